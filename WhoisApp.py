@@ -3,14 +3,16 @@ from streamlit_option_menu import option_menu
 import pandas as pd
 import requests
 import time
-from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 import socket
 import struct
 import ipaddress
 from urllib.parse import quote
 import math
 import random
+import functools
 import altair as alt 
+import numpy as np
 alt.data_transformers.disable_max_rows() # 5000行以上の大容量データセットの描画を許可する
 import json 
 import io 
@@ -25,6 +27,14 @@ import tempfile
 import os
 import bisect
 import uuid
+import hashlib
+import queue
+import threading
+from collections import Counter, OrderedDict
+import gzip
+import zlib
+import shutil
+import pyarrow as pa
 
 # ==========================================
 #  [Local User Config] API Key Hardcoding
@@ -36,35 +46,99 @@ HARDCODED_VPNAPI_KEY = ""
 HARDCODED_SECURITYTRAILS_KEY = ""
 # ==========================================
 
+BACKUP_JOURNAL_FILE = "whois_recovery_journal.jsonl"
+# 旧形式 (全件JSONの上書き保存) のバックアップ。復元と削除にのみ使用する
 BACKUP_FILE = "whois_recovery_session.json"
 BACKUP_DETAILS_FILE = "whois_recovery_details.json"
+# 追記レコードがこの件数に達したら、ジャーナルを1件のスナップショットに書き直す (コンパクション)
+JOURNAL_COMPACT_RECORDS = 360
+
+def get_journal_cursor():
+    """ ジャーナルへ書き出し済みの範囲 (次回のチェックポイントではこれ以降の差分のみを追記する) """
+    if 'recovery_journal' not in st.session_state:
+        st.session_state['recovery_journal'] = {'results': 0, 'finished': set(), 'cache': {}, 'static_sig': None, 'state_line': None, 'records': 0}
+    return st.session_state['recovery_journal']
+
+def journal_cache_entries(entries):
+    """ CIDRキャッシュの新規・更新エントリを次回チェックポイントの追記対象に積む """
+    get_journal_cursor()['cache'].update(entries)
+
+def static_state_signature():
+    """ 検索開始時に確定する入力系の状態が差し替えられたかを判定するための軽量な署名 """
+    ss = st.session_state
+    return (id(ss.targets_cache), len(ss.targets_cache), id(ss.target_freq_map), len(ss.target_freq_map),
+            id(ss.resolved_dns_map), len(ss.resolved_dns_map), ss.detailed_data.directory)
+
+def triage_state_for_journal():
+    """ 2段階トリアージの段階をJSONで書き出せる形にする (1段階目の途中で中断しても、復元後に2段階目へ進めるようにする) """
+    triage = st.session_state.get('triage')
+    if not triage:
+        return None
+    return {'phase': triage['phase'], 'targets': sorted(triage['targets'])}
+
+def write_journal_snapshot(cursor):
+    """ 全状態を1件のスナップショットとして書き出し、ジャーナルを置き換える """
+    ss = st.session_state
+    record = {
+        'type': 'snapshot',
+        'raw_results': list(ss.raw_results),
+        'detail_refs': ss.detailed_data.to_state(),
+        'targets_cache': ss.targets_cache,
+        'deferred_ips': ss.deferred_ips,
+        'finished_ips': list(ss.finished_ips),
+        'target_freq_map': ss.target_freq_map,
+        'cidr_cache': ss.cidr_cache,
+        'learned_proxy_isps': ss.learned_proxy_isps,
+        'resolved_dns_map': ss.resolved_dns_map,
+        'triage': triage_state_for_journal(),
+    }
+    # 一時ファイルに完全に書き込んでからリネーム(アトミック書き込み)し、クラッシュ時のデータ破損を防ぐ
+    tmp_journal = BACKUP_JOURNAL_FILE + ".tmp"
+    with open(tmp_journal, "w", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_journal, BACKUP_JOURNAL_FILE)
+    cursor.update(results=len(ss.raw_results), finished=set(ss.finished_ips), cache={}, static_sig=static_state_signature(), state_line=None, records=1)
 
 def save_recovery_data():
-    """ 検索進捗と詳細データをローカルに退避させる """
+    """ 前回のチェックポイント以降に増えた結果・キャッシュだけをジャーナルへ追記する """
     if IS_PUBLIC_MODE: return # パブリック環境ではストレージ保護のため無効化
+    ss = st.session_state
+    cursor = get_journal_cursor()
     try:
-        session_data = {
-            'raw_results': st.session_state.raw_results,
-            'targets_cache': st.session_state.targets_cache,
-            'deferred_ips': st.session_state.deferred_ips,
-            'finished_ips': list(st.session_state.finished_ips),
-            'target_freq_map': st.session_state.target_freq_map,
-            'cidr_cache': st.session_state.cidr_cache,
-            'learned_proxy_isps': st.session_state.learned_proxy_isps,
-            'resolved_dns_map': st.session_state.resolved_dns_map,
-        }
-        
-        # 一時ファイルに完全に書き込んでからリネーム(アトミック書き込み)し、クラッシュ時のデータ破損を防ぐ
-        tmp_session = BACKUP_FILE + ".tmp"
-        tmp_details = BACKUP_DETAILS_FILE + ".tmp"
-        
-        with open(tmp_session, "w", encoding="utf-8") as f:
-            json.dump(session_data, f, ensure_ascii=False)
-        with open(tmp_details, "w", encoding="utf-8") as f:
-            json.dump(st.session_state.detailed_data, f, ensure_ascii=False)
-            
-        os.replace(tmp_session, BACKUP_FILE)
-        os.replace(tmp_details, BACKUP_DETAILS_FILE)
+        if cursor['records'] == 0 or cursor['records'] >= JOURNAL_COMPACT_RECORDS or not os.path.exists(BACKUP_JOURNAL_FILE):
+            write_journal_snapshot(cursor)
+            return
+
+        records = []
+        new_rows = ss.raw_results[cursor['results']:]
+        if new_rows:
+            refs = ss.detailed_data.refs
+            records.append({'type': 'results', 'rows': new_rows, 'refs': {r['Target_IP']: refs[r['Target_IP']] for r in new_rows if r['Target_IP'] in refs}})
+        new_finished = ss.finished_ips - cursor['finished'] if len(ss.finished_ips) != len(cursor['finished']) else set()
+        if new_finished:
+            records.append({'type': 'finished', 'targets': list(new_finished)})
+        if cursor['cache']:
+            records.append({'type': 'cache', 'entries': cursor['cache']})
+        static_sig = static_state_signature()
+        if static_sig != cursor['static_sig']:
+            records.append({'type': 'static', 'targets_cache': ss.targets_cache, 'target_freq_map': ss.target_freq_map, 'resolved_dns_map': ss.resolved_dns_map, 'detail_directory': ss.detailed_data.directory})
+        # 保留中リスト・学習済みISP・トリアージの段階は小さいため、変化があった時のみ全体を記録する
+        state_line = json.dumps({'type': 'state', 'deferred_ips': ss.deferred_ips, 'learned_proxy_isps': ss.learned_proxy_isps, 'triage': triage_state_for_journal()}, ensure_ascii=False)
+        lines = [json.dumps(r, ensure_ascii=False) for r in records]
+        if state_line != cursor['state_line']:
+            lines.append(state_line)
+        if not lines:
+            return
+
+        try:
+            with open(BACKUP_JOURNAL_FILE, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError:
+            # 追記が途中で失敗した可能性があるため、次回は全体を書き直す
+            cursor['records'] = 0
+            raise
+        cursor.update(results=len(ss.raw_results), cache={}, static_sig=static_sig, state_line=state_line, records=cursor['records'] + len(lines))
+        cursor['finished'] |= new_finished
     except TypeError as e:
         import logging
         logging.error(f"[Recovery Save Error] JSONシリアライズ失敗: {e}")
@@ -72,29 +146,89 @@ def save_recovery_data():
         import logging
         logging.error(f"[Recovery Save Error] ファイル保存/置換失敗: {e}")
 
+def replay_recovery_journal():
+    """ ジャーナルを先頭から順に適用して状態を組み立てる (書き込み途中で途切れた行は読み飛ばす) """
+    state = {'raw_results': ResultStore(), 'detail_refs': {'directory': None, 'refs': {}}, 'finished_ips': set(), 'cidr_cache': {}}
+    records = 0
+    is_torn = False
+    with open(BACKUP_JOURNAL_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                is_torn = True
+                continue
+            records += 1
+            kind = record.pop('type', None)
+            if kind == 'snapshot':
+                record['raw_results'] = ResultStore(record['raw_results'])
+                record['finished_ips'] = set(record['finished_ips'])
+                state.update(record)
+            elif kind == 'results':
+                state['raw_results'].extend(record['rows'])
+                state['detail_refs']['refs'].update(record['refs'])
+            elif kind == 'finished':
+                state['finished_ips'].update(record['targets'])
+            elif kind == 'cache':
+                state['cidr_cache'].update(record['entries'])
+            elif kind == 'static':
+                state['detail_refs']['directory'] = record.pop('detail_directory')
+                state.update(record)
+            elif kind == 'state':
+                state.update(record)
+    # 途切れた行の後ろに追記すると次の行まで壊れるため、その場合は次回のチェックポイントで全体を書き直させる
+    return state, 0 if is_torn else records
+
+def read_legacy_recovery_files():
+    """ 旧形式 (全件JSON 2ファイル) のバックアップを読み込む """
+    with open(BACKUP_FILE, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    with open(BACKUP_DETAILS_FILE, "r", encoding="utf-8") as f:
+        state['detail_refs'] = json.load(f)
+    state['raw_results'] = ResultStore(state['raw_results'])
+    state['finished_ips'] = set(state['finished_ips'])
+    return state
+
+def recovery_data_exists():
+    """ 復元可能なバックアップ (ジャーナル または 旧形式) が存在するか """
+    return os.path.exists(BACKUP_JOURNAL_FILE) or (os.path.exists(BACKUP_FILE) and os.path.exists(BACKUP_DETAILS_FILE))
+
 def load_recovery_data():
     """ 中断されたデータを復元し、再開フラグを立てる """
     if IS_PUBLIC_MODE: return False
     try:
-        if os.path.exists(BACKUP_FILE) and os.path.exists(BACKUP_DETAILS_FILE):
-            with open(BACKUP_FILE, "r", encoding="utf-8") as f:
-                session_data = json.load(f)
-            with open(BACKUP_DETAILS_FILE, "r", encoding="utf-8") as f:
-                detailed_data = json.load(f)
-                
-            st.session_state.raw_results = session_data['raw_results']
-            st.session_state.targets_cache = session_data['targets_cache']
-            st.session_state.deferred_ips = session_data['deferred_ips']
-            st.session_state.finished_ips = set(session_data['finished_ips'])
-            st.session_state.target_freq_map = session_data['target_freq_map']
-            st.session_state.cidr_cache = session_data['cidr_cache']
-            st.session_state.learned_proxy_isps = session_data['learned_proxy_isps']
-            st.session_state.resolved_dns_map = session_data['resolved_dns_map']
-            st.session_state.detailed_data = detailed_data
-            
-            st.session_state.is_searching = True
-            st.session_state.cancel_search = False
-            return True
+        if os.path.exists(BACKUP_JOURNAL_FILE):
+            state, records = replay_recovery_journal()
+        elif recovery_data_exists():
+            state, records = read_legacy_recovery_files(), 0 # 初回チェックポイントでジャーナル形式へ書き直させる
+        else:
+            return False
+
+        st.session_state.raw_results = state['raw_results']
+        st.session_state.targets_cache = state['targets_cache']
+        st.session_state.deferred_ips = state['deferred_ips']
+        st.session_state.finished_ips = state['finished_ips']
+        st.session_state.target_freq_map = state['target_freq_map']
+        st.session_state.cidr_cache = state['cidr_cache']
+        st.session_state.learned_proxy_isps = state['learned_proxy_isps']
+        st.session_state.resolved_dns_map = state['resolved_dns_map']
+        st.session_state.detailed_data = DetailStore.from_state(state['detail_refs'])
+        triage = state.get('triage')
+        if triage:
+            st.session_state['triage'] = {'phase': triage['phase'], 'targets': set(triage['targets'])}
+        else:
+            st.session_state.pop('triage', None)
+        # 進捗カウンターは復元した完了済みリストから数え直させる
+        st.session_state.pop('search_progress', None)
+        # 復元した時点までは書き出し済みとして扱い、以降は差分のみを同じジャーナルへ追記する
+        st.session_state['recovery_journal'] = {
+            'results': len(st.session_state.raw_results), 'finished': set(st.session_state.finished_ips), 'cache': {},
+            'static_sig': static_state_signature(), 'state_line': None, 'records': records
+        }
+        
+        st.session_state.is_searching = True
+        st.session_state.cancel_search = False
+        return True
     except Exception:
         pass
     return False
@@ -102,9 +236,10 @@ def load_recovery_data():
 def clear_recovery_data():
     """ 正常終了時や新規検索時にバックアップを破棄する """
     if IS_PUBLIC_MODE: return
+    st.session_state.pop('recovery_journal', None)
     try:
-        if os.path.exists(BACKUP_FILE): os.remove(BACKUP_FILE)
-        if os.path.exists(BACKUP_DETAILS_FILE): os.remove(BACKUP_DETAILS_FILE)
+        for path in (BACKUP_JOURNAL_FILE, BACKUP_FILE, BACKUP_DETAILS_FILE):
+            if os.path.exists(path): os.remove(path)
     except OSError as e:
         import logging
         logging.warning(f"バックアップファイルの削除に失敗しました: {e}")
@@ -212,6 +347,17 @@ MODE_SETTINGS = {
         "DELAY_BETWEEN_REQUESTS": 1.4 
     }
 }
+# 並列スレッド数の上限 (カスタム設定で選択できる最大値)
+MAX_WORKERS_LIMIT = 5
+# 1ターゲット内の補助照会 (VPN判定・RDAP・WHOIS・逆引き等) を並行実行する専用プールのスレッド数
+# 各段階は別プロバイダーへの通信のため、プロバイダー単位の同時接続数は本体のワーカー数を超えない
+ENRICHMENT_STAGE_WORKERS = 16
+# InternetDB専用の同時接続数 (本体のワーカー数とは独立させ、Shodan側の制限に合わせて絞る)
+INTERNETDB_CONCURRENCY = 3
+# SecurityTrailsへの同時接続数 (契約プランの制限に合わせて調整する)
+SECURITYTRAILS_CONCURRENCY = 4
+# 共有セッションを使う全スレッドプールの合計。ホスト単位の接続プールをこの大きさにして、溢れた接続が破棄されないようにする
+HTTP_POOL_MAXSIZE = MAX_WORKERS_LIMIT + ENRICHMENT_STAGE_WORKERS + INTERNETDB_CONCURRENCY + SECURITYTRAILS_CONCURRENCY
 IP_API_URL = "http://ip-api.com/json/{ip}?fields=status,country,countryCode,isp,org,query,message"
 IPINFO_API_URL = "https://ipinfo.io/{ip}" 
 VPNAPI_URL = "https://vpnapi.io/api/{ip}?key={key}"
@@ -431,25 +577,218 @@ def normalize_isp_key(text):
 
 ISP_JP_NAME_NORMALIZED = {normalize_isp_key(k): v for k, v in ISP_JP_NAME.items()}
 
+# 名寄せルールのキーワードを1本の正規表現にまとめて事前コンパイルする
+# 先読み(?=...)で全位置を走査し、一致したキーワードのうちルール順で最も優先度の高いものを採用する
+# 単語の境界(\b)を判定し、edionの中のdion等、意図しない部分文字列へのマッチを排除する
+ISP_REMAP_PRIORITY = {keyword: i for i, (keyword, _) in reversed(list(enumerate(ISP_REMAP_RULES)))}
+ISP_REMAP_PATTERN = re.compile(r'(?=\b(' + '|'.join(re.escape(keyword) for keyword, _ in ISP_REMAP_RULES) + r')\b)')
+# ISP名 → 日本語名 の変換結果を保持する件数 (同じISPが大量に出現するため、2回目以降は辞書参照のみで済ませる)
+ISP_JP_CACHE_SIZE = 65536
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 接続プールを保持するホスト (プロバイダー) 数の上限
+HTTP_POOL_HOSTS = 32
+# ネットワーク瞬断に対応するための自動リトライ機能 (3回, バックオフ)。全プロバイダーで同じポリシーを共有する
+HTTP_RETRY_POLICY = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
+
+@st.cache_resource
+def get_session():
+    session = requests.Session()
+    session.headers.update({"User-Agent": "WhoisBatchTool/2.4 (+RDAP)"})
+    
+    # 接続プールはホスト単位で保持し、全スレッドプール合計分の接続をKeep-Aliveで使い回す (照会ごとのTLSハンドシェイクを省く)
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=HTTP_RETRY_POLICY)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    
+    return session
+
+session = get_session()
+
 # --- 匿名化・プロキシ判定用データ ---
+# 外部フィード (Tor・クラウドレンジ・捨てアド) の生データを保存するディレクトリ
+FEED_CACHE_DIR = "whois_feed_cache"
+# 取得に失敗した場合に再試行するまでの間隔 (秒)
+FEED_RETRY_INTERVAL = 300
 
-@st.cache_data(ttl=86400, show_spinner=False, max_entries=10)
-def fetch_tor_exit_nodes():
-    try:
-        url = "https://check.torproject.org/exit-addresses"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return set([line.split()[1] for line in response.text.splitlines() if line.startswith("ExitAddress")])
-    except requests.exceptions.RequestException as e:
-        import logging
-        logging.warning(f"Tor出口ノードリストの取得に失敗しました: {e}")
-        return set()
+class FeedManager:
+    """
+    外部フィードの生データを検証子 (ETag / Last-Modified) 付きでディスクに保存し、条件付きGETで更新を確認する。
+    解析済みのスナップショットは再検証間隔を過ぎていても即座に返し、更新は裏のスレッドで行う (stale-while-revalidate)。
+    """
 
-@st.cache_data(ttl=86400*3, show_spinner=False)
-def fetch_cloud_ip_ranges():
-    """ 主要クラウドプロバイダの公式IPレンジ(JSON)を動的に取得し、二分探索用に最適化する """
+    def __init__(self, feeds, directory=None):
+        self.feeds = feeds         # フィード名 -> (解析関数, 再検証間隔)。解析関数は fetch(url, timeout) を受け取り、取得できない場合は None を返す
+        self.directory = directory # None の場合はディスクを使わずメモリ上にのみ保持する
+        self._lock = threading.Lock()
+        self._raw = {}             # URL -> {'etag', 'last_modified', 'body'}
+        self._snapshots = {}       # フィード名 -> {'data', 'fetched_at', 'version'}
+        self._refreshing = set()
+        self._meta = self._load_meta() # フィード名 -> {'fetched_at', 'urls'}
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _raw_path(self, url):
+        return self._path(hashlib.sha256(url.encode('utf-8')).hexdigest()[:32] + ".json")
+
+    def _write_json(self, path, value):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def _load_meta(self):
+        if not self.directory:
+            return {}
+        try:
+            with open(self._path("feeds.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load_raw(self, url):
+        entry = self._raw.get(url)
+        if entry is None and self.directory:
+            try:
+                with open(self._raw_path(url), "r", encoding="utf-8") as f:
+                    entry = self._raw[url] = json.load(f)
+            except (OSError, ValueError):
+                entry = None
+        return entry
+
+    def _fetch_text(self, url, timeout, revalidate, trace):
+        """ URLの本文を返す。revalidate=False の場合は保存済みの本文のみを返し、通信しない """
+        trace['urls'].append(url)
+        entry = self._load_raw(url)
+        if not revalidate:
+            return entry['body'] if entry else None
+
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            response = session.get(url, headers=headers, timeout=timeout)
+            if response.status_code == 304 and entry:
+                return entry['body']
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            import logging
+            logging.warning(f"外部フィードの取得に失敗したため、前回取得したデータを使用します ({url}): {e}")
+            trace['failed'] = True
+            return entry['body'] if entry else None
+
+        trace['changed'] = True
+        entry = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'), 'body': response.text}
+        self._raw[url] = entry
+        if self.directory:
+            self._write_json(self._raw_path(url), entry)
+        return entry['body']
+
+    def _build(self, name, revalidate):
+        parse, _ = self.feeds[name]
+        trace = {'urls': [], 'changed': False, 'failed': False}
+        data = parse(lambda url, timeout=10: self._fetch_text(url, timeout, revalidate, trace))
+        return data, trace
+
+    def _retry_at(self, name):
+        """ FEED_RETRY_INTERVAL 後に再検証されるよう、取得時刻を過去にずらした値を返す """
+        return time.time() - self.feeds[name][1] + FEED_RETRY_INTERVAL
+
+    def _fresh_until(self, name, trace):
+        """ 取得時刻として記録する値 (一部の取得元でも失敗していれば、再検証間隔を待たずに再試行する) """
+        return self._retry_at(name) if trace['failed'] else time.time()
+
+    def _set_snapshot(self, name, data, fetched_at, urls=None):
+        """ スナップショットを差し替える (ロック取得済みの状態で呼び出す) """
+        previous = self._snapshots.get(name)
+        self._snapshots[name] = {'data': data, 'fetched_at': fetched_at, 'version': (previous['version'] + 1) if previous else 0}
+        if urls is None or not self.directory:
+            return
+        # Azureのように取得元URLが更新ごとに変わるフィードもあるため、今回使わなかった生データは削除する
+        for old_url in set(self._meta.get(name, {}).get('urls', [])) - set(urls):
+            self._raw.pop(old_url, None)
+            try:
+                os.remove(self._raw_path(old_url))
+            except OSError:
+                pass
+        self._meta[name] = {'fetched_at': fetched_at, 'urls': urls}
+        self._write_json(self._path("feeds.json"), self._meta)
+
+    def _snapshot(self, name):
+        with self._lock:
+            snapshot = self._snapshots.get(name)
+        if snapshot is not None:
+            return snapshot
+        # プロセス起動直後は、保存済みの生データから通信なしでスナップショットを組み立てる
+        data, _ = self._build(name, revalidate=False)
+        fetched_at = self._meta.get(name, {}).get('fetched_at', 0)
+        urls = None
+        if data is None:
+            # 保存済みデータがない初回のみ、この場で取得する
+            data, trace = self._build(name, revalidate=True)
+            fetched_at = self._fresh_until(name, trace) if data is not None else self._retry_at(name)
+            urls = trace['urls'] if data is not None else None
+        with self._lock:
+            if name not in self._snapshots:
+                self._set_snapshot(name, data, fetched_at, urls)
+            return self._snapshots[name]
+
+    def _refresh(self, name):
+        try:
+            data, trace = self._build(name, revalidate=True)
+            with self._lock:
+                snapshot = self._snapshots[name]
+                fetched_at = self._fresh_until(name, trace)
+                if data is None:
+                    # 取得に失敗した場合は最後に取得できたデータを使い続け、少し時間をおいて再試行する
+                    snapshot['fetched_at'] = fetched_at
+                elif trace['changed'] or snapshot['data'] is None:
+                    self._set_snapshot(name, data, fetched_at, trace['urls'])
+                else:
+                    # すべて 304 (未更新) の場合は解析結果を差し替えず、鮮度のみ更新する
+                    snapshot['fetched_at'] = fetched_at
+                    if self.directory:
+                        self._meta[name] = {'fetched_at': fetched_at, 'urls': trace['urls']}
+                        self._write_json(self._path("feeds.json"), self._meta)
+        finally:
+            with self._lock:
+                self._refreshing.discard(name)
+
+    def get(self, name):
+        """ フィードの解析済みデータを返す (取得できていない場合は None)。再検証間隔を過ぎている場合は裏で更新を開始する """
+        snapshot = self._snapshot(name)
+        if time.time() - snapshot['fetched_at'] >= self.feeds[name][1]:
+            with self._lock:
+                is_started = name in self._refreshing
+                self._refreshing.add(name)
+            if not is_started:
+                threading.Thread(target=self._refresh, args=(name,), daemon=True).start()
+        return snapshot['data']
+
+    def version(self, name):
+        """ スナップショットの世代番号 (データが差し替わるたびに増える) """
+        return self._snapshot(name)['version']
+
+def parse_tor_exit_nodes(fetch):
+    body = fetch("https://check.torproject.org/exit-addresses")
+    if body is None:
+        return None
+    return set([line.split()[1] for line in body.splitlines() if line.startswith("ExitAddress")])
+
+def parse_cloud_ip_ranges(fetch):
+    """ 主要クラウドプロバイダの公式IPレンジ(JSON)を解析し、二分探索用に最適化する """
     cloud_ranges_v4 = []
     cloud_ranges_v6 = []
+    has_source = False
 
     def add_range(cidr_str, provider):
         try:
@@ -463,60 +802,91 @@ def fetch_cloud_ip_ranges():
 
     # 1. AWS (Amazon Web Services)
     try:
-        r = requests.get("https://ip-ranges.amazonaws.com/ip-ranges.json", timeout=10)
-        if r.status_code == 200:
-            data = r.json()
+        body = fetch("https://ip-ranges.amazonaws.com/ip-ranges.json")
+        if body is not None:
+            data = json.loads(body)
             for prefix in data.get("prefixes", []): add_range(prefix.get("ip_prefix"), "AWS")
             for prefix in data.get("ipv6_prefixes", []): add_range(prefix.get("ipv6_prefix"), "AWS")
+            has_source = True
     except: pass
 
     # 2. GCP (Google Cloud Platform)
     try:
-        r = requests.get("https://www.gstatic.com/ipranges/cloud.json", timeout=10)
-        if r.status_code == 200:
-            data = r.json()
+        body = fetch("https://www.gstatic.com/ipranges/cloud.json")
+        if body is not None:
+            data = json.loads(body)
             for prefix in data.get("prefixes", []):
                 if "ipv4Prefix" in prefix: add_range(prefix["ipv4Prefix"], "GCP")
                 if "ipv6Prefix" in prefix: add_range(prefix["ipv6Prefix"], "GCP")
+            has_source = True
     except: pass
 
     # 3. Azure (Microsoft Download Centerをスクレイピングして動的URLを取得)
     try:
-        dl_page = requests.get("https://www.microsoft.com/en-us/download/confirmation.aspx?id=56519", timeout=10)
-        match = re.search(r'href="(https://download\.microsoft\.com/download/.*?/ServiceTags_Public_.*?\.json)"', dl_page.text)
+        dl_page = fetch("https://www.microsoft.com/en-us/download/confirmation.aspx?id=56519")
+        match = re.search(r'href="(https://download\.microsoft\.com/download/.*?/ServiceTags_Public_.*?\.json)"', dl_page or "")
         if match:
-            azure_url = match.group(1)
-            r = requests.get(azure_url, timeout=15)
-            if r.status_code == 200:
-                data = r.json()
+            body = fetch(match.group(1), timeout=15)
+            if body is not None:
+                data = json.loads(body)
                 for val in data.get("values", []):
                     for prefix in val.get("properties", {}).get("addressPrefixes", []):
                         add_range(prefix, "Azure")
+                has_source = True
     except: pass
 
     # 4. Cloudflare (Reverse Proxy / WAF)
     try:
-        r_v4 = requests.get("https://www.cloudflare.com/ips-v4", timeout=5)
-        if r_v4.status_code == 200:
-            for line in r_v4.text.splitlines(): add_range(line.strip(), "Cloudflare")
-        r_v6 = requests.get("https://www.cloudflare.com/ips-v6", timeout=5)
-        if r_v6.status_code == 200:
-            for line in r_v6.text.splitlines(): add_range(line.strip(), "Cloudflare")
+        for url in ("https://www.cloudflare.com/ips-v4", "https://www.cloudflare.com/ips-v6"):
+            body = fetch(url, timeout=5)
+            if body is not None:
+                for line in body.splitlines(): add_range(line.strip(), "Cloudflare")
+                has_source = True
     except: pass
 
+    if not has_source:
+        return None
+
     # 二分探索(O(log N))できるように開始IPの整数値でソート
     cloud_ranges_v4.sort(key=lambda x: x[0])
     cloud_ranges_v6.sort(key=lambda x: x[0])
 
     return {"v4": cloud_ranges_v4, "v6": cloud_ranges_v6}
 
+def parse_disposable_domains(fetch):
+    """ GitHubの有名リポジトリの捨てアドドメイン一覧を解析する """
+    body = fetch("https://raw.githubusercontent.com/disposable-email-domains/disposable-email-domains/master/disposable_email_blocklist.conf")
+    if body is None:
+        return None
+    # 空行とコメントを除外し、小文字でセット（集合）に格納して高速化
+    return set([line.strip().lower() for line in body.splitlines() if line.strip() and not line.startswith('//')])
+
+# フィード名 -> (解析関数, 再検証間隔 (秒))
+FEEDS = {
+    'tor': (parse_tor_exit_nodes, 86400),
+    'cloud': (parse_cloud_ip_ranges, 86400 * 3),
+    'disposable': (parse_disposable_domains, 86400),
+}
+
+@st.cache_resource
+def get_feed_manager():
+    """ 公開モードではメモリ上のみ、ローカルモードではディスクに生データを保存するフィード管理を作る """
+    return FeedManager(FEEDS, None if IS_PUBLIC_MODE else FEED_CACHE_DIR)
+
+def fetch_tor_exit_nodes():
+    return get_feed_manager().get('tor') or set()
+
+def fetch_cloud_ip_ranges():
+    return get_feed_manager().get('cloud') or {"v4": [], "v6": []}
+
 def check_cloud_provider(ip_str, cloud_data):
     """ IPアドレスがクラウド事業者の公式リストに含まれているかを超高速で判定する """
     if not cloud_data: return None
     try:
-        ip_obj = ipaddress.ip_address(ip_str)
-        ip_int = int(ip_obj)
-        target_list = cloud_data["v4"] if ip_obj.version == 4 else cloud_data["v6"]
+        parsed = parse_target(ip_str)
+        if not parsed.is_ip: return None
+        ip_int = parsed.int_value
+        target_list = cloud_data["v4"] if parsed.version == 4 else cloud_data["v6"]
 
         # 二分探索で「開始IPが探しているIP以下の最大のインデックス」を見つける
         keys = [r[0] for r in target_list]
@@ -530,21 +900,8 @@ def check_cloud_provider(ip_str, cloud_data):
         pass
     return None
 
-@st.cache_data(ttl=86400, show_spinner=False, max_entries=10)
 def fetch_disposable_domains():
-    """ GitHubの有名リポジトリから最新の捨てアドドメイン一覧を取得 (1日1回更新) """
-    try:
-        url = "https://raw.githubusercontent.com/disposable-email-domains/disposable-email-domains/master/disposable_email_blocklist.conf"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        if response.status_code == 200:
-            # 空行とコメントを除外し、小文字でセット（集合）に格納して高速化
-            return set([line.strip().lower() for line in response.text.splitlines() if line.strip() and not line.startswith('//')])
-    except requests.exceptions.RequestException as e:
-        import logging
-        logging.warning(f"使い捨てドメインリストの取得に失敗しました: {e}")
-    return set()
-
+    return get_feed_manager().get('disposable') or set()
 
 
 # --- 捨てアド (Disposable Email) 検知用グローバル辞書 ---
@@ -588,39 +945,106 @@ DISPOSABLE_DOMAIN_SERVICES = {
     'yopmail.com': 'YOPmail'
 }
 
-def check_disposable_domain(domain, nslookup_raw):
+# nslookup出力からMXレコードのホスト名を抜き出すパターン
+MX_RECORD_PATTERN = re.compile(r'\bin\s+mx\s+\d+\s+(\S+)')
+
+class DisposableMatcher:
+    """ 捨てアド判定用の照合器。既知サービスのパターンは1本の正規表現に、外部DBのドメインはラベルを逆順にたどるサフィックス木にまとめる """
+
+    def __init__(self, blocklist):
+        # MX辞書 → ドメイン辞書 の並びが、検出結果に並べるサービス名の順序になる
+        self.services = list(DISPOSABLE_MX_SERVICES.items()) + list(DISPOSABLE_DOMAIN_SERVICES.items())
+        ids_by_pattern = {}
+        for service_id, (pattern, _) in enumerate(self.services):
+            ids_by_pattern.setdefault(pattern, []).append(service_id)
+        # 同じ位置から始まるパターンは最長のものしか捕捉されないため、その接頭辞にあたるパターンも併せて引けるようにする
+        self.ids_by_match = {
+            pattern: sorted(i for other, ids in ids_by_pattern.items() if pattern.startswith(other) for i in ids)
+            for pattern in ids_by_pattern
+        }
+        # 先読み(?=...)で全位置を走査し、重なり合う一致も取りこぼさない (長いパターンを先に試す)
+        alternation = '|'.join(re.escape(p) for p in sorted(ids_by_pattern, key=len, reverse=True))
+        self.service_pattern = re.compile(f'(?=({alternation}))')
+
+        # 外部DBのドメインは TLD 側からラベルをたどる木に格納する (True は子を持たない終端、キー None は途中の終端)
+        self.suffix_tree = {}
+        for domain in blocklist:
+            self._add_suffix(domain)
+
+    def _add_suffix(self, domain):
+        labels = domain.split('.')[::-1]
+        node = self.suffix_tree
+        for label in labels[:-1]:
+            child = node.get(label)
+            if not isinstance(child, dict):
+                child = node[label] = {None: True} if child else {}
+            node = child
+        child = node.get(labels[-1])
+        if isinstance(child, dict):
+            child[None] = True
+        else:
+            node[labels[-1]] = True
+
+    def match_services(self, target):
+        """ 文字列中に含まれる既知サービスのパターンを、辞書の定義順のIDで返す """
+        return sorted({i for m in self.service_pattern.finditer(target) for i in self.ids_by_match[m.group(1)]})
+
+    def find_blocklisted_suffix(self, target):
+        """ 外部DBに載っている最長のサフィックス (2ラベル以上) を返す """
+        labels = target.split('.')
+        node = self.suffix_tree
+        hit_depth = 0
+        for depth, label in enumerate(reversed(labels), 1):
+            child = node.get(label)
+            if child is None:
+                break
+            if child is True:
+                hit_depth = depth
+                break
+            if child.get(None):
+                hit_depth = depth
+            node = child
+        if hit_depth >= 2:
+            return '.'.join(labels[-hit_depth:])
+        return None
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def build_disposable_matcher(feed_version):
+    """ 捨てアド照合器を構築する (外部リストの世代ごとに1回だけ作る) """
+    return DisposableMatcher(fetch_disposable_domains())
+
+def get_disposable_matcher():
+    """ 外部リストが実際に更新された (304以外で再取得された) 場合のみ照合器を作り直す """
+    return build_disposable_matcher(get_feed_manager().version('disposable'))
+
+def check_disposable_domain(domain, nslookup_raw="", dns_records=None):
     """ MXレコードやドメイン名から捨てアドサービスを検知し、特定されたサービス名のリストを返す """
-    dynamic_disposable_list = fetch_disposable_domains()
+    matcher = get_disposable_matcher()
     detected_services = []
-    raw_lower = nslookup_raw.lower() if nslookup_raw else ""
     query_domain_lower = domain.lower()
     
-    import re
-    mx_targets = re.findall(r'\bin\s+mx\s+\d+\s+(\S+)', raw_lower)
-    targets_to_check = mx_targets + [query_domain_lower]
+    if dns_records is not None:
+        mx_targets = [mx['exchange'].lower() for mx in dns_records.get('MX', [])]
+    else:
+        # 種別ごとのレコードを持たない旧形式のデータは、生出力からMXホストを抜き出す
+        mx_targets = MX_RECORD_PATTERN.findall(nslookup_raw.lower() if nslookup_raw else "")
+    targets_to_check = [t.strip('.') for t in mx_targets + [query_domain_lower]]
     
     # 1. 既知の辞書を使った特定
     for target in targets_to_check:
-        target = target.strip('.')
-        for pattern, service_name in DISPOSABLE_MX_SERVICES.items():
-            if pattern in target and service_name not in detected_services:
-                detected_services.append(service_name)
-        for pattern, service_name in DISPOSABLE_DOMAIN_SERVICES.items():
-            if pattern in target and service_name not in detected_services:
+        for service_id in matcher.match_services(target):
+            service_name = matcher.services[service_id][1]
+            if service_name not in detected_services:
                 detected_services.append(service_name)
                 
     # 2. 外部DB（GitHubリスト）による特定不可ドメインの捕捉
-    if not detected_services and dynamic_disposable_list:
+    if not detected_services:
         for target in targets_to_check:
-            target = target.strip('.')
-            parts = target.split('.')
-            for i in range(len(parts) - 1): 
-                domain_to_check = '.'.join(parts[i:])
-                if domain_to_check in dynamic_disposable_list:
-                    label = f"外部DB検知 ({domain_to_check} / サービス名特定不可)"
-                    if label not in detected_services:
-                        detected_services.append(label)
-                    break 
+            domain_to_check = matcher.find_blocklisted_suffix(target)
+            if domain_to_check:
+                label = f"外部DB検知 ({domain_to_check} / サービス名特定不可)"
+                if label not in detected_services:
+                    detected_services.append(label)
     return detected_services   
 
 def get_jp_names(english_isp, country_code):
@@ -629,40 +1053,22 @@ def get_jp_names(english_isp, country_code):
     if not english_isp:
         return "N/A", jp_country
 
-    normalized_input = normalize_isp_key(english_isp)
-    jp_isp = english_isp 
+    return lookup_isp_jp_name(english_isp), jp_country
 
+@functools.lru_cache(maxsize=ISP_JP_CACHE_SIZE)
+def lookup_isp_jp_name(english_isp):
+    """ ISP名を日本語名へ変換する (完全一致 → 正規化一致 → 名寄せルールの順) """
     if english_isp in ISP_JP_NAME:
-        jp_isp = ISP_JP_NAME[english_isp]
-    elif normalized_input in ISP_JP_NAME_NORMALIZED:
-        jp_isp = ISP_JP_NAME_NORMALIZED[normalized_input]
-    else:
-        for keyword, mapped_name in ISP_REMAP_RULES:
-            # 単語の境界(\b)を判定し、edionの中のdion等、意図しない部分文字列へのマッチを排除する
-            if re.search(rf'\b{re.escape(keyword)}\b', normalized_input):
-                jp_isp = mapped_name
-                break
-        
-    jp_country = COUNTRY_JP_NAME.get(country_code, country_code)
-    return jp_isp, jp_country
+        return ISP_JP_NAME[english_isp]
 
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-
-@st.cache_resource
-def get_session():
-    session = requests.Session()
-    session.headers.update({"User-Agent": "WhoisBatchTool/2.4 (+RDAP)"})
-    
-    # ネットワーク瞬断に対応するための自動リトライ機能 (3回, バックオフ)
-    retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-    adapter = HTTPAdapter(max_retries=retries)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    
-    return session
+    normalized_input = normalize_isp_key(english_isp)
+    if normalized_input in ISP_JP_NAME_NORMALIZED:
+        return ISP_JP_NAME_NORMALIZED[normalized_input]
 
-session = get_session()
+    matched = [ISP_REMAP_PRIORITY[m.group(1)] for m in ISP_REMAP_PATTERN.finditer(normalized_input)]
+    if matched:
+        return ISP_REMAP_RULES[min(matched)][1]
+    return english_isp
 
 @st.cache_data(max_entries=10)
 def get_world_map_data():
@@ -676,18 +1082,134 @@ WORLD_MAP_GEOJSON = get_world_map_data()
 
 # --- ヘルパー関数群 ---
 
-def extract_actual_ip(target):
-    """ 'ドメイン (IP)' の形式からIPアドレスだけを抽出する関数 """
-    if not isinstance(target, str): return target
-    if "(" in target and ")" in target:
-        possible_ip = target.split("(")[-1].replace(")", "").strip()
+def parse_ip_range(text):
+    """ CIDR表記 (203.0.113.0/24) またはハイフン範囲 (1.2.3.4-1.2.3.200) を (開始IP, 終了IP) に変換する """
+    if '/' in text:
         try:
-            ipaddress.ip_address(possible_ip)
-            return possible_ip
+            network = ipaddress.ip_network(text.strip(), strict=False)
         except ValueError:
-            pass
+            return None
+        return network.network_address, network.broadcast_address
+    if text.count('-') == 1:
+        left, right = (part.strip() for part in text.split('-'))
+        try:
+            start, end = ipaddress.ip_address(left), ipaddress.ip_address(right)
+        except ValueError:
+            return None
+        if start.version != end.version or start > end:
+            return None
+        return start, end
+    return None
+
+def format_ip_range(start, end):
+    """ レンジを正規化した表記に変換する (単一のCIDRで表せる場合はCIDR表記を優先) """
+    networks = list(ipaddress.summarize_address_range(start, end))
+    return str(networks[0]) if len(networks) == 1 else f"{start}-{end}"
+
+def prefix_key_from_int(int_value, version):
+    """ CIDRキャッシュの集約単位 (IPv4: /24, IPv6: /48) のキー文字列を整数値から直接生成する """
+    if version == 4:
+        return f"{ipaddress.IPv4Address(int_value & 0xFFFFFF00)}/24"
+    return f"{ipaddress.IPv6Address(int_value & ~((1 << 80) - 1))}/48"
+
+class Target:
+    """ 入力ターゲット1件の解析結果 (原文・ドメイン部・IP・バージョン・整数値・集約キー) を保持する軽量オブジェクト """
+    __slots__ = ('raw', 'domain', 'range_parent', 'ip', 'address', 'version', 'int_value', 'prefix_key', 'span')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.domain = None
+        self.range_parent = None # レンジ展開したメンバーの結果キー ('レンジ (IP)') の場合の展開元レンジ
+        self.ip = raw
+        self.address = None
+        self.version = 0
+        self.int_value = 0
+        self.prefix_key = None
+        self.span = None
+
+        # CIDR / ハイフン範囲は展開せず、開始・終了の整数値だけを保持する (代表アドレスは開始IP)
+        if ('/' in raw or '-' in raw) and "(" not in raw:
+            bounds = parse_ip_range(raw)
+            if bounds:
+                start, end = bounds
+                self.ip = str(start)
+                self.version = start.version
+                self.int_value = int(start)
+                self.span = (int(start), int(end))
+                self.prefix_key = prefix_key_from_int(self.int_value, self.version)
+                return
+
+        # 'ドメイン (IP)' の複合形式は括弧内がIPとして有効な場合のみ分解する
+        # 括弧の前がレンジの場合はレンジ展開のメンバーであり、ドメインとしては扱わない
+        if "(" in raw and ")" in raw:
+            possible_ip = raw.split("(")[-1].replace(")", "").strip()
+            try:
+                self.address = ipaddress.ip_address(possible_ip)
+                self.ip = possible_ip
+                prefix = raw.split("(")[0].strip()
+                if parse_ip_range(prefix):
+                    self.range_parent = prefix
+                else:
+                    self.domain = prefix
+            except ValueError:
+                pass
+        if self.address is None:
+            try:
+                self.address = ipaddress.ip_address(raw)
+            except ValueError:
+                return
+
+        self.version = self.address.version
+        self.int_value = int(self.address)
+        self.prefix_key = prefix_key_from_int(self.int_value, self.version)
+
+    @property
+    def is_ip(self):
+        return self.address is not None
+
+    @property
+    def is_composite(self):
+        return self.domain is not None
+
+    @property
+    def is_range(self):
+        return self.span is not None
+
+    @property
+    def is_range_member(self):
+        return self.range_parent is not None
+
+    @property
+    def range_size(self):
+        return self.span[1] - self.span[0] + 1 if self.span else 0
+
+    def __repr__(self):
+        return f"Target({self.raw!r})"
+
+@st.cache_resource
+def get_target_intern_table():
+    """ 解析済みTargetを再実行(rerun)をまたいで共有するための辞書 """
+    return {}
+
+TARGET_INTERN_MAX = 500000
+target_intern_table = get_target_intern_table()
+
+def parse_target(raw):
+    """ 文字列をTargetへ変換する。同じ文字列は一度だけ解析し、以降は同一オブジェクトを返す """
+    target = target_intern_table.get(raw)
+    if target is None:
+        target = Target(raw)
+        if len(target_intern_table) >= TARGET_INTERN_MAX:
+            # 長時間稼働で無制限に肥大化しないよう、上限到達時は一度破棄して作り直す
+            target_intern_table.clear()
+        target_intern_table[raw] = target
     return target
 
+def extract_actual_ip(target):
+    """ 'ドメイン (IP)' の形式からIPアドレスだけを抽出する関数 """
+    if not isinstance(target, str): return target
+    return parse_target(target).ip
+
 def clean_ocr_error_chars(target):
     cleaned_target = target.replace('Ⅱ', '11').replace('I', '1').replace('l', '1').replace('|', '1').replace('O', '0').replace('o', '0').replace(';', '.').replace(',', '.')
     if ':' not in cleaned_target:
@@ -695,11 +1217,8 @@ def clean_ocr_error_chars(target):
     return cleaned_target
 
 def is_valid_ip(target):
-    try:
-        ipaddress.ip_address(extract_actual_ip(target))
-        return True
-    except ValueError:
-        return False
+    if not isinstance(target, str): return False
+    return parse_target(target).is_ip
 
 def is_valid_domain(target):
     """ 入力された文字列が有効なFQDN（ドメイン名）の形式を満たしているか判定する """
@@ -712,36 +1231,43 @@ def is_valid_domain(target):
     return True
 
 def is_ipv4(target):
-    try:
-        ipaddress.IPv4Address(extract_actual_ip(target))
-        return True
-    except ValueError:
-        return False
+    if not isinstance(target, str): return False
+    parsed = parse_target(target)
+    # レンジも開始IPのバージョンを持つため、単一IP (複合形式を含む) に限定する
+    return parsed.is_ip and parsed.version == 4
+
+def is_ip_range(target):
+    if not isinstance(target, str): return False
+    return parse_target(target).is_range
+
+def range_member_key(range_target, member_ip):
+    """ レンジ展開したメンバーIPの結果キー。'レンジ (IP)' の形式にし、同じIPを個別に入力した結果と衝突させない (Target では range_parent に分解され、ドメイン複合型とはみなされない) """
+    return f"{range_target} ({member_ip})"
+
+def iter_range_members(target, limit=None):
+    """ レンジに含まれるIPを先頭から順に生成する (全件をリスト化しないため /8 等でもメモリを消費しない) """
+    parsed = parse_target(target)
+    if not parsed.is_range: return
+    start, end = parsed.span
+    if limit is not None:
+        end = min(end, start + limit - 1)
+    address_class = ipaddress.IPv4Address if parsed.version == 4 else ipaddress.IPv6Address
+    for value in range(start, end + 1):
+        yield str(address_class(value))
 
 def ip_to_int(ip):
-    actual_ip = extract_actual_ip(ip)
-    try:
-        if is_ipv4(actual_ip):
-            return struct.unpack("!I", socket.inet_aton(actual_ip))[0]
-        return 0
-    except OSError:
-        return 0
+    if not isinstance(ip, str): return 0
+    parsed = parse_target(ip)
+    return parsed.int_value if parsed.is_ip and parsed.version == 4 else 0
 
 def get_cidr_block(ip, netmask_range=(8, 24)):
-    actual_ip = extract_actual_ip(ip)
-    try:
-        ip_obj = ipaddress.ip_address(actual_ip)
-        if ip_obj.version == 4:
-            netmask = netmask_range[1] 
-            network = ipaddress.ip_network(f'{actual_ip}/{netmask}', strict=False)
-            return str(network)
-        elif ip_obj.version == 6:
-            netmask = 48
-            network = ipaddress.ip_network(f'{actual_ip}/{netmask}', strict=False)
-            return str(network)
-        return None
-    except ValueError:
+    if not isinstance(ip, str): return None
+    parsed = parse_target(ip)
+    if not parsed.is_ip:
         return None
+    if parsed.version == 4 and netmask_range[1] != 24:
+        return str(ipaddress.ip_network(f'{parsed.ip}/{netmask_range[1]}', strict=False))
+    return parsed.prefix_key
 
 def get_authoritative_rir_link(ip, country_code):
     rir_name = COUNTRY_CODE_TO_RIR.get(country_code)
@@ -763,9 +1289,13 @@ def get_copy_target(ip_display):
     return str(ip_display).split(' - ')[0].split(' ')[0]
 
 def create_secondary_links(target):
-    actual_ip = extract_actual_ip(target)
-    is_composite = (actual_ip != target and "(" in target) # ドメインとIPの複合型か判定
-    is_ip = is_valid_ip(target) and not is_composite
+    if is_ip_range(target):
+        # レンジはネットワークアドレス (開始IP) の調査リンクで代表させる
+        target = parse_target(target).ip
+    parsed = parse_target(target)
+    actual_ip = parsed.ip
+    is_composite = parsed.is_composite # ドメインとIPの複合型か判定 (レンジ展開のメンバーはIPとして扱う)
+    is_ip = parsed.is_ip and not is_composite
     
     # --- ツールごとの解説文（オンマウス時のツールチップ用） ---
     tool_tips = {
@@ -786,7 +1316,7 @@ def create_secondary_links(target):
 
     if is_composite:
         # --- ドメイン(IP) 複合型専用 厳選リンク ---
-        domain_part = target.split("(")[0].strip()
+        domain_part = parsed.domain
         encoded_domain = quote(domain_part, safe='')
         encoded_ip = quote(actual_ip, safe='')
         
@@ -959,80 +1489,265 @@ def fetch_classic_whois(target):
         error_msg = f"Error: WHOIS情報の取得中にシステムエラーが発生しました ({str(e)})"
         return error_msg, "不明"
 
-# SecurityTrails API取得関数 (過去のAレコード・AAAAレコード履歴)
-def get_securitytrails_data(domain, api_key, start_date=None, end_date=None):
-    """ SecurityTrails APIを使用してドメインの過去のIP履歴(IPv4/IPv6)を取得し、期間でフィルタリングする """
-    if not api_key or not domain:
-        return None
-    
+# --- 永続キャッシュ (外部APIの応答再利用) ---
+class PersistentTTLCache:
+    """ キー単位の応答をTTL付きで保持するキャッシュ。ローカルモードではJSONLへ追記して再起動後も再利用する (スレッドセーフ) """
+
+    def __init__(self, path=None, ttl=86400, migrate=None):
+        self.path = path
+        self.ttl = ttl
+        self.migrate = migrate # 旧形式の行を {'key', 'fetched_at', 'value'} へ変換する関数 (変換できない行は None を返す)
+        self._entries = {}
+        self._lock = threading.Lock()
+        if path:
+            self._load()
+
+    def _load(self):
+        now = time.time()
+        line_count = 0
+        migrated = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line_count += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # 書き込み途中で途切れた行は読み飛ばす
+                    if isinstance(entry, dict) and 'key' not in entry and self.migrate:
+                        entry = self.migrate(entry)
+                        migrated += 1
+                    if isinstance(entry, dict) and 'key' in entry and now - entry.get('fetched_at', 0) < self.ttl:
+                        self._entries[entry['key']] = entry
+        except OSError:
+            return
+        # 期限切れ・上書き済みの行が溜まっている場合や、旧形式の行を変換した場合は有効な行だけで書き直す
+        if migrated or line_count > 2 * len(self._entries):
+            try:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for entry in self._entries.values():
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                os.replace(tmp_path, self.path)
+            except OSError:
+                pass
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry['fetched_at'] < self.ttl:
+                return entry['value']
+            return None
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def put(self, key, value):
+        entry = {'key': key, 'fetched_at': time.time(), 'value': value}
+        with self._lock:
+            self._entries[key] = entry
+            if self.path:
+                try:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                except OSError:
+                    pass
+        return value
+
+# --- SecurityTrails クォータ台帳・応答キャッシュ ---
+SECURITYTRAILS_LEDGER_FILE = "whois_securitytrails_ledger.json"
+SECURITYTRAILS_CACHE_FILE = "whois_securitytrails_cache.jsonl"
+# 履歴・逆検索の応答を再利用する期間 (過去の履歴は頻繁には変わらないため長めに保持する)
+SECURITYTRAILS_CACHE_TTL = 7 * 86400
+# 429 (上限到達) を受けた後、再度APIへ問い合わせるまでの待機時間 (一時的な制限で月末まで止めないよう定期的に確認する)
+SECURITYTRAILS_EXHAUSTED_RECHECK = 3600
+# 全スレッド合計での1秒あたりの送信上限 (既定は従来どおり1秒1件。無料枠のレート制限を超えないようにする)
+SECURITYTRAILS_MAX_RPS = 1
+# 有料プラン向けに画面から選択できる高速側の送信上限
+SECURITYTRAILS_FAST_RPS = 4
+# Reverse IP 全件取得時のページ数の上限 (暴走防止。100ページ = 約1万件)
+SECURITYTRAILS_MAX_PAGES = 100
+
+class RateLimiter:
+    """ 複数スレッドで共有する送信間隔の制御。1秒あたりの上限を超えないよう、各送信の時刻を均等にずらす """
+
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+class SecurityTrailsLedger:
+    """ SecurityTrailsの呼び出し回数をAPIキー・月単位で記録する台帳。キーはハッシュ化して保存し、平文では保持しない """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {'usage': {}, 'exhausted': {}}
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    loaded = json.load(f)
+                self._data['usage'] = loaded.get('usage', {})
+                self._data['exhausted'] = loaded.get('exhausted', {})
+            except (OSError, ValueError, AttributeError):
+                pass
+
+    @staticmethod
+    def _key_id(api_key):
+        return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def _month():
+        return datetime.datetime.now().strftime("%Y-%m")
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._data, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    def record_call(self, api_key, count=1):
+        with self._lock:
+            months = self._data['usage'].setdefault(self._key_id(api_key), {})
+            months[self._month()] = months.get(self._month(), 0) + count
+            self._save()
+
+    def calls_this_month(self, api_key):
+        with self._lock:
+            return self._data['usage'].get(self._key_id(api_key), {}).get(self._month(), 0)
+
+    def mark_exhausted(self, api_key):
+        with self._lock:
+            self._data['exhausted'][self._key_id(api_key)] = time.time()
+            self._save()
+
+    def is_exhausted(self, api_key):
+        """ 直近に上限到達 (429) を受けている場合は、通信せずに上限到達として扱う """
+        with self._lock:
+            exhausted_at = self._data['exhausted'].get(self._key_id(api_key), 0)
+        return time.time() - exhausted_at < SECURITYTRAILS_EXHAUSTED_RECHECK
+
+@st.cache_resource
+def get_securitytrails_ledger():
+    """ 公開モードではメモリ上のみ、ローカルモードではファイルに永続化する台帳を作る """
+    return SecurityTrailsLedger(None if IS_PUBLIC_MODE else SECURITYTRAILS_LEDGER_FILE)
+
+@st.cache_resource
+def get_securitytrails_cache():
+    """ ドメイン履歴 (期間で絞り込む前の全件) と逆検索の応答を保持するキャッシュ """
+    return PersistentTTLCache(None if IS_PUBLIC_MODE else SECURITYTRAILS_CACHE_FILE, SECURITYTRAILS_CACHE_TTL)
+
+@st.cache_resource
+def get_securitytrails_limiter(key_id, rate):
+    """ APIキー (ハッシュ値) と送信上限の組ごとに送信間隔を管理する (他のセッションの速度設定に影響されないようにする) """
+    return RateLimiter(rate)
+
+@st.cache_resource
+def get_securitytrails_executor():
+    """ SecurityTrailsの個別リクエスト (A/AAAA履歴・Reverse IPの各ページ) を並行実行する専用プール """
+    return ThreadPoolExecutor(max_workers=SECURITYTRAILS_CONCURRENCY)
+
+class SecurityTrailsAborted(requests.exceptions.RequestException):
+    """ 送信待ちの間に上限到達 (429) または呼び出し元の打ち切りが判明し、送信を取りやめたリクエスト """
+
+def securitytrails_request(method, url, api_key, stop_event=None, rate=SECURITYTRAILS_MAX_RPS, **kwargs):
+    """ 送信レートの上限を守ってSecurityTrailsへリクエストし、呼び出し回数を台帳へ記録する """
+    ledger = get_securitytrails_ledger()
+    get_securitytrails_limiter(SecurityTrailsLedger._key_id(api_key), rate).acquire()
+    # 並行中の他のリクエストが429を受けた後や打ち切り後は送信せず、台帳にも記録しない
+    if ledger.is_exhausted(api_key) or (stop_event is not None and stop_event.is_set()):
+        raise SecurityTrailsAborted(url)
+    ledger.record_call(api_key)
+    res = session.request(method, url, timeout=10, **kwargs)
+    if res.status_code == 429:
+        ledger.mark_exhausted(api_key)
+    return res
+
+def securitytrails_key_scope(api_key):
+    """ 公開モードではキャッシュを利用者間で共有しないよう、APIキーのハッシュ値をキーの接頭辞にする """
+    return f"{SecurityTrailsLedger._key_id(api_key)}:" if IS_PUBLIC_MODE else ""
+
+def securitytrails_history_key(domain, api_key):
+    return f"{securitytrails_key_scope(api_key)}history:{domain.lower()}"
+
+def securitytrails_reverse_key(ip, fetch_all, api_key):
+    return f"{securitytrails_key_scope(api_key)}reverse:{ip}:{'all' if fetch_all else 'first'}"
+
+def fetch_securitytrails_history(domain, api_key, rate=SECURITYTRAILS_MAX_RPS):
+    """ Aレコード・AAAAレコードの履歴を並行して取得し、両方とも取得できた場合のみキャッシュへ保存する """
     headers = {
         "APIKEY": api_key,
         "accept": "application/json"
     }
-    
+    executor = get_securitytrails_executor()
+    futures = [
+        executor.submit(securitytrails_request, "GET", f"https://api.securitytrails.com/v1/history/{domain}/dns/{record_type}", api_key, rate=rate, headers=headers)
+        for record_type in ("a", "aaaa")
+    ]
     combined_records = []
-    
-    import requests
-    # Aレコード (IPv4) 取得
-    try:
-        url_a = f"https://api.securitytrails.com/v1/history/{domain}/dns/a"
-        res_a = session.get(url_a, headers=headers, timeout=10)
-        
-        # HTTPステータスコードが200番台以外なら例外を発生させる
-        res_a.raise_for_status() 
-        
-        data_a = res_a.json()
-        if "records" in data_a:
-            combined_records.extend(data_a["records"])
-            
-    except requests.exceptions.Timeout:
-        # タイムアウトした場合の処理
-        # print(f"[Timeout] SecurityTrails API (A): {domain}")
-        pass
-    except requests.exceptions.HTTPError as e:
-        # 月間制限(50回)等のレートリミット到達時、エラーフラグを返す
-        if e.response is not None and e.response.status_code == 429:
-            return {"error": "rate_limit"}
-        pass
-    except requests.exceptions.RequestException as e:
-        # その他のネットワークエラー（DNS解決失敗など）
-        pass
-    except ValueError:
-        # JSONのパースエラー（APIが想定外のHTMLなどを返してきた場合）
-        pass
+    is_complete = True
 
-    # AAAAレコード (IPv6) 取得
-    try:
-        url_aaaa = f"https://api.securitytrails.com/v1/history/{domain}/dns/aaaa"
-        res_aaaa = session.get(url_aaaa, headers=headers, timeout=10)
-        
-        # HTTPステータスコードが200番台以外なら例外を発生させる
-        res_aaaa.raise_for_status()
-        
-        data_aaaa = res_aaaa.json()
-        if "records" in data_aaaa:
-            combined_records.extend(data_aaaa["records"])
+    for future in futures:
+        try:
+            res = future.result()
             
-    except requests.exceptions.Timeout:
-        # タイムアウトした場合の処理
-        # print(f"[Timeout] SecurityTrails API (AAAA): {domain}")
-        pass
-    except requests.exceptions.HTTPError as e:
-        # AAAAレコード側にもレートリミット到達の検知を追加
-        if e.response is not None and e.response.status_code == 429:
-            return {"error": "rate_limit"}
-        pass
-    except requests.exceptions.RequestException as e:
-        # その他のネットワークエラー
-        pass
-    except ValueError:
-        # JSONのパースエラー
-        pass
+            # HTTPステータスコードが200番台以外なら例外を発生させる
+            res.raise_for_status() 
+            
+            data = res.json()
+            if "records" in data:
+                combined_records.extend(data["records"])
+                
+        except SecurityTrailsAborted:
+            return {"error": "rate_limit"} # もう一方のリクエストが先に上限へ到達した
+        except requests.exceptions.HTTPError as e:
+            # 月間制限(50回)等のレートリミット到達時、台帳に記録してエラーフラグを返す
+            if e.response is not None and e.response.status_code == 429:
+                get_securitytrails_ledger().mark_exhausted(api_key)
+                return {"error": "rate_limit"}
+            is_complete = False
+        except (requests.exceptions.RequestException, ValueError):
+            # タイムアウト・ネットワークエラー・JSONのパースエラー (APIが想定外のHTMLなどを返してきた場合)
+            is_complete = False
+
+    if is_complete:
+        get_securitytrails_cache().put(securitytrails_history_key(domain, api_key), combined_records)
+    return combined_records
+
+# SecurityTrails API取得関数 (過去のAレコード・AAAAレコード履歴)
+def get_securitytrails_data(domain, api_key, start_date=None, end_date=None, rate=SECURITYTRAILS_MAX_RPS):
+    """ SecurityTrails APIを使用してドメインの過去のIP履歴(IPv4/IPv6)を取得し、期間でフィルタリングする """
+    if not api_key or not domain:
+        return None
     
+    # 期間での絞り込みは取得後にローカルで行うため、キャッシュには全件を保存し、期間を変えても再取得しない
+    st_cache = get_securitytrails_cache()
+    ledger = get_securitytrails_ledger()
+    cache_key = securitytrails_history_key(domain, api_key)
+    combined_records = st_cache.get(cache_key)
+    if combined_records is None:
+        if ledger.is_exhausted(api_key):
+            return {"error": "rate_limit"}
+        combined_records = fetch_securitytrails_history(domain, api_key, rate)
+        if isinstance(combined_records, dict):
+            return combined_records # レートリミット到達
 
     if combined_records:
-        # まず first_seen (初回観測日) の降順で全体をソート (新しい順)
-        combined_records.sort(key=lambda x: str(x.get('first_seen', '1970-01-01')), reverse=True)
+        # まず first_seen (初回観測日) の降順で全体をソート (新しい順)。キャッシュ上のリストは書き換えない
+        combined_records = sorted(combined_records, key=lambda x: str(x.get('first_seen', '1970-01-01')), reverse=True)
         
         filtered_records = []
         is_date_filtered = False
@@ -1065,13 +1780,29 @@ def get_securitytrails_data(domain, api_key, start_date=None, end_date=None):
 
     return None
 
+def fetch_securitytrails_page(url, api_key, headers, payload, page, stop_event=None, rate=SECURITYTRAILS_MAX_RPS):
+    """ Reverse IP の指定ページのレコードを取得する """
+    res = securitytrails_request("POST", url, api_key, stop_event, rate, headers=headers, json=dict(payload, page=page))
+    res.raise_for_status()
+    return res.json().get('records', [])
+
 # SecurityTrails API取得関数 (Reverse IP / ドメイン逆検索)
 # fetch_allフラグを受け取り、ページネーションループを回す
-def get_securitytrails_reverse_ip(ip, api_key, fetch_all=False):
+def get_securitytrails_reverse_ip(ip, api_key, fetch_all=False, rate=SECURITYTRAILS_MAX_RPS):
     """ SecurityTrails APIを使用してIPアドレスに紐づくドメイン群を取得する """
     if not api_key or not ip:
         return None
     
+    # 全件取得済みの応答は先頭ページのみの照会にも流用できる
+    st_cache = get_securitytrails_cache()
+    ledger = get_securitytrails_ledger()
+    for cached_all in ((True,) if fetch_all else (False, True)):
+        cached = st_cache.get(securitytrails_reverse_key(ip, cached_all, api_key))
+        if cached is not None:
+            return cached
+    if ledger.is_exhausted(api_key):
+        return {"error": "rate_limit"}
+
     headers = {
         "APIKEY": api_key,
         "accept": "application/json",
@@ -1083,69 +1814,112 @@ def get_securitytrails_reverse_ip(ip, api_key, fetch_all=False):
     
     try:
         url = "https://api.securitytrails.com/v1/domains/list"
-        res = session.post(url, headers=headers, json=payload, timeout=10)
+        res = securitytrails_request("POST", url, api_key, rate=rate, headers=headers, json=payload)
         res.raise_for_status()
         data = res.json()
+        is_complete = True
         
-        # 全件取得オンかつ複数ページある場合、次ページを取得し続ける
+        # 全件取得オンかつ複数ページある場合、総ページ数が判明した時点で残りのページを並行して取得する
         if fetch_all:
             total_pages = data.get('meta', {}).get('total_pages', 1)
-            current_page = 1
-            # 念のため暴走防止で最大100ページ（1万件）で頭打ちにする
-            while current_page < total_pages and current_page <= 100:
-                current_page += 1
-                payload['page'] = current_page
+            last_page = min(total_pages, SECURITYTRAILS_MAX_PAGES + 1)
+            executor = get_securitytrails_executor()
+            stop_event = threading.Event()
+            page_futures = {
+                executor.submit(fetch_securitytrails_page, url, api_key, headers, payload, page, stop_event, rate): page
+                for page in range(2, last_page + 1)
+            }
+            records = data.setdefault('records', [])
+            received = {}
+            next_page = 2
+            for future in as_completed(page_futures):
                 try:
-                    time.sleep(1) # API制限回避のウェイト
-                    res_next = session.post(url, headers=headers, json=payload, timeout=10)
-                    res_next.raise_for_status()
-                    data_next = res_next.json()
-                    if 'records' in data_next:
-                        data['records'].extend(data_next['records'])
+                    received[page_futures[future]] = future.result()
+                except SecurityTrailsAborted:
+                    is_complete = False
+                    data['error'] = "rate_limit_during_pagination" # 他のページが先に制限へ達した
+                    break
                 except requests.exceptions.HTTPError as e:
+                    is_complete = False
                     if e.response is not None and e.response.status_code == 429:
+                        ledger.mark_exhausted(api_key)
                         data['error'] = "rate_limit_during_pagination" # 途中で制限に達した専用フラグ
-                        break
-                    else:
-                        break
+                    break
                 except Exception:
+                    is_complete = False
                     break
+                # 届いたページは、先頭から連続して揃った分だけページ順に結果へ追加していく
+                while next_page in received:
+                    records.extend(received.pop(next_page))
+                    next_page += 1
+            if not is_complete:
+                # 送信待ちのページは取りやめ、結果は先頭から欠けなく揃ったページまでに留める (途中が欠けた後続ページは破棄する)
+                stop_event.set()
+                for future in page_futures:
+                    future.cancel()
+                data['pages_fetched'] = next_page - 1
+        # 途中で打ち切った応答はキャッシュせず、次回に改めて全件を取得させる
+        if is_complete:
+            st_cache.put(securitytrails_reverse_key(ip, fetch_all, api_key), data)
         return data
         
     except requests.exceptions.HTTPError as e:
         # 初回リクエストでのレートリミット到達検知
         if e.response is not None and e.response.status_code == 429:
+            ledger.mark_exhausted(api_key)
             return {"error": "rate_limit"}
         return None
     except Exception:
         return None
 
 # Shodan InternetDB API Logic (No API Key Required)
-def check_internetdb_risk(ip, max_retries=3):
+# 危険ポートとその表示名 (スコアリング方針。生の ports / vulns はキャッシュに保持するため、変更しても再取得は不要)
+INTERNETDB_RISK_PORTS = {
+    21: "Vuln:FTP",
+    23: "Vuln:Telnet (High Risk)",
+    1080: "Proxy:SOCKS",
+    3128: "Proxy:Squid",
+    5554: "IoT:Android/Emu",
+    5555: "IoT:Android/ADB (High Risk)",
+    7547: "Vuln:TR-069",
+    1900: "Vuln:UPnP",
+    8080: "Proxy:HTTP",
+}
+INTERNETDB_CACHE_FILE = "whois_internetdb_cache.jsonl"
+INTERNETDB_CACHE_TTL = 86400
+
+def migrate_internetdb_cache_entry(entry):
+    """ 汎用キャッシュ導入前の行 ({'ip', 'fetched_at', 'found', 'ports', 'vulns'}) を現在の形式へ変換する """
+    if 'ip' not in entry:
+        return None
+    return {
+        'key': entry['ip'], 'fetched_at': entry.get('fetched_at', 0),
+        'value': {'found': entry.get('found', False), 'ports': entry.get('ports', []), 'vulns': entry.get('vulns', [])}
+    }
+
+@st.cache_resource
+def get_internetdb_cache():
+    """ 公開モードではメモリ上のみ、ローカルモードではファイルに永続化するキャッシュを作る """
+    return PersistentTTLCache(None if IS_PUBLIC_MODE else INTERNETDB_CACHE_FILE, INTERNETDB_CACHE_TTL, migrate_internetdb_cache_entry)
+
+@st.cache_resource
+def get_internetdb_executor():
+    """ InternetDB照会専用のスレッドプール (ジオ照会と並行して走らせる) """
+    return ThreadPoolExecutor(max_workers=INTERNETDB_CONCURRENCY)
+
+def fetch_internetdb_record(ip, max_retries=3):
     """
-    Shodan InternetDB APIを使用して、ポートスキャン結果と脆弱性をチェックする。
-    タイムアウトによるデータ欠損を防ぐため、リトライ機構とバックオフを実装。
+    Shodan InternetDB APIから生のポート・脆弱性一覧を取得し、キャッシュへ保存する。
+    成功時はキャッシュエントリ (dict)、失敗時はエラー文字列を返す (エラーはキャッシュしない)。
     """
-    RISK_PORTS = {
-        21: "Vuln:FTP",
-        23: "Vuln:Telnet (High Risk)",
-        1080: "Proxy:SOCKS",
-        3128: "Proxy:Squid",
-        5554: "IoT:Android/Emu",
-        5555: "IoT:Android/ADB (High Risk)",
-        7547: "Vuln:TR-069",
-        1900: "Vuln:UPnP",
-        8080: "Proxy:HTTP",
-    }
-    
     for attempt in range(max_retries):
         try:
             url = f"https://internetdb.shodan.io/{ip}"
             # タイムアウトを5秒に延長し、猶予を持たせる
-            response = requests.get(url, timeout=5)
+            response = session.get(url, timeout=5)
             
             if response.status_code == 404:
-                return "[データなし]"
+                return get_internetdb_cache().put(ip, {'found': False, 'ports': [], 'vulns': []})
             elif response.status_code == 429:
                 return "エラー: Shodanのアクセス制限超過"
             elif 500 <= response.status_code < 600:
@@ -1154,24 +1928,7 @@ def check_internetdb_risk(ip, max_retries=3):
                 return f"エラー: Shodan通信障害 ({response.status_code})"
                 
             data = response.json()
-            found_risks = []
-            open_ports = data.get('ports', [])
-            vulns = data.get('vulns', [])
-            
-            for p in open_ports:
-                if p in RISK_PORTS:
-                    found_risks.append(RISK_PORTS[p])
-            
-            if vulns:
-                found_risks.append(f"CVEs({len(vulns)})")
-                
-            if found_risks:
-                unique_risks = sorted(list(set(found_risks)))
-                return " / ".join(unique_risks)
-            else:
-                if open_ports:
-                    return "[No Match (Other Ports)]"
-                return "[No Match]"
+            return get_internetdb_cache().put(ip, {'found': True, 'ports': sorted(data.get('ports') or []), 'vulns': sorted(data.get('vulns') or [])})
             
         except requests.exceptions.ConnectionError:
             # 物理的なネットワーク切断時は上位ループへ例外を投げ、15秒待機のサーキットブレーカーを発動させる
@@ -1187,6 +1944,65 @@ def check_internetdb_risk(ip, max_retries=3):
             return "エラー: ネットワーク接続に失敗しました"
         except ValueError:
             return "エラー: データ解析失敗 (相手から不正なデータが返されました)"
+
+def score_internetdb_risk(record, risk_ports=None):
+    """ キャッシュエントリ (生の ports / vulns) を危険ポート方針に照らして表示用のリスク文字列へ変換する """
+    if not isinstance(record, dict):
+        return record # 取得失敗時のエラー文字列はそのまま返す
+    if not record['found']:
+        return "[データなし]"
+    risk_ports = INTERNETDB_RISK_PORTS if risk_ports is None else risk_ports
+    found_risks = [risk_ports[p] for p in record['ports'] if p in risk_ports]
+    if record['vulns']:
+        found_risks.append(f"CVEs({len(record['vulns'])})")
+        
+    if found_risks:
+        return " / ".join(sorted(set(found_risks)))
+    if record['ports']:
+        return "[No Match (Other Ports)]"
+    return "[No Match]"
+
+INTERNETDB_UNSCORED_MARKERS = ('', 'N/A', '[Not Checked]', '[Skipped (Policy)]', 'Aggr Mode (Skip)')
+
+def rescore_internetdb_risk(frame, risk_ports):
+    """ 結果フレームのIoTリスク列を、キャッシュ済みの生データから指定の危険ポート方針で採点し直す (通信はしない) """
+    # 照会時は既定の方針で採点しているため、方針が既定のままなら採点し直す必要はない
+    if risk_ports == INTERNETDB_RISK_PORTS or 'IoT_Risk' not in frame.columns or frame.empty:
+        return frame
+    risks = text_column(frame, 'IoT_Risk', '')
+    scorable = ~(risks.isin(INTERNETDB_UNSCORED_MARKERS) | risks.str.startswith('[Range]'))
+    targets = text_column(frame, 'Target_IP', '')
+    cache = get_internetdb_cache()
+    rescored = {}
+    for target in targets[scorable].unique():
+        record = cache.get(extract_actual_ip(target))
+        if record is not None:
+            rescored[target] = score_internetdb_risk(record, risk_ports)
+    if not rescored:
+        return frame
+    new_risks = targets.map(rescored)
+    frame = frame.copy()
+    frame['IoT_Risk'] = risks.where(~scorable | new_risks.isna(), new_risks)
+    return frame
+
+def prefetch_internetdb(ip):
+    """ InternetDBの照会を専用プールへ投入し、Futureを返す。キャッシュ済みの場合は通信せずに即座に完了する """
+    cached = get_internetdb_cache().get(ip)
+    if cached is not None:
+        future = Future()
+        future.set_result(cached)
+        return future
+    return get_internetdb_executor().submit(fetch_internetdb_record, ip)
+
+def check_internetdb_risk(ip, max_retries=3, risk_ports=None):
+    """
+    Shodan InternetDB APIを使用して、ポートスキャン結果と脆弱性をチェックする。
+    キャッシュ済みのIPは通信せず、保存済みの生データを現在の方針で採点し直す。
+    """
+    record = get_internetdb_cache().get(ip)
+    if record is None:
+        record = fetch_internetdb_record(ip, max_retries)
+    return score_internetdb_risk(record, risk_ports)
         
 # VPNAPI.io 取得関数
 def get_vpnapi_data(ip, api_key):
@@ -1262,6 +2078,108 @@ def resolve_ip_nslookup(ip):
     
     return hostnames, raw_output
 
+def new_dns_records():
+    """ ドメインの正引き結果を種別ごとに保持する入れ物 (JSONにそのまま保存できる形) """
+    return {'A': [], 'AAAA': [], 'MX': [], 'NS': [], 'CNAME': []}
+
+def extract_cname_chain(answer):
+    """ 応答メッセージからCNAMEの連鎖 (別名 → 転送先) を取り出す """
+    try:
+        cnames = answer.response.resolve_chaining().cnames
+    except Exception:
+        return []
+    return [{'name': rrset.name.to_text(omit_final_dot=True), 'target': rrset[0].target.to_text(omit_final_dot=True)} for rrset in cnames]
+
+def resolve_domain_nslookup(domain):
+    """ パブリックDNSへ直接問い合わせて正引きし、(IPリスト, 人が読むための生出力, 種別ごとのレコード) を返す """
+    ips = []
+    seen_ips = set()
+    raw_lines = []
+    records = new_dns_records()
+
+    try:
+        # システムのリゾルバに依存せず、Google/CloudflareのパブリックDNSを明示的に使用
+        resolver = dns.resolver.Resolver(configure=False)
+        resolver.nameservers = random.sample(PUBLIC_DNS_SERVERS, 2) + random.sample(PUBLIC_DNS_V6_SERVERS, 1)
+        resolver.timeout = 3
+        resolver.lifetime = 3
+
+        raw_lines.append(f";; Domain: {domain}")
+        raw_lines.append(f";; Resolver: {resolver.nameservers}")
+
+        # --- Aレコード (IPv4) 取得 ---
+        try:
+            answers_v4 = resolver.resolve(domain, 'A')
+            # CNAMEを経由して解決された場合は、その連鎖も記録する
+            for cname in extract_cname_chain(answers_v4):
+                records['CNAME'].append(cname)
+                raw_lines.append(f"{cname['name']}. \tIN \tCNAME \t{cname['target']}")
+            for rdata in answers_v4:
+                ip = rdata.to_text()
+                if ip not in seen_ips:
+                    seen_ips.add(ip)
+                    ips.append(ip)
+                    records['A'].append(ip)
+                raw_lines.append(f"{domain}. \tIN \tA \t{ip}")
+        except dns.resolver.NoAnswer:
+            raw_lines.append(f";; IPv4 (A) record not found for {domain}")
+        except dns.resolver.NXDOMAIN:
+            raw_lines.append(f";; Domain {domain} does not exist (NXDOMAIN)")
+            return [], "\n".join(raw_lines), records # ドメインがないなら終了
+        except Exception as e:
+            raw_lines.append(f";; IPv4 Query Failed: {str(e)}")
+
+        # --- AAAAレコード (IPv6) 取得 ---
+        try:
+            answers_v6 = resolver.resolve(domain, 'AAAA')
+            for rdata in answers_v6:
+                ip = rdata.to_text()
+                if ip not in seen_ips:
+                    seen_ips.add(ip)
+                    ips.append(ip)
+                    records['AAAA'].append(ip)
+                raw_lines.append(f"{domain}. \tIN \tAAAA \t{ip}")
+        except dns.resolver.NoAnswer:
+            pass # IPv6がないのは一般的
+        except Exception as e:
+            raw_lines.append(f";; IPv6 Query Failed: {str(e)}")
+
+        # --- MXレコード (Mail Exchange) 取得 ---
+        try:
+            # MXレコードは捨てアド特定の生命線であるため、専用の長いライフタイムを設定して取得を試みる
+            resolver_mx = dns.resolver.Resolver(configure=False)
+            resolver_mx.nameservers = random.sample(PUBLIC_DNS_SERVERS, 3)
+            resolver_mx.timeout = 5
+            resolver_mx.lifetime = 10
+            
+            answers_mx = resolver_mx.resolve(domain, 'MX')
+            for rdata in answers_mx:
+                mx_target = rdata.exchange.to_text(omit_final_dot=True)
+                mx_pref = rdata.preference
+                records['MX'].append({'preference': mx_pref, 'exchange': mx_target})
+                raw_lines.append(f"{domain}. \tIN \tMX \t{mx_pref} {mx_target}")
+        except dns.resolver.NoAnswer:
+            raw_lines.append(f";; MX record not found for {domain}")
+        except Exception as e:
+            raw_lines.append(f";; MX Query Failed: {str(e)}")
+
+        # --- NSレコード (権威DNSサーバー) 取得 ---
+        try:
+            answers_ns = resolver.resolve(domain, 'NS')
+            for rdata in answers_ns:
+                ns_target = rdata.target.to_text(omit_final_dot=True)
+                records['NS'].append(ns_target)
+                raw_lines.append(f"{domain}. \tIN \tNS \t{ns_target}")
+        except dns.resolver.NoAnswer:
+            pass # サブドメインには委任が無いのが一般的
+        except Exception as e:
+            raw_lines.append(f";; NS Query Failed: {str(e)}")
+
+    except Exception as e:
+        raw_lines.append(f";; Critical DNS Error: {str(e)}")
+
+    return ips, "\n".join(raw_lines), records
+
 def fetch_ipinfo_bulk(ip_list, api_key):
     """ IPinfoの/batchエンドポイントを使用して最大1000件を一括取得する """
     if not ip_list or not api_key:
@@ -1295,9 +2213,106 @@ def fetch_ipinfo_bulk(ip_list, api_key):
             
     return results
 
+def apply_domain_stages(result, target, use_rdap, st_api_key=None, st_start_date=None, st_end_date=None, is_single_target=False, st_rate=SECURITYTRAILS_MAX_RPS):
+    """ 複合ターゲット ('ドメイン (IP)') のドメイン部分に対する解析 (ドメインRDAP・WHOIS・SecurityTrails履歴) を実行する """
+    parsed = parse_target(target)
+    if not parsed.is_composite:
+        return result
+    domain_part = parsed.domain
+
+    if use_rdap:
+        res_d = fetch_domain_rdap_data(domain_part)
+        if res_d:
+            result['DOMAIN_RDAP_JSON'] = res_d['json']
+            result['DOMAIN_RDAP_URL'] = res_d['url']
+        
+        # RDAPの成否に関わらず、生のWHOISテキストは証拠として常に取得を試みる
+        if is_single_target:
+            w_text, w_server = fetch_classic_whois(domain_part)
+            if w_text:
+                result['DOMAIN_WHOIS_TEXT'] = w_text
+                result['DOMAIN_WHOIS_SERVER'] = w_server
+
+    if st_api_key:
+        st_res = get_securitytrails_data(domain_part, st_api_key, st_start_date, st_end_date, st_rate)
+        if st_res: result['ST_JSON'] = st_res
+    return result
+
+
+@st.cache_resource
+def get_stage_executor():
+    """ ターゲット内の互いに依存しない照会段階を並行実行するための専用スレッドプール """
+    return ThreadPoolExecutor(max_workers=ENRICHMENT_STAGE_WORKERS)
+
+def dispatch_enrichment_stages(stage_calls):
+    """ 照会段階 {名前: (関数, 引数...)} を専用プールへ一括投入し、{名前: Future} を返す。無効な段階 (None) は投入しない """
+    executor = get_stage_executor()
+    return {name: executor.submit(*call) for name, call in stage_calls.items() if call is not None}
+
+# --- 条件付き照会ポリシー ---
+# ホスティング事業者・データセンターとみなすISP名のキーワード (ASN種別が取得できない ip-api 利用時の代替判定)
+# 単語単位で照合し、"Colombia" の colo や "Observer" の server のような語の一部への誤一致を防ぐ
+HOSTING_ISP_PATTERN = re.compile(
+    r'\b(?:hosting|cloud|data ?cent(?:er|re)s?|servers?|vps|colo(?:cation)?|digitalocean|linode|akamai|ovh|hetzner|vultr|choopa|contabo|leaseweb|m247|'
+    r'amazon|google|microsoft|alibaba|tencent|oracle|cloudflare|fastly)\b',
+    re.IGNORECASE
+)
+# 照会ポリシー: {段階名: その段階を実行する一次シグナルの集合}。ポリシーに含まれない段階は常に実行し、None は全件照会とする
+# 一次シグナル: tor (Torリスト), cloud (公式クラウドレンジ), hosting (ASN種別・ISP名), unknown_isp (ISP不明), foreign (日本国外。国不明は含めない)
+ENRICHMENT_POLICIES = {
+    "全件照会 (従来通り)": None,
+    "疑わしいIPのみ (ホスティング・Tor・ISP不明・海外)": {
+        'vpnapi': {'cloud', 'hosting', 'unknown_isp', 'foreign'},
+        'st_reverse': {'cloud', 'hosting', 'unknown_isp'},
+        'internetdb': {'tor', 'cloud', 'hosting', 'unknown_isp', 'foreign'},
+    },
+    "ホスティング・ISP不明のみ (最小限)": {
+        'vpnapi': {'cloud', 'hosting', 'unknown_isp'},
+        'st_reverse': {'cloud', 'hosting'},
+        'internetdb': {'tor', 'cloud', 'hosting'},
+    },
+}
+DEFAULT_ENRICHMENT_POLICY = "全件照会 (従来通り)"
+ENRICHMENT_STAGE_LABELS = {'vpnapi': "VPNAPI", 'st_reverse': "ST Reverse IP", 'internetdb': "InternetDB"}
+
+def collect_cheap_signals(actual_ip, result, tor_nodes, cloud_provider):
+    """ ローカル判定とジオ照会の結果のみから、追加照会の要否判定に使う一次シグナルを集める """
+    signals = set()
+    if actual_ip in tor_nodes:
+        signals.add('tor')
+    if cloud_provider:
+        signals.add('cloud')
+
+    isp = result.get('ISP_API_Raw') or 'N/A'
+    if isp == 'N/A':
+        signals.add('unknown_isp')
+    elif HOSTING_ISP_PATTERN.search(isp):
+        signals.add('hosting')
+
+    # IPinfo (Pro) はASN種別・ホスティング判定を返すため、取得できた場合はISP名より優先して採用する
+    ipinfo = result.get('IPINFO_JSON') or {}
+    asn = ipinfo.get('asn')
+    privacy = ipinfo.get('privacy')
+    if (isinstance(asn, dict) and asn.get('type') == 'hosting') or (isinstance(privacy, dict) and privacy.get('hosting')):
+        signals.add('hosting')
+
+    # 国が取得できなかった場合は国外とみなさない (照会失敗を海外扱いして追加照会を誘発しないため)
+    country_code = result.get('CountryCode')
+    if country_code and country_code != 'N/A' and country_code != 'JP':
+        signals.add('foreign')
+    return signals
+
+def is_stage_permitted(policy, stage, signals):
+    """ 照会ポリシーに照らして、一次シグナルから該当段階の照会を実行すべきかを判定する """
+    rules = ENRICHMENT_POLICIES.get(policy)
+    if not rules or stage not in rules:
+        return True
+    return bool(rules[stage] & signals)
+
 # --- API通信関数 (Main) ---
-def get_ip_details_from_api(ip, cidr_cache_snapshot, learned_isps_snapshot, delay_between_requests, rate_limit_wait_seconds, tor_nodes, cloud_ip_data, use_rdap, use_internetdb, use_rdns, use_st_reverse_ip, api_key=None, vpnapi_key=None, st_api_key=None, st_start_date=None, st_end_date=None, use_st_rev_fetchall=False, is_single_target=False, bulk_ipinfo_cache=None):
-    actual_ip = extract_actual_ip(ip)
+def get_ip_details_from_api(ip, cidr_cache_snapshot, learned_isps_snapshot, delay_between_requests, rate_limit_wait_seconds, tor_nodes, cloud_ip_data, use_rdap, use_internetdb, use_rdns, use_st_reverse_ip, api_key=None, vpnapi_key=None, st_api_key=None, st_start_date=None, st_end_date=None, use_st_rev_fetchall=False, is_single_target=False, bulk_ipinfo_cache=None, enrichment_policy=None, st_rate=SECURITYTRAILS_MAX_RPS):
+    parsed_target = parse_target(ip)
+    actual_ip = parsed_target.ip
     
     result = {
         'Target_IP': ip, 
@@ -1316,7 +2331,7 @@ def get_ip_details_from_api(ip, cidr_cache_snapshot, learned_isps_snapshot, dela
     }
     new_cache_entry = None
     new_learned_isp = None
-    cidr_block = get_cidr_block(actual_ip)
+    cidr_block = parsed_target.prefix_key
     
     if cidr_block and cidr_block in cidr_cache_snapshot:
         cached_data = cidr_cache_snapshot[cidr_block]
@@ -1328,6 +2343,7 @@ def get_ip_details_from_api(ip, cidr_cache_snapshot, learned_isps_snapshot, dela
             result['Secondary_Security_Links'] = create_secondary_links(ip)
             return result, None, None
 
+    stages = {}
     try:
         # --- 動的スリープ判定（バルク処理のボトルネック解消） ---
         has_bulk_cache = bool(api_key and bulk_ipinfo_cache and actual_ip in bulk_ipinfo_cache and isinstance(bulk_ipinfo_cache[actual_ip], dict))
@@ -1344,6 +2360,25 @@ def get_ip_details_from_api(ip, cidr_cache_snapshot, learned_isps_snapshot, dela
             pass # キャッシュ完備かつ他APIへの通信がない場合は待機ゼロで爆速処理
         else:
             time.sleep(delay_between_requests)
+
+        # --- 照会段階の依存関係 ---
+        # ジオ照会 (ipinfo / ip-api) と以下の補助照会は互いに独立しているため、補助照会を先に専用プールへ投入し、
+        # ジオ照会はこのスレッドで並行して実行する。ジオ結果が必要な処理 (日本語名・RDAP名の変換、Proxy判定の結合) のみ合流後に行う
+        # 照会ポリシーで条件付きとした段階は一次シグナル (ジオ結果) に依存するため、ジオ照会の後に要否を判定して投入する
+        gated_stages = ENRICHMENT_POLICIES.get(enrichment_policy) or {}
+        stage_calls = {
+            'vpnapi': (get_vpnapi_data, actual_ip, vpnapi_key) if vpnapi_key else None,
+            'rdap': (fetch_rdap_data, actual_ip) if use_rdap else None,
+            # 複合ターゲット（ドメインから解決されたIP）の場合は、生WHOISの取得をスキップしてIP-BANを防ぐ
+            'ip_whois': (fetch_classic_whois, actual_ip) if use_rdap and not parsed_target.is_composite and is_single_target else None,
+            'domain': (apply_domain_stages, {}, ip, use_rdap, st_api_key, st_start_date, st_end_date, is_single_target, st_rate) if parsed_target.is_composite else None,
+            'rdns': (resolve_ip_nslookup, actual_ip) if use_rdns else None,
+            'st_reverse': (get_securitytrails_reverse_ip, actual_ip, st_api_key, use_st_rev_fetchall, st_rate) if use_st_reverse_ip and st_api_key else None,
+        }
+        stages = dispatch_enrichment_stages({name: call for name, call in stage_calls.items() if name not in gated_stages})
+        # InternetDBは同時接続数を絞った専用プールで実行する (キャッシュ済みの場合は即座に完了)
+        if use_internetdb and 'internetdb' not in gated_stages:
+            stages['internetdb'] = prefetch_internetdb(actual_ip)
         
         # --- API通信セクション ---
         if api_key:
@@ -1433,9 +2468,26 @@ def get_ip_details_from_api(ip, cidr_cache_snapshot, learned_isps_snapshot, dela
         else:
             result['Proxy_Type'] = ""
 
+        # 条件付きの段階は一次シグナルが揃ったこの時点で要否を判定し、対象外の照会は実行せずに記録する
+        if gated_stages:
+            signals = collect_cheap_signals(actual_ip, result, tor_nodes, cloud_provider)
+            skipped_stages = []
+            for name in gated_stages:
+                is_enabled = use_internetdb if name == 'internetdb' else stage_calls.get(name) is not None
+                if not is_enabled:
+                    continue
+                if not is_stage_permitted(enrichment_policy, name, signals):
+                    skipped_stages.append(name)
+                elif name == 'internetdb':
+                    stages['internetdb'] = prefetch_internetdb(actual_ip)
+                else:
+                    stages.update(dispatch_enrichment_stages({name: stage_calls[name]}))
+            if skipped_stages:
+                result['Skipped_Stages'] = skipped_stages
+
         # 2. VPNAPI.io による実地検証 (APIキーがある場合のみ上書き・結合)
-        if vpnapi_key:
-            proxy_data = get_vpnapi_data(actual_ip, vpnapi_key)
+        if 'vpnapi' in stages:
+            proxy_data = stages['vpnapi'].result()
             if proxy_data:
                 result['VPNAPI_JSON'] = proxy_data
                 sec = proxy_data.get('security', {})
@@ -1453,9 +2505,9 @@ def get_ip_details_from_api(ip, cidr_cache_snapshot, learned_isps_snapshot, dela
                     else:
                         result['Proxy_Type'] = "Standard Connection (API Verified)"
         
-        # --- RDAP等の補助データ取得 ---
-        if use_rdap:
-            rdap_res = fetch_rdap_data(actual_ip) 
+        # --- RDAP等の補助データ取得 (投入済みの段階の結果を合流させる) ---
+        if 'rdap' in stages:
+            rdap_res = stages['rdap'].result()
             if rdap_res:
                 raw_rdap_name = rdap_res['name']
                 result['RDAP_Name_Raw'] = raw_rdap_name 
@@ -1464,62 +2516,30 @@ def get_ip_details_from_api(ip, cidr_cache_snapshot, learned_isps_snapshot, dela
                 rdap_jp, _ = get_jp_names(raw_rdap_name, result['CountryCode'])
                 result['RDAP_JP'] = rdap_jp
 
-            is_composite = (actual_ip != ip and "(" in ip)
+        if 'ip_whois' in stages:
+            w_text_ip, w_server_ip = stages['ip_whois'].result()
+            if w_text_ip:
+                result['IP_WHOIS_TEXT'] = w_text_ip
+                result['IP_WHOIS_SERVER'] = w_server_ip
 
-            # 複合ターゲット（ドメインから解決されたIP）の場合は、生WHOISの取得をスキップしてIP-BANを防ぐ
-            if not is_composite and is_single_target:
-                w_text_ip, w_server_ip = fetch_classic_whois(actual_ip)
-                if w_text_ip:
-                    result['IP_WHOIS_TEXT'] = w_text_ip
-                    result['IP_WHOIS_SERVER'] = w_server_ip
-
-            if is_composite:
-                domain_part = ip.split("(")[0].strip()
-                res_d = fetch_domain_rdap_data(domain_part)
-                if res_d:
-                    result['DOMAIN_RDAP_JSON'] = res_d['json']
-                    result['DOMAIN_RDAP_URL'] = res_d['url']
-                
-                # RDAPの成否に関わらず、生のWHOISテキストは証拠として常に取得を試みる
-                if is_single_target:
-                    w_text, w_server = fetch_classic_whois(domain_part)
-                    if w_text:
-                        result['DOMAIN_WHOIS_TEXT'] = w_text
-                        result['DOMAIN_WHOIS_SERVER'] = w_server
-
-        is_composite = (actual_ip != ip and "(" in ip)
-        if is_composite and st_api_key:
-            st_res = get_securitytrails_data(ip.split("(")[0].strip(), st_api_key, st_start_date, st_end_date)
-            if st_res: result['ST_JSON'] = st_res
+        if 'domain' in stages:
+            result.update(stages['domain'].result())
 
-        if use_rdns:
-            rdns_hosts, rdns_raw = resolve_ip_nslookup(actual_ip)
+        if 'rdns' in stages:
+            rdns_hosts, rdns_raw = stages['rdns'].result()
             if rdns_raw: result['RDNS_DATA'] = {'hosts': rdns_hosts, 'raw': rdns_raw}
             if rdns_hosts: result['RDNS_Hosts'] = " / ".join(rdns_hosts)
 
-        if use_st_reverse_ip and st_api_key:
-            st_rev_res = get_securitytrails_reverse_ip(actual_ip, st_api_key, use_st_rev_fetchall)
+        if 'st_reverse' in stages:
+            st_rev_res = stages['st_reverse'].result()
             if st_rev_res: 
                 result['ST_REVERSE_IP_JSON'] = st_rev_res
-                records = st_rev_res.get('records', [])
-                
-                # 順序を保持したまま重複を排除してホスト名を抽出
-                hosts = []
-                for r in records:
-                    h = r.get('hostname')
-                    if h and h not in hosts:
-                        hosts.append(h)
-                
-                if hosts:
-                    # 一覧表・Excelでの視認性崩壊を防ぐため、表示上限を3件に設定
-                    display_limit = 3
-                    if len(hosts) > display_limit:
-                        result['ST_Reverse_Hosts'] = " / ".join(hosts[:display_limit]) + f" (他 {len(hosts) - display_limit}件)"
-                    else:
-                        result['ST_Reverse_Hosts'] = " / ".join(hosts)
+                result['ST_Reverse_Hosts'] = format_reverse_ip_hosts(st_rev_res)
 
-        if use_internetdb:
-            result['IoT_Risk'] = check_internetdb_risk(actual_ip)
+        if 'internetdb' in stages:
+            result['IoT_Risk'] = score_internetdb_risk(stages['internetdb'].result())
+        elif 'internetdb' in result.get('Skipped_Stages', ()):
+            result['IoT_Risk'] = "[Skipped (Policy)]"
         else:
             result['IoT_Risk'] = "[Not Checked]" 
 
@@ -1554,12 +2574,167 @@ def get_ip_details_from_api(ip, cidr_cache_snapshot, learned_isps_snapshot, dela
         result['Status'] = 'エラー: データ形式が不正 (JSON解析失敗)'
     except Exception as e:
         result['Status'] = f'エラー: 予期せぬシステム例外 ({type(e).__name__})'
+    finally:
+        # ジオ照会の失敗・保留で途中終了した場合、まだ開始していない補助照会は破棄して無駄な通信を防ぐ
+        for stage_future in stages.values():
+            stage_future.cancel()
 
     return result, new_cache_entry, new_learned_isp
 
-def get_domain_details(domain, nslookup_raw="", st_api_key=None, st_start_date=None, st_end_date=None, is_single_target=False):
+def format_reverse_ip_hosts(st_rev_res):
+    """ Reverse IPの結果から一覧表示用のホスト名文字列を生成する """
+    # 順序を保持したまま重複を排除してホスト名を抽出
+    hosts = list(dict.fromkeys(r.get('hostname') for r in st_rev_res.get('records', []) if r.get('hostname')))
+    if not hosts:
+        return ''
+    # 一覧表・Excelでの視認性崩壊を防ぐため、表示上限を3件に設定
+    display_limit = 3
+    if len(hosts) > display_limit:
+        return " / ".join(hosts[:display_limit]) + f" (他 {len(hosts) - display_limit}件)"
+    return " / ".join(hosts)
+
+# レンジをIP単位へ展開する際の上限 (/24 相当。InternetDB等のIP単位APIへの過剰アクセスを防ぐ)
+RANGE_FANOUT_LIMIT = 256
+
+def enrich_range_member(member_ip, base_result, tor_nodes, cloud_ip_data, use_internetdb, use_rdns, use_st_reverse_ip, st_api_key=None, use_st_rev_fetchall=False, internetdb_future=None, enrichment_policy=None, st_rate=SECURITYTRAILS_MAX_RPS):
+    """ レンジ照会結果 (ISP・国など) を引き継ぎ、IP単位で必要な解析だけを個別に実行する """
+    member = dict(base_result)
+    for heavy_key in ('RDAP_JSON', 'VPNAPI_JSON', 'IPINFO_JSON', 'DOMAIN_RDAP_JSON', 'ST_JSON', 'RDNS_DATA', 'ST_REVERSE_IP_JSON', 'DOMAIN_WHOIS_TEXT', 'IP_WHOIS_TEXT'):
+        member[heavy_key] = None
+    member['Target_IP'] = member_ip
+    member['Status'] = 'Success (Range Fan-out)'
+    member['RIR_Link'] = get_authoritative_rir_link(member_ip, member.get('CountryCode', 'N/A'))
+    member['Secondary_Security_Links'] = create_secondary_links(member_ip)
+    member['RDNS_Hosts'] = ''
+    member['ST_Reverse_Hosts'] = ''
+
+    # Tor・クラウド判定はローカルの公式リスト照合のみのため、IPごとに判定し直す
+    cloud_provider = check_cloud_provider(member_ip, cloud_ip_data)
+    if member_ip in tor_nodes:
+        member['Proxy_Type'] = "TorNode"
+    elif cloud_provider:
+        member['Proxy_Type'] = f"Hosting ({cloud_provider})"
+    else:
+        member['Proxy_Type'] = ""
+
+    # ISP・国はレンジ共通のため、照会ポリシーの判定にはレンジ代表の結果とIP単位のローカル判定を組み合わせる
+    signals = collect_cheap_signals(member_ip, member, tor_nodes, cloud_provider)
+    skipped_stages = []
+    if use_st_reverse_ip and st_api_key and not is_stage_permitted(enrichment_policy, 'st_reverse', signals):
+        skipped_stages.append('st_reverse')
+        use_st_reverse_ip = False
+    if use_internetdb and not is_stage_permitted(enrichment_policy, 'internetdb', signals):
+        skipped_stages.append('internetdb')
+        use_internetdb = False
+    if skipped_stages:
+        member['Skipped_Stages'] = skipped_stages
+
+    try:
+        if use_rdns:
+            rdns_hosts, rdns_raw = resolve_ip_nslookup(member_ip)
+            if rdns_raw: member['RDNS_DATA'] = {'hosts': rdns_hosts, 'raw': rdns_raw}
+            if rdns_hosts: member['RDNS_Hosts'] = " / ".join(rdns_hosts)
+
+        if use_st_reverse_ip and st_api_key:
+            st_rev_res = get_securitytrails_reverse_ip(member_ip, st_api_key, use_st_rev_fetchall, st_rate)
+            if st_rev_res:
+                member['ST_REVERSE_IP_JSON'] = st_rev_res
+                member['ST_Reverse_Hosts'] = format_reverse_ip_hosts(st_rev_res)
+
+        if use_internetdb:
+            member['IoT_Risk'] = score_internetdb_risk(internetdb_future.result()) if internetdb_future else check_internetdb_risk(member_ip)
+        elif 'internetdb' in skipped_stages:
+            member['IoT_Risk'] = "[Skipped (Policy)]"
+        else:
+            member['IoT_Risk'] = "[Not Checked]"
+    except Exception as e:
+        member['Status'] = f'エラー: 予期せぬシステム例外 ({type(e).__name__})'
+    return member
+
+def get_range_details(target, cidr_cache_snapshot, learned_isps_snapshot, delay_between_requests, rate_limit_wait_seconds, tor_nodes, cloud_ip_data, use_rdap, use_internetdb, use_rdns, use_st_reverse_ip, api_key=None, vpnapi_key=None, st_api_key=None, st_start_date=None, st_end_date=None, use_st_rev_fetchall=False, is_single_target=False, bulk_ipinfo_cache=None, enrichment_policy=None, st_rate=SECURITYTRAILS_MAX_RPS):
+    """ IPレンジを割り当て単位で1回だけ照会し、IP単位の解析が有効な場合のみメンバーIPへ結果を展開する """
+    parsed = parse_target(target)
+
+    # ISP・国・RDAPは割り当て単位の情報のため、代表アドレス (開始IP) の1回の照会で範囲全体を代表させる
+    # VPN判定・IoTリスク・逆引きはIPごとに異なるため、代表照会では実行しない
+    base_result, new_cache_entry, new_learned_isp = get_ip_details_from_api(
+        parsed.ip, cidr_cache_snapshot, learned_isps_snapshot, delay_between_requests, rate_limit_wait_seconds,
+        tor_nodes, cloud_ip_data, use_rdap, False, False, False,
+        api_key, None, None, None, None, False, is_single_target, bulk_ipinfo_cache
+    )
+    result = dict(base_result)
+    result['Target_IP'] = target
+    if not result.get('Status', '').startswith('Success'):
+        return result, None, None, []
+
+    result['Secondary_Security_Links'] = create_secondary_links(target)
+    result['Status'] = f"{result['Status']} [Range: {parsed.range_size} IPs]"
+
+    member_results = []
+    needs_fanout = use_internetdb or use_rdns or (use_st_reverse_ip and st_api_key)
+    if needs_fanout:
+        member_ips = list(iter_range_members(target, RANGE_FANOUT_LIMIT))
+        # メンバーIPのInternetDB照会は専用プールへまとめて投入し、逆引き等の逐次処理と並行させる (照会ポリシーの対象外となるIPは除く)
+        internetdb_futures = {}
+        if use_internetdb:
+            for member_ip in member_ips:
+                signals = collect_cheap_signals(member_ip, base_result, tor_nodes, check_cloud_provider(member_ip, cloud_ip_data))
+                if is_stage_permitted(enrichment_policy, 'internetdb', signals):
+                    internetdb_futures[member_ip] = prefetch_internetdb(member_ip)
+        for member_ip in member_ips:
+            member = enrich_range_member(
+                member_ip, base_result, tor_nodes, cloud_ip_data,
+                use_internetdb, use_rdns, use_st_reverse_ip, st_api_key, use_st_rev_fetchall,
+                internetdb_futures.get(member_ip), enrichment_policy, st_rate
+            )
+            member['Target_IP'] = range_member_key(target, member_ip)
+            member_results.append(member)
+            # InternetDBは専用プール、SecurityTrailsは共有のレート制御で間隔を取るため、待機は直接通信する逆引きのみに掛ける
+            if use_rdns:
+                time.sleep(delay_between_requests)
+        truncated_note = f" (先頭{RANGE_FANOUT_LIMIT}件のみ)" if parsed.range_size > RANGE_FANOUT_LIMIT else ""
+        result['IoT_Risk'] = f"[Range] {len(member_results)}件に展開{truncated_note}"
+    else:
+        result['IoT_Risk'] = "[Not Checked]"
+
+    return result, new_cache_entry, new_learned_isp, member_results
+
+def get_ip_group_details(group_targets, cidr_cache_snapshot, learned_isps_snapshot, delay_between_requests, rate_limit_wait_seconds, tor_nodes, cloud_ip_data, use_rdap, use_internetdb, use_rdns, use_st_reverse_ip, api_key=None, vpnapi_key=None, st_api_key=None, st_start_date=None, st_end_date=None, use_st_rev_fetchall=False, is_single_target=False, bulk_ipinfo_cache=None, enrichment_policy=None, st_rate=SECURITYTRAILS_MAX_RPS):
+    """ 同じ実IPを共有するターゲット群 (例: 同一CDN配下の複数ドメイン) をIP単位で1回だけ照会し、結果を各ターゲットへ配る """
+    lead_target = group_targets[0]
+    lead_result, new_cache_entry, new_learned_isp = get_ip_details_from_api(
+        lead_target, cidr_cache_snapshot, learned_isps_snapshot, delay_between_requests, rate_limit_wait_seconds,
+        tor_nodes, cloud_ip_data, use_rdap, use_internetdb, use_rdns, use_st_reverse_ip,
+        api_key, vpnapi_key, st_api_key, st_start_date, st_end_date, use_st_rev_fetchall, is_single_target, bulk_ipinfo_cache, enrichment_policy, st_rate
+    )
+    results = [lead_result]
+    is_success = lead_result.get('Status', '').startswith('Success')
+
+    for target in group_targets[1:]:
+        shared = dict(lead_result)
+        shared['Target_IP'] = target
+        # ドメイン固有の情報は先頭ターゲットのものを引き継がず、ドメインごとに取り直す
+        for domain_key in ('DOMAIN_RDAP_JSON', 'ST_JSON', 'DOMAIN_WHOIS_TEXT', 'DOMAIN_WHOIS_SERVER'):
+            shared[domain_key] = None
+        shared['DOMAIN_RDAP_URL'] = ''
+        shared.pop('Skipped_Stages', None) # 節約した照会はIP単位で1回のみ数える
+        if is_success:
+            shared['Secondary_Security_Links'] = create_secondary_links(target)
+            try:
+                apply_domain_stages(shared, target, use_rdap, st_api_key, st_start_date, st_end_date, is_single_target, st_rate)
+            except requests.exceptions.RequestException:
+                pass # IP側の照会結果は有効なため、ドメイン固有情報の取得失敗で行全体をエラーにしない
+            except Exception as e:
+                # 想定外の例外もこのメンバーだけに留め、グループ内の他のターゲットの結果は返す
+                import logging
+                logging.warning(f"ドメイン固有情報の取得中に予期せぬ例外が発生しました ({target}): {type(e).__name__}: {e}")
+        results.append(shared)
+
+    return results, new_cache_entry, new_learned_isp
+
+def get_domain_details(domain, nslookup_raw="", st_api_key=None, st_start_date=None, st_end_date=None, is_single_target=False, dns_records=None, st_rate=SECURITYTRAILS_MAX_RPS):
     # 捨てアド検知を実行
-    detected_disposables = check_disposable_domain(domain, nslookup_raw)
+    detected_disposables = check_disposable_domain(domain, nslookup_raw, dns_records)
     proxy_type_val = f"⚠️ 捨てアド ({' / '.join(detected_disposables)})" if detected_disposables else "N/A (Domain)"
 
     # TLD情報辞書から公式レジストリのリンクと日本語名を動的生成
@@ -1577,7 +2752,7 @@ def get_domain_details(domain, nslookup_raw="", st_api_key=None, st_start_date=N
     # --- 1. SecurityTrails (日付フィルタ対応) ---
     st_json = None
     if st_api_key:
-        st_json = get_securitytrails_data(domain, st_api_key, st_start_date, st_end_date)
+        st_json = get_securitytrails_data(domain, st_api_key, st_start_date, st_end_date, st_rate)
     
     # --- 2. ドメインRDAPとWHOISの取得  ---
     domain_rdap_json = None
@@ -1643,7 +2818,7 @@ def get_domain_details(domain, nslookup_raw="", st_api_key=None, st_start_date=N
     }
 
 def get_simple_mode_details(target):
-    if is_valid_ip(target):
+    if is_valid_ip(target) or is_ip_range(target):
         rir_link_content = f"[Whois (汎用検索 - APNIC窓口)]({RIR_LINKS['APNIC']})"
     else:
         tld_val = target.split('.')[-1].lower() if '.' in target else ""
@@ -1671,179 +2846,844 @@ def get_simple_mode_details(target):
 
 # --- ヘルパー関数群 ---
 
-def group_results_by_isp(results):
-    grouped = {}
-    final_grouped_results = []
-    non_aggregated_results = []
-    successful_results = [res for res in results if res['Status'].startswith('Success')]
-
-    for res in successful_results:
-        is_ip = is_valid_ip(res['Target_IP'])
-        if not is_ip or not is_ipv4(res['Target_IP']) or res['ISP'] == 'N/A' or res['Country'] == 'N/A' or res['ISP'] == 'N/A (簡易モード)':
-            if res['Status'].startswith('Success (IPv4 CIDR Cache)'):
-                non_aggregated_results.append(res)
-            else:
-                non_aggregated_results.append(res)
-            continue
-        
-        key = (res['ISP'], res['CountryCode']) 
-        
-        if key not in grouped:
-            grouped[key] = {
-                'IP_Ints': [], 'IPs_List': [], 'RIR_Link': res['RIR_Link'],
-                'Secondary_Security_Links': res['Secondary_Security_Links'],
-                'ISP': res['ISP'], 
-                'Country': res['Country'], 
-                'Status': res['Status'],
-                'ISP_JP': res.get('ISP_JP', 'N/A'),
-                'Country_JP': res.get('Country_JP', 'N/A')
-            }
-        ip_int = ip_to_int(res['Target_IP'])
-        if ip_int != 0:
-            grouped[key]['IP_Ints'].append(ip_int)
-            grouped[key]['IPs_List'].append(res['Target_IP'])
-        else:
-            res['Status'] = 'Error: IPv4 Int Conversion Failed'
-            non_aggregated_results.append(res)
+def frame_rows_to_dicts(frame, positions=None):
+    """ 結果のDataFrameから指定位置の行だけをdictへ戻す (欠損値のキーは含めない。選択行の詳細表示など少数行の参照用) """
+    subset = frame if positions is None else frame.iloc[list(positions)]
+    return [{k: v for k, v in row.items() if v is not None and not (isinstance(v, float) and math.isnan(v))} for row in subset.to_dict('records')]
 
-    non_aggregated_results.extend([res for res in results if not res['Status'].startswith('Success')])
-    
-    for key, data in grouped.items():
-        if not data['IP_Ints']: 
-            continue
-            
-        sorted_ip_ints = sorted(data['IP_Ints'])
-        min_int = sorted_ip_ints[0]
-        max_int = sorted_ip_ints[-1]
-        count = len(data['IPs_List'])
-        try:
-            min_ip = str(ipaddress.IPv4Address(min_int))
-            max_ip = str(ipaddress.IPv4Address(max_int))
-        except ValueError:
-            min_ip = data['IPs_List'][0]
-            max_ip = data['IPs_List'][-1]
-        
-        target_ip_display = min_ip if count == 1 else f"{min_ip} - {max_ip} (x{count} IPs)"
-        status_display = data['Status'] if count == 1 else f"Aggregated ({count} IPs)"
-        
-        final_grouped_results.append({
-            'Target_IP': target_ip_display, 
-            'Country': data['Country'], 
-            'Country_JP': data['Country_JP'], 
-            'ISP': data['ISP'],
-            'ISP_JP': data['ISP_JP'], 
-            'RIR_Link': data['RIR_Link'], 
-            'Secondary_Security_Links': data['Secondary_Security_Links'],
-            'Status': status_display,
+def text_column(frame, column, default='N/A'):
+    """ 列を欠損値補完済みの文字列Seriesとして返す (列自体がない場合は既定値で埋める) """
+    if column not in frame.columns:
+        return pd.Series(default, index=frame.index, dtype=object)
+    return frame[column].astype(object).where(frame[column].notna(), default).astype(str)
+
+def group_results_by_isp(results):
+    """ 成功行をISP・国単位で集約したDataFrameを返す (集約行の後ろに、集約できない行と成功以外の行を元の順序で連結する) """
+    status = text_column(results, 'Status', '')
+    target_ip = text_column(results, 'Target_IP', '')
+    isp = text_column(results, 'ISP')
+    country = text_column(results, 'Country')
+    is_success = status.str.startswith('Success')
+
+    groupable = is_success & target_ip.map(lambda t: is_valid_ip(t) and is_ipv4(t)) & ~isp.isin(['N/A', 'N/A (簡易モード)']) & (country != 'N/A')
+    ip_ints = target_ip.where(groupable).map(lambda t: ip_to_int(t) if isinstance(t, str) else 0)
+    failed = groupable & (ip_ints == 0)
+    if failed.any():
+        results = results.assign(Status=status.where(~failed, 'Error: IPv4 Int Conversion Failed'))
+    groupable &= ~failed
+
+    members = pd.DataFrame({
+        'ISP': isp, 'CountryCode': text_column(results, 'CountryCode'), 'Country': country, 'Status': status, 'IP_Int': ip_ints,
+        'Country_JP': text_column(results, 'Country_JP'), 'ISP_JP': text_column(results, 'ISP_JP'),
+        'RIR_Link': text_column(results, 'RIR_Link', ''), 'Secondary_Security_Links': text_column(results, 'Secondary_Security_Links', ''),
+    })[groupable]
+    grouped_rows = []
+    for _, group in members.groupby(['ISP', 'CountryCode'], sort=False):
+        first = group.iloc[0]
+        count = len(group)
+        min_ip = str(ipaddress.IPv4Address(int(group['IP_Int'].min())))
+        max_ip = str(ipaddress.IPv4Address(int(group['IP_Int'].max())))
+        grouped_rows.append({
+            'Target_IP': min_ip if count == 1 else f"{min_ip} - {max_ip} (x{count} IPs)",
+            'Country': first['Country'],
+            'Country_JP': first['Country_JP'],
+            'ISP': first['ISP'],
+            'ISP_JP': first['ISP_JP'],
+            'RIR_Link': first['RIR_Link'],
+            'Secondary_Security_Links': first['Secondary_Security_Links'],
+            'Status': first['Status'] if count == 1 else f"Aggregated ({count} IPs)",
             'IoT_Risk': 'Aggr Mode (Skip)' # 集約時はShodan個別判定は省略
         })
-    
-    final_grouped_results.extend(non_aggregated_results)
 
-    return final_grouped_results
+    non_aggregated = results[is_success & ~groupable]
+    others = results[~is_success]
+    return pd.concat([pd.DataFrame(grouped_rows), non_aggregated, others], ignore_index=True)
 
 # --- リアルタイム集計関数 ---
-def summarize_in_realtime(raw_results):
-    isp_counts = {}
-    country_counts = {}
-    country_code_counts = {}
-    proxy_counts = {} 
+# 画像やダッシュボードの可視化向上のため「株式会社」等の法人格表記を削除する (行ごとにコンパイルしないよう事前構築)
+LEGAL_ENTITY_PATTERN = re.compile(r'(株式会社|有限会社|合同会社|一般社団法人|財団法人|\(株\)|（株）|Inc\.|Co\.,\s*Ltd\.|Corp\.|Corporation)', re.IGNORECASE)
 
-    target_frequency = st.session_state.get('target_freq_map', {})
-    st.session_state['debug_summary'] = {} 
-
-    country_all_df_raw = pd.DataFrame({
-        'NumericCode': pd.Series(dtype='int64'), 
-        'Count': pd.Series(dtype='int64'),
-        'Country': pd.Series(dtype='str')
-    })
+def new_summary_aggregator(raw_results, target_frequency):
+    """ 集計用カウンター群を初期化する (集計元のリスト・頻度表への参照を保持して差し替えを検知する) """
+    return {
+        'source': raw_results, 'freq_source': target_frequency, 'processed': 0,
+        'isp': Counter(), 'country': Counter(), 'country_code': Counter(), 'proxy': Counter(), 'freq': Counter()
+    }
 
-    success_ipv4 = [
-        r for r in raw_results 
-        if r['Status'].startswith('Success') and is_ipv4(r['Target_IP'])
-    ]
+def update_summary_aggregator(raw_results):
+    """ 前回の集計以降に追加された結果だけをカウンターへ反映する (1回の更新コストは新規件数に比例) """
+    target_frequency = st.session_state.get('target_freq_map', {})
+    agg = st.session_state.get('summary_aggregator')
+    # 結果リストの差し替え (リカバリ・簡易モード) や頻度表の更新を検知した場合のみ最初から数え直す
+    if agg is None or agg['source'] is not raw_results or agg['freq_source'] is not target_frequency or agg['processed'] > len(raw_results):
+        agg = new_summary_aggregator(raw_results, target_frequency)
+        st.session_state['summary_aggregator'] = agg
 
-    for r in success_ipv4:
+    for r in raw_results[agg['processed']:]:
         ip = r.get('Target_IP')
-        frequency = target_frequency.get(ip, 1) 
+        if ip in target_frequency:
+            agg['freq'][ip] = target_frequency[ip]
+
+        # レンジ行も代表IPv4の割り当てとして集計する
+        if not (r['Status'].startswith('Success') and parse_target(ip).version == 4):
+            continue
+        frequency = target_frequency.get(ip, 1)
 
         isp_name = r.get('ISP_JP', r.get('ISP', 'N/A'))
-        
-        # 画像やダッシュボードの可視化向上のため「株式会社」等の法人格表記を削除
         if isp_name and isp_name not in ['N/A', 'N/A (簡易モード)']:
-            isp_name = re.sub(r'(株式会社|有限会社|合同会社|一般社団法人|財団法人|\(株\)|（株）|Inc\.|Co\.,\s*Ltd\.|Corp\.|Corporation)', '', isp_name, flags=re.IGNORECASE).strip()
-            
+            isp_name = LEGAL_ENTITY_PATTERN.sub('', isp_name).strip()
+            agg['isp'][isp_name] += frequency
+
         country_name = r.get('Country_JP', r.get('Country', 'N/A'))
-        cc = r.get('CountryCode', 'N/A')
-        
-        # プロキシ判定の取得
-        proxy_val = r.get('Proxy_Type', '')
-        if not proxy_val: 
-            # API不使用時かつローカル検知(Tor/Cloud)に引っかからなかった場合の客観的な表現
-            proxy_val = "API未検証"
-            
-        if isp_name and isp_name not in ['N/A', 'N/A (簡易モード)']:
-            isp_counts[isp_name] = isp_counts.get(isp_name, 0) + frequency
-        
         if country_name and country_name != 'N/A':
-            country_counts[country_name] = country_counts.get(country_name, 0) + frequency
-            
+            agg['country'][country_name] += frequency
+
+        cc = r.get('CountryCode', 'N/A')
         if cc and cc != 'N/A':
-            country_code_counts[cc] = country_code_counts.get(cc, 0) + frequency
-            
-        proxy_counts[proxy_val] = proxy_counts.get(proxy_val, 0) + frequency # ⬅️ NEW: 集計
+            agg['country_code'][cc] += frequency
+
+        # API不使用時かつローカル検知(Tor/Cloud)に引っかからなかった場合の客観的な表現
+        proxy_val = r.get('Proxy_Type', '') or "API未検証"
+        agg['proxy'][proxy_val] += frequency
+
+    agg['processed'] = len(raw_results)
+    return agg
+
+def counter_to_df(counter, name_col, top_n=None):
+    """ カウンターを件数降順のデータフレームに変換する (top_n指定時は上位のみをヒープで抽出) """
+    items = counter.most_common(top_n)
+    return pd.DataFrame(items, columns=[name_col, 'Count']) if items else pd.DataFrame(columns=[name_col, 'Count'])
+
+def summarize_in_realtime(raw_results, include_full=True):
+    """ 集計カウンターから上位10件のビューを生成する (include_full=False の場合は全件表の構築を省略) """
+    agg = update_summary_aggregator(raw_results)
+    st.session_state['debug_summary'] = {} 
 
     # --- ISP集計 ---
-    isp_full_df = pd.DataFrame(list(isp_counts.items()), columns=['ISP', 'Count']).sort_values('Count', ascending=False)
-    isp_df = isp_full_df.head(10).copy() if not isp_full_df.empty else pd.DataFrame(columns=['ISP', 'Count'])
+    isp_df = counter_to_df(agg['isp'], 'ISP', 10)
     if not isp_df.empty: isp_df['ISP'] = isp_df['ISP'].str.wrap(25)
 
     # --- 国集計 ---
-    country_full_df = pd.DataFrame(list(country_counts.items()), columns=['Country', 'Count']).sort_values('Count', ascending=False)
-    country_df = country_full_df.head(10).copy() if not country_full_df.empty else pd.DataFrame(columns=['Country', 'Count'])
+    country_df = counter_to_df(agg['country'], 'Country', 10)
     if not country_df.empty: country_df['Country'] = country_df['Country'].str.wrap(25)
 
-    # --- プロキシ集計 ---
-    proxy_full_df = pd.DataFrame(list(proxy_counts.items()), columns=['Proxy_Type', 'Count']).sort_values('Count', ascending=False)
-    proxy_df = proxy_full_df.copy() if not proxy_full_df.empty else pd.DataFrame(columns=['Proxy_Type', 'Count'])
+    # --- プロキシ集計 ---
+    proxy_df = counter_to_df(agg['proxy'], 'Proxy_Type')
+
+    # ヒートマップ用
+    country_code_counts = dict(agg['country_code'])
+    country_all_df_raw = pd.DataFrame({
+        'NumericCode': pd.Series(dtype='int64'), 
+        'Count': pd.Series(dtype='int64'),
+        'Country': pd.Series(dtype='str')
+    })
+    if country_code_counts:
+        map_data = []
+        for cc, cnt in country_code_counts.items():
+            num = COUNTRY_CODE_TO_NUMERIC_ISO.get(cc)
+            if num is not None:
+                map_data.append({'NumericCode': int(num), 'Count': int(cnt), 'Country': COUNTRY_JP_NAME.get(cc, cc)})
+        
+        # DataFrame構築時のKeyErrorを完全に防ぐフェイルセーフ
+        if map_data:
+            country_all_df_raw = pd.DataFrame(map_data).astype({'NumericCode': 'int64', 'Count': 'int64'})
+        else:
+            country_all_df_raw = pd.DataFrame(columns=['NumericCode', 'Count', 'Country'])
+            
+    st.session_state['debug_summary']['country_code_counts'] = country_code_counts
+    st.session_state['debug_summary']['country_all_df'] = country_all_df_raw.to_dict('records')
+
+    # --- ターゲット頻度集計 ---
+    freq_df = counter_to_df(agg['freq'], 'Target_IP', 10)
+
+    # 全件表はダウンロード・レポート用のため、検索完了後の集計時のみ構築する
+    if include_full:
+        isp_full_df = counter_to_df(agg['isp'], 'ISP')
+        country_full_df = counter_to_df(agg['country'], 'Country')
+        freq_full_df = counter_to_df(agg['freq'], 'Target_IP')
+    else:
+        isp_full_df = country_full_df = freq_full_df = None
+
+    return isp_df, country_df, freq_df, country_all_df_raw, isp_full_df, country_full_df, freq_full_df, proxy_df
+
+# --- 検索結果ストア ---
+# 値の種類が少ない列 (ISP・国・ステータス等) は辞書エンコードし、同じ文字列を行ごとに保持しない
+RESULT_DICTIONARY_COLUMNS = {'ISP', 'ISP_JP', 'ISP_API_Raw', 'RDAP', 'RDAP_Name_Raw', 'RDAP_JP', 'Country', 'Country_JP', 'CountryCode', 'Status', 'Proxy_Type', 'IoT_Risk'}
+# 追記バッファがこの行数に達した時点で列指向のチャンクへ確定する
+RESULT_STORE_CHUNK_ROWS = 2048
+# 行にキー自体が存在しないことを表す目印 (値が None の列と区別する)
+_MISSING = object()
+
+def encode_result_column(key, values):
+    """ 1列分の値を Arrow 配列へ変換する (文字列・数値以外が混在する列は Python のリストのまま保持する) """
+    present = [v for v in values if v is not _MISSING]
+    value_types = {type(v) for v in present}
+    if value_types <= {str}:
+        arrow_type = pa.string()
+    elif value_types <= {float}:
+        arrow_type = pa.float64()
+    elif value_types <= {int}:
+        arrow_type = pa.int64()
+    else:
+        return values
+    arr = pa.array([None if v is _MISSING else v for v in values], type=arrow_type)
+    if arrow_type == pa.string() and key in RESULT_DICTIONARY_COLUMNS:
+        arr = arr.dictionary_encode()
+    return arr
+
+class ResultStore:
+    """ 検索結果を列指向 (Apache Arrow) で保持するストア。list と同じ操作 (append / len / 反復 / 添字・スライス) で扱える """
+
+    def __init__(self, rows=None):
+        self._chunks = [] # 確定済みチャンク: (行数, {列名: Arrow配列 または リスト})
+        self._buffer = [] # 未確定の行 (dictのまま保持)
+        self._length = 0
+        if rows:
+            self.extend(rows)
+
+    def append(self, row):
+        self._buffer.append(row)
+        self._length += 1
+        if len(self._buffer) >= RESULT_STORE_CHUNK_ROWS:
+            self._chunks.append(self._encode(self._buffer))
+            self._buffer = []
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def clear(self):
+        self._chunks = []
+        self._buffer = []
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def __bool__(self):
+        return self._length > 0
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield from self._decode(chunk)
+        yield from self._buffer
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step != 1:
+                return list(self)[index]
+            return list(self._iter_range(start, stop))
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('result index out of range')
+        return next(self._iter_range(index, index + 1))
+
+    def _iter_range(self, start, stop):
+        """ 指定範囲を含むチャンクだけを復元して行を返す (増分集計が新着分のみを読む際に全件を展開しない) """
+        offset = 0
+        for chunk in self._chunks:
+            size = chunk[0]
+            if offset < stop and offset + size > start:
+                yield from self._decode(chunk)[max(start - offset, 0):stop - offset]
+            offset += size
+        yield from self._buffer[max(start - offset, 0):max(stop - offset, 0)]
+
+    @staticmethod
+    def _encode(rows):
+        keys = list(dict.fromkeys(k for row in rows for k in row))
+        columns = {key: encode_result_column(key, [row.get(key, _MISSING) for row in rows]) for key in keys}
+        return len(rows), columns
+
+    @staticmethod
+    def _decode(chunk):
+        size, columns = chunk
+        rows = [{} for _ in range(size)]
+        for key, col in columns.items():
+            # Arrow配列では null がキー欠損を表す
+            missing = None if isinstance(col, pa.Array) else _MISSING
+            values = col.to_pylist() if missing is None else col
+            for row, value in zip(rows, values):
+                if value is not missing:
+                    row[key] = value
+        return rows
+
+    def to_pandas(self, columns=None):
+        """ 列指向のまま DataFrame へ変換する (文字列列はArrow配列を共有し、辞書エンコード列はカテゴリ型になる) """
+        chunks = self._chunks + ([self._encode(self._buffer)] if self._buffer else [])
+        if columns is None:
+            columns = list(dict.fromkeys(k for _, cols in chunks for k in cols))
+        data = {}
+        for key in columns:
+            parts = [(size, cols.get(key)) for size, cols in chunks]
+            arrow_parts = [col for _, col in parts if isinstance(col, pa.Array)]
+            if len(arrow_parts) == len([col for _, col in parts if col is not None]) and arrow_parts and len({a.type for a in arrow_parts}) == 1:
+                arrow_type = arrow_parts[0].type
+                chunked = pa.chunked_array([col if col is not None else pa.nulls(size, arrow_type) for size, col in parts], type=arrow_type)
+                data[key] = chunked.to_pandas()
+            else:
+                # 型が混在する列は行単位の値を object 列として連結する
+                values = []
+                for size, col in parts:
+                    if col is None:
+                        values.extend([None] * size)
+                    elif isinstance(col, pa.Array):
+                        values.extend(col.to_pylist())
+                    else:
+                        values.extend(None if v is _MISSING else v for v in col)
+                data[key] = pd.Series(values, dtype=object)
+        return pd.DataFrame(data, index=pd.RangeIndex(self._length))
+
+# --- 詳細データストア ---
+# 詳細データ (生JSON・WHOISテキスト) の圧縮ブロブを書き出す親ディレクトリ (ローカルモードのみ)
+DETAIL_BLOB_ROOT = "whois_detail_blobs"
+# 展開済みブロブをメモリに保持する件数 (LRU)
+DETAIL_CACHE_ENTRIES = 128
+# 最後の書き込みからこの期間を過ぎたセッション用ディレクトリは、終了済みのセッションのものとして削除する (秒)
+DETAIL_BLOB_MAX_AGE = 3 * 86400
+# 古いディレクトリを探す間隔 (秒)
+DETAIL_BLOB_SWEEP_INTERVAL = 3600
+DETAIL_BLOB_DIR_PATTERN = re.compile(re.escape(DETAIL_BLOB_ROOT) + r'[/\\]+([0-9a-f]{32})')
+
+def referenced_detail_directories():
+    """ 中断時のバックアップが参照しているセッション用ディレクトリ名 (復元に必要なため削除しない) """
+    names = set()
+    for path in (BACKUP_JOURNAL_FILE, BACKUP_DETAILS_FILE):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    names.update(DETAIL_BLOB_DIR_PATTERN.findall(line))
+        except OSError:
+            pass
+    return names
+
+def remove_stale_detail_directories(now=None):
+    """ ブラウザを閉じる等でリセットされずに終わったセッションのディレクトリを、最終書き込み時刻を基準に削除する """
+    now = now or time.time()
+    try:
+        names = os.listdir(DETAIL_BLOB_ROOT)
+    except OSError:
+        return 0
+    protected = referenced_detail_directories()
+    removed = 0
+    for name in names:
+        path = os.path.join(DETAIL_BLOB_ROOT, name)
+        if name in protected or not os.path.isdir(path):
+            continue
+        try:
+            last_write = os.path.getmtime(path)
+            for root, _, files in os.walk(path):
+                last_write = max([last_write, os.path.getmtime(root)] + [os.path.getmtime(os.path.join(root, f)) for f in files])
+        except OSError:
+            continue
+        if now - last_write >= DETAIL_BLOB_MAX_AGE:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+@st.cache_resource(ttl=DETAIL_BLOB_SWEEP_INTERVAL, show_spinner=False)
+def sweep_detail_blob_directories():
+    """ 古いセッション用ディレクトリの掃除を、プロセス全体で一定間隔ごとに1回だけ行う """
+    return remove_stale_detail_directories()
+
+class DetailStore:
+    """ 詳細データを内容ハッシュ単位で圧縮保存し、ターゲット側には参照 (ハッシュ) だけを持たせるストア。dict と同じ get / in / [] で読み出せる """
+
+    def __init__(self, directory=None, refs=None):
+        self.directory = directory # None の場合はディスクを使わず圧縮済みブロブをメモリに保持する
+        self.refs = refs or {}     # ターゲット -> {キー: ハッシュ}
+        self._blobs = {}
+        self._cache = OrderedDict()
+
+    @classmethod
+    def create(cls):
+        """ 公開モードではメモリ上に、ローカルモードではセッション専用のディレクトリにブロブを保存するストアを作る """
+        if IS_PUBLIC_MODE:
+            return cls()
+        sweep_detail_blob_directories()
+        return cls(os.path.join(DETAIL_BLOB_ROOT, uuid.uuid4().hex))
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _put_blob(self, value):
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        if self.directory is None:
+            self._blobs.setdefault(digest, zlib.compress(data))
+            return digest
+        path = self._blob_path(digest)
+        # 同一内容 (同じネットワークのRDAP応答等) は既存のブロブを共有し、一度しか書き出さない
+        if not os.path.exists(path):
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(zlib.compress(data))
+                os.replace(tmp_path, path)
+            except OSError as e:
+                import logging
+                logging.warning(f"詳細データの書き出しに失敗したため、メモリに保持します: {e}")
+                self._blobs.setdefault(digest, zlib.compress(data))
+        return digest
+
+    def _load_blob(self, digest):
+        if digest in self._cache:
+            self._cache.move_to_end(digest)
+            return self._cache[digest]
+        try:
+            compressed = self._blobs.get(digest)
+            if compressed is None:
+                with open(self._blob_path(digest), "rb") as f:
+                    compressed = f.read()
+            value = json.loads(zlib.decompress(compressed))
+        except (OSError, TypeError, zlib.error, ValueError):
+            return None
+        self._cache[digest] = value
+        if len(self._cache) > DETAIL_CACHE_ENTRIES:
+            self._cache.popitem(last=False)
+        return value
+
+    def __setitem__(self, target, payload):
+        self.refs[target] = {key: self._put_blob(value) for key, value in payload.items()}
+
+    def __getitem__(self, target):
+        # 参照からブロブを読み出すのは、レポート表示等で実際に必要になった時点のみ
+        return {key: self._load_blob(digest) for key, digest in self.refs[target].items()}
+
+    def get(self, target, default=None):
+        return self[target] if target in self.refs else default
+
+    def get_field(self, target, key, default=None):
+        """ 1項目だけを読み出す (他の項目のブロブは展開しない) """
+        digest = self.refs.get(target, {}).get(key)
+        if digest is None:
+            return default
+        value = self._load_blob(digest)
+        return default if value is None else value
+
+    def __contains__(self, target):
+        return target in self.refs
+
+    def __len__(self):
+        return len(self.refs)
+
+    def clear(self):
+        """ 参照とメモリ上のデータを破棄し、このストアのディレクトリも削除する """
+        self.refs = {}
+        self._blobs = {}
+        self._cache.clear()
+        if self.directory and os.path.isdir(self.directory):
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def to_state(self):
+        """ バックアップ用に参照情報だけを返す (ブロブ本体はディスク上に既に存在する) """
+        return {'directory': self.directory, 'refs': self.refs}
+
+    @classmethod
+    def from_state(cls, state):
+        """ バックアップから復元する (参照形式以前のバックアップは詳細データをそのまま取り込み直す) """
+        if set(state) == {'directory', 'refs'}:
+            return cls(state['directory'], state['refs'])
+        store = cls.create()
+        for target, payload in state.items():
+            store[target] = payload
+        return store
+
+# --- 検索結果の反映 ---
+HEAVY_RESULT_KEYS = ['RDAP_JSON', 'VPNAPI_JSON', 'IPINFO_JSON', 'DOMAIN_RDAP_JSON', 'ST_JSON', 'RDNS_DATA', 'ST_REVERSE_IP_JSON', 'DOMAIN_WHOIS_TEXT', 'IP_WHOIS_TEXT']
+# 検索中の画面 (進捗・リアルタイム分析) の更新間隔 (秒)
+UI_REFRESH_INTERVAL = 1.5
+
+def store_result_row(res):
+    """ 詳細データ (生JSON等) を分離して保存し、一覧用の軽量な行だけを結果リストへ追加する """
+    ip = res['Target_IP']
+    st.session_state.detailed_data[ip] = {k: res.pop(k) for k in HEAVY_RESULT_KEYS if k in res}
+    st.session_state.raw_results.append(res)
+
+def apply_worker_result(res_tuple, progress):
+    """ ワーカー1件分の戻り値 (結果・CIDRキャッシュ・学習済みISP・レンジ展開結果) をセッションへ反映する """
+    new_cache_entry = res_tuple[1] if len(res_tuple) > 1 else None
+    new_learned_isp = res_tuple[2] if len(res_tuple) > 2 else None
+    range_member_results = res_tuple[3] if len(res_tuple) > 3 else []
+    # IPグループ単位のワーカーは複数ターゲット分の結果をリストで返す
+    group_results = res_tuple[0] if isinstance(res_tuple[0], list) else [res_tuple[0]]
+
+    # 照会ポリシーで省略した段階は結果行には残さず、節約件数として数える
+    for res in group_results + range_member_results:
+        progress.setdefault('skipped_calls', Counter()).update(res.pop('Skipped_Stages', ()))
+    
+    # トリアージ1段階目の結果は詳細照会を省いた浅い結果のため、後続の通常検索へ流用されないようCIDRキャッシュに残さない
+    if new_cache_entry and (st.session_state.get('triage') or {}).get('phase') != 1:
+        st.session_state.cidr_cache.update(new_cache_entry)
+        journal_cache_entries(new_cache_entry)
+    
+    # メインスレッド側で学習済みリストを安全に更新
+    if new_learned_isp:
+        st.session_state.learned_proxy_isps.update(new_learned_isp)
+
+    for res in group_results:
+        ip = res['Target_IP']
+        record_progress(progress, res, newly_finished=(not res.get('Defer_Until') and ip not in st.session_state.finished_ips))
+        if res.get('Defer_Until') and not res.get('Status', '').startswith('Success'):
+            st.session_state.deferred_ips[ip] = res['Defer_Until']
+            continue
+
+        store_result_row(res)
+        st.session_state.finished_ips.add(ip)
+
+        # レンジ展開されたメンバーIPは結果行のみ追加する (検索対象数・完了判定には含めない)
+        if res.get('Status', '').startswith('Success'):
+            for member_res in range_member_results:
+                store_result_row(member_res)
+
+# --- 進捗カウンター ---
+PROGRESS_EWMA_ALPHA = 0.3
+STATUS_PROVIDER_PATTERN = re.compile(r'^Success \(([^)]*)\)')
+
+def init_progress_counters(finished_targets=()):
+    """ 進捗カウンターを初期化する (リカバリ再開時のみ完了済みターゲットから一度だけ数え直す) """
+    completed = sum(1 for t in finished_targets if is_valid_ip(t) or is_ip_range(t))
+    return {
+        'completed': completed, 'cached': 0, 'errors': 0, 'deferred_events': 0, 'providers': Counter(), 'skipped_calls': Counter(),
+        'rate_ewma': 0.0, 'last_count': completed, 'last_time': time.time()
+    }
+
+def get_progress_counters():
+    progress = st.session_state.get('search_progress')
+    if progress is None:
+        progress = init_progress_counters(st.session_state.get('finished_ips', set()))
+        st.session_state['search_progress'] = progress
+    return progress
+
+def record_progress(progress, res, newly_finished):
+    """ ワーカーから結果を受け取るたびにカウンターを更新する (完了済みターゲットの再走査を行わない) """
+    status = res.get('Status', '')
+    if res.get('Defer_Until'):
+        progress['deferred_events'] += 1
+        return
+    if newly_finished:
+        progress['completed'] += 1
+    if not status.startswith('Success'):
+        progress['errors'] += 1
+        return
+    m = STATUS_PROVIDER_PATTERN.match(status)
+    provider = m.group(1) if m else 'Other'
+    progress['providers'][provider] += 1
+    if 'Cache' in provider:
+        progress['cached'] += 1
+
+def update_throughput_estimate(progress, now=None):
+    """ 直近のスループットを指数加重移動平均で更新し、1秒あたりの完了件数を返す """
+    now = now or time.time()
+    elapsed = now - progress['last_time']
+    if elapsed <= 0:
+        return progress['rate_ewma']
+    instant_rate = (progress['completed'] - progress['last_count']) / elapsed
+    if progress['rate_ewma'] <= 0:
+        progress['rate_ewma'] = instant_rate
+    else:
+        progress['rate_ewma'] = PROGRESS_EWMA_ALPHA * instant_rate + (1 - PROGRESS_EWMA_ALPHA) * progress['rate_ewma']
+    progress['last_count'] = progress['completed']
+    progress['last_time'] = now
+    return progress['rate_ewma']
+
+def format_saved_calls(progress):
+    """ 照会ポリシーにより省略した照会件数を段階別に表示用の文字列へ変換する """
+    return " / ".join(f"{ENRICHMENT_STAGE_LABELS.get(k, k)}: {v}" for k, v in progress.get('skipped_calls', Counter()).most_common())
+
+def format_eta(remaining_count, rate):
+    if rate <= 0 or remaining_count <= 0:
+        return "計算中..."
+    eta_seconds = math.ceil(remaining_count / rate)
+    return f"{int(eta_seconds // 60):02d}分{int(eta_seconds % 60):02d}秒"
+
+# --- 実行計画 (ドライラン見積もり) ---
+# 各プロバイダーの利用上限の目安 (無料枠): {プロバイダー: (上限回数, 期間)}
+PROVIDER_QUOTAS = {
+    "IPinfo": (50000, "月"),
+    "VPNAPI": (1000, "日"),
+    "SecurityTrails": (50, "月"),
+}
+# ip-api (無料版) の1分あたりのリクエスト上限
+IP_API_RATE_PER_MINUTE = 45
+# 見積もりに使う1リクエストあたりの平均応答時間 (秒)
+PLANNER_AVG_LATENCY = 0.6
+# IPinfo Bulk APIの1リクエストあたりの最大件数 (fetch_ipinfo_bulk のチャンクサイズと同じ)
+IPINFO_BULK_CHUNK = 1000
+
+def format_duration(seconds):
+    """ 見積もり時間を「約X時間Y分」形式で表示する """
+    seconds = int(math.ceil(seconds))
+    if seconds < 60:
+        return f"約{seconds}秒"
+    hours, minutes = divmod(math.ceil(seconds / 60), 60)
+    return f"約{hours}時間{minutes:02d}分" if hours else f"約{minutes}分"
+
+def plan_search_run(ip_targets, range_targets, domain_targets, max_workers, delay, use_rdap, use_internetdb, use_rdns, use_st_reverse_ip, api_key, vpnapi_key, st_api_key, use_triage=False, enrichment_policy=None, is_new_search=True, light_settings=None):
+    """ 現在の入力・オプションと各キャッシュ (CIDR・InternetDB・DNS解決済み) から、検索時のAPI呼び出し数と所要時間を見積もる (通信は行わない) """
+    now = time.time()
+    finished = set() if is_new_search else st.session_state.finished_ips
+    cidr_cache = st.session_state.cidr_cache
+    resolved_map = st.session_state.get('resolved_dns_map', {})
+    internetdb_cache = get_internetdb_cache()
+
+    # 正引き済みのドメインは解決結果のIPを、未解決のドメインは1件のIPに解決されるものとして数える
+    ip_list = [t for t in ip_targets if t not in finished]
+    unresolved_domain_count = 0
+    pending_domains = [d for d in domain_targets if d not in finished]
+    for d in pending_domains:
+        dns_data = resolved_map.get(d)
+        if isinstance(dns_data, dict) and dns_data.get('ips'):
+            ip_list.extend(f"{d} ({ip})" for ip in dns_data['ips'])
+        elif dns_data is None:
+            unresolved_domain_count += 1
+
+    # 同じ実IPは1回の照会に集約され、24時間以内のCIDRキャッシュに該当する場合は通信しない
+    actual_ips = set()
+    cached_ips = set()
+    for t in ip_list:
+        parsed = parse_target(t)
+        cached = cidr_cache.get(parsed.prefix_key) if parsed.prefix_key else None
+        if cached and now - cached.get('Timestamp', 0) < 86400:
+            cached_ips.add(parsed.ip)
+        else:
+            actual_ips.add(parsed.ip)
+    actual_ips -= cached_ips
+    query_count = len(actual_ips) + unresolved_domain_count
+    pending_ranges = [t for t in range_targets if t not in finished]
+    member_count = sum(min(parse_target(t).range_size, RANGE_FANOUT_LIMIT) for t in pending_ranges)
+    needs_fanout = use_internetdb or use_rdns or (use_st_reverse_ip and st_api_key)
+
+    calls = {}
+    ipinfo_requests = 0
+    if api_key:
+        # IPinfoの無料枠は照会件数単位のため、Bulk APIに送る実IPの数で数える (CIDRキャッシュに該当するIPやレンジの代表IPも送信される)
+        # トリアージ時は2段階目の対象IPを改めて送信するため、上限は2倍となる
+        bulk_ips = actual_ips | cached_ips | {parse_target(t).ip for t in pending_ranges}
+        ipinfo_lookups = len(bulk_ips) + unresolved_domain_count
+        ipinfo_requests = math.ceil(ipinfo_lookups / IPINFO_BULK_CHUNK)
+        calls["IPinfo"] = ipinfo_lookups * (2 if use_triage else 1)
+    else:
+        calls["ip-api"] = query_count + len(pending_ranges)
+    # トリアージ1段階目では詳細解析を行わないため、以降の呼び出し数は2段階目の対象が全件となった場合の上限値となる
+    if use_rdap:
+        calls["RDAP"] = query_count + len(pending_ranges)
+    if vpnapi_key:
+        calls["VPNAPI"] = query_count
+    if use_internetdb:
+        calls["InternetDB"] = sum(1 for ip in actual_ips if internetdb_cache.get(ip) is None) + unresolved_domain_count + member_count
+    if use_rdns:
+        calls["rDNS"] = query_count + member_count
+    st_calls = 0
+    st_used = 0
+    if st_api_key:
+        # 履歴はドメイン単位でキャッシュされるため、同じドメインの正引きIPが複数あっても照会は1回 (A・AAAAの2回) となる
+        st_cache = get_securitytrails_cache()
+        history_domains = set(pending_domains) | {parse_target(t).domain for t in ip_list if parse_target(t).is_composite}
+        st_calls = 2 * sum(1 for d in history_domains if securitytrails_history_key(d, st_api_key) not in st_cache)
+        if use_st_reverse_ip:
+            st_calls += sum(1 for ip in actual_ips if securitytrails_reverse_key(ip, True, st_api_key) not in st_cache and securitytrails_reverse_key(ip, False, st_api_key) not in st_cache)
+            st_calls += unresolved_domain_count + member_count
+        st_used = get_securitytrails_ledger().calls_this_month(st_api_key)
+    if st_calls:
+        calls["SecurityTrails"] = st_calls
+    is_upper_bound = bool(use_triage or ENRICHMENT_POLICIES.get(enrichment_policy))
+
+    # 所要時間: ワーカー1本あたり「待機 + 応答時間」で1ターゲットを処理し、レンジ展開はレンジ担当のワーカー内で逐次処理される
+    # RDAP・逆引き有効時は実行時に単一スレッド・最低待機時間へ固定される (トリアージ時は2段階目のみ)
+    # light_settings: RDAP・逆引きによる固定を受けない場合の (スレッド数, 待機秒)。一次判定のみの所要時間の見積もりに使う
+    def estimate_seconds(deep_enabled):
+        workers, wait = (light_settings or (max_workers, delay)) if not deep_enabled else (max_workers, delay)
+        if deep_enabled and use_rdap:
+            workers, wait = 1, max(delay, 5.0)
+        elif deep_enabled and use_rdns:
+            workers, wait = 1, max(delay, 2.0)
+        stage_latency = PLANNER_AVG_LATENCY * (2 if deep_enabled and len(calls) > 1 else 1)
+        seconds = (query_count + len(pending_ranges)) * (wait + stage_latency) / max(1, workers)
+        if deep_enabled and needs_fanout:
+            seconds += member_count * (wait + PLANNER_AVG_LATENCY) / max(1, workers)
+        if not api_key:
+            # ip-api の毎分上限を超える速度では処理できない
+            seconds = max(seconds, calls["ip-api"] / IP_API_RATE_PER_MINUTE * 60)
+        else:
+            # Bulk APIの一括取得は検索開始前にチャンク単位で逐次実行される
+            seconds += ipinfo_requests * PLANNER_AVG_LATENCY
+        return seconds
+
+    total_ips = len(cached_ips) + len(actual_ips)
+    return {
+        'calls': calls,
+        'is_upper_bound': is_upper_bound,
+        'query_count': query_count,
+        'cache_hits': len(cached_ips),
+        'cache_hit_ratio': len(cached_ips) / total_ips if total_ips else 0.0,
+        'range_members': member_count,
+        'quota_used': {"SecurityTrails": st_used},
+        'seconds': estimate_seconds(not use_triage),
+        'light_seconds': estimate_seconds(False),
+        # トリアージ時の 'seconds' は1段階目のみのため、2段階目は全件が対象となった場合の上限として別に持つ
+        'deep_seconds_upper': estimate_seconds(True) if use_triage else None,
+    }
+
+def remaining_quota(plan, provider):
+    """ 無料枠の目安から、台帳に記録済みの今期の使用回数を差し引いた残り回数 """
+    return max(0, PROVIDER_QUOTAS[provider][0] - plan['quota_used'].get(provider, 0))
+
+def suggest_cheaper_options(plan, use_rdap, use_rdns, vpnapi_key, use_st_reverse_ip, api_key, use_triage=False, enrichment_policy=None):
+    """ 見積もり結果から、呼び出し数・所要時間を抑えられるオプションの組み合わせを提案する """
+    suggestions = []
+    calls = plan['calls']
+    if (use_rdap or use_rdns) and not use_triage and plan['query_count'] > 20:
+        suggestions.append(f"**2段階トリアージ** を有効にすると、一次判定は{format_duration(plan['light_seconds'])}で完了し、RDAP・逆引きは疑わしいIPのみに実行されます (現在の設定: {format_duration(plan['seconds'])})。")
+    if not ENRICHMENT_POLICIES.get(enrichment_policy) and (vpnapi_key or use_st_reverse_ip):
+        over_quota = [p for p in ("VPNAPI", "SecurityTrails") if calls.get(p, 0) > remaining_quota(plan, p)]
+        if over_quota:
+            suggestions.append(f"{' / '.join(over_quota)} の呼び出し数が無料枠の目安を超えます。**照会ポリシー** を「疑わしいIPのみ」にすると、住宅回線等への呼び出しを省略できます。")
+    if calls.get("SecurityTrails", 0) > remaining_quota(plan, "SecurityTrails") and use_st_reverse_ip:
+        suggestions.append("**Reverse IP (SecurityTrails)** をオフにし、必要なIPのみ個別調査で照会するとクォータを大幅に節約できます。")
+    if not api_key and calls.get("ip-api", 0) > IP_API_RATE_PER_MINUTE * 10:
+        suggestions.append(f"ip-api は毎分{IP_API_RATE_PER_MINUTE}件が上限です。**IPinfo APIキー** を設定すると Bulk API ({IPINFO_BULK_CHUNK}件/リクエスト) で一括取得できます。")
+    return suggestions
+
+def render_search_plan(plan, suggestions):
+    """ 実行計画 (呼び出し数・キャッシュヒット率・上限目安・所要時間) を表示する """
+    bound_note = " (上限)" if plan['is_upper_bound'] else ""
+    rows = []
+    for provider, count in plan['calls'].items():
+        quota = PROVIDER_QUOTAS.get(provider)
+        quota_text = "-"
+        if quota:
+            used = plan['quota_used'].get(provider)
+            remaining = remaining_quota(plan, provider)
+            quota_text = f"{quota[0]:,}件/{quota[1]} ({count / quota[0]:.0%})" if used is None else f"{quota[0]:,}件/{quota[1]} (今{quota[1]}の使用 {used:,}件 / 残り {remaining:,}件)"
+        rows.append({"プロバイダー": provider, f"想定呼び出し数{bound_note}": f"{count:,}", "無料枠の目安 (消費率)": quota_text})
+
+    has_warning = bool(suggestions) or any(count > remaining_quota(plan, p) for p, count in plan['calls'].items() if p in PROVIDER_QUOTAS)
+    duration_text = format_duration(plan['seconds'])
+    if plan.get('deep_seconds_upper') is not None:
+        duration_text = f"一次判定 {duration_text} + 詳細解析 最大 {format_duration(plan['deep_seconds_upper'])}"
+    with st.expander(f"🧮 実行計画 (ドライラン見積もり): 所要時間 {duration_text} / API照会 {plan['query_count']:,}件", expanded=has_warning):
+        st.markdown(
+            f"**キャッシュヒット:** {plan['cache_hits']:,}件 ({plan['cache_hit_ratio']:.0%}) / "
+            f"**照会対象:** {plan['query_count']:,}件" + (f" / **レンジ展開:** {plan['range_members']:,}件" if plan['range_members'] else "")
+        )
+        if rows:
+            st.dataframe(pd.DataFrame(rows), hide_index=True, width="stretch")
+        if plan['is_upper_bound']:
+            st.caption("※ 2段階トリアージ・照会ポリシーが有効なため、詳細解析の呼び出し数は全件が対象となった場合の上限値です。")
+        for suggestion in suggestions:
+            st.warning(f"💡 {suggestion}")
+
+# --- 集計結果描画ヘルパー関数 (2x2ダッシュボード & 1枚絵出力対応) ---
+# --- ダッシュボード描画 ---
+# ブラウザ表示用ダッシュボードのパネル構成 (パネルID, 見出し)
+DASHBOARD_PANELS = [
+    ('map', "📍 **国別 ヒートマップ**"),
+    ('isp', "🏢 **ISP別 件数 (Top 10)**"),
+    ('pie', "🌍 **国別 割合 (Pie Chart)**"),
+    ('proxy', "🕵️ **プロキシ・VPN 割合 (Donut)**"),
+]
+# リアルタイム分析の再描画間隔の上限 (秒)。結果件数が増えるほど間隔を延ばし、描画が検索処理を圧迫しないようにする
+LIVE_DASHBOARD_MAX_INTERVAL = 10.0
+
+# データがない場合のエラー回避用プレースホルダー作成関数
+def get_empty_chart():
+    return alt.Chart(pd.DataFrame({'x': [1]})).mark_text(size=14, color='gray').encode(
+        text=alt.value('データなし')
+    )
 
-    # ヒートマップ用
-    if country_code_counts:
-        map_data = []
-        for cc, cnt in country_code_counts.items():
-            num = COUNTRY_CODE_TO_NUMERIC_ISO.get(cc)
-            if num is not None:
-                map_data.append({'NumericCode': int(num), 'Count': int(cnt), 'Country': COUNTRY_JP_NAME.get(cc, cc)})
+def build_dashboard_chart(panel, df):
+    """ ダッシュボードの1パネル分のベースチャートを、そのパネルの集計データだけから構築する """
+    if df.empty or (panel == 'map' and not WORLD_MAP_GEOJSON):
+        return get_empty_chart()
+
+    # 1. 国別ヒートマップ
+    if panel == 'map':
+        base = alt.Chart(WORLD_MAP_GEOJSON).mark_geoshape(
+            stroke='black', strokeWidth=0.1, fill="#f0f0f052"
+        ).project(type='mercator', scale=65, translate=[220, 150]) 
         
-        # DataFrame構築時のKeyErrorを完全に防ぐフェイルセーフ
-        if map_data:
-            country_all_df_raw = pd.DataFrame(map_data).astype({'NumericCode': 'int64', 'Count': 'int64'})
-        else:
-            country_all_df_raw = pd.DataFrame(columns=['NumericCode', 'Count', 'Country'])
-            
-    st.session_state['debug_summary']['country_code_counts'] = country_code_counts
-    st.session_state['debug_summary']['country_all_df'] = country_all_df_raw.to_dict('records')
+        heatmap = alt.Chart(WORLD_MAP_GEOJSON).mark_geoshape(
+            stroke='black', strokeWidth=0.1
+        ).encode(
+            color=alt.Color('Count:Q', scale=alt.Scale(type='log', scheme='yelloworangered'), legend=None),
+            tooltip=[alt.Tooltip('Country:N', title='国名'), alt.Tooltip('Count:Q', title='件数', format=',')]
+        ).transform_lookup(
+            lookup='id', from_=alt.LookupData(df, key='NumericCode', fields=['Count', 'Country'])
+        ).project(type='mercator', scale=65, translate=[220, 150])
+        
+        return alt.layer(base, heatmap).resolve_scale(color='independent')
 
-    # --- ターゲット頻度集計 ---
-    freq_map = st.session_state.get('target_freq_map', {})
-    finished = st.session_state.get('finished_ips', set())
-    freq_list = [{'Target_IP': t, 'Count': c} for t, c in freq_map.items() if t in finished]
-    freq_full_df = pd.DataFrame(freq_list).sort_values('Count', ascending=False) if freq_list else pd.DataFrame(columns=['Target_IP', 'Count'])
-    freq_df = freq_full_df.head(10).copy() if not freq_full_df.empty else pd.DataFrame(columns=['Target_IP', 'Count'])
+    # 2. ISP横棒グラフ
+    if panel == 'isp':
+        return alt.Chart(df).mark_bar(color="#1e3a8a").encode(
+            x=alt.X('Count:Q', title='件数', axis=alt.Axis(tickMinStep=1, format='d')),
+            y=alt.Y('ISP:N', sort='-x', title='')
+        )
 
-    # 戻り値に proxy_df を追加
-    return isp_df, country_df, freq_df, country_all_df_raw, isp_full_df, country_full_df, freq_full_df, proxy_df
+    # 3. 国別パイチャート
+    if panel == 'pie':
+        country_order = df.sort_values('Count', ascending=False)['Country'].tolist()
+        return alt.Chart(df).mark_arc().encode(
+            theta=alt.Theta(field="Count", type="quantitative"),
+            color=alt.Color(
+                field="Country", 
+                type="nominal", 
+                scale=alt.Scale(domain=country_order, scheme="spectral"), 
+                legend=alt.Legend(title="国名", orient="right")
+            ),
+            tooltip=["Country", "Count"]
+        )
+
+    # 4. プロキシドーナツチャート
+    df = df.assign(Proxy_Type=df['Proxy_Type'].replace('非Tor / API未検証', 'API未検証'))
+    proxy_order = df.sort_values('Count', ascending=False)['Proxy_Type'].tolist()
+    return alt.Chart(df).mark_arc(innerRadius=50).encode(
+        theta=alt.Theta(field="Count", type="quantitative"),
+        color=alt.Color(
+            field="Proxy_Type", 
+            type="nominal", 
+            scale=alt.Scale(domain=proxy_order, scheme="category10"),
+            legend=alt.Legend(title="判定", orient="right")
+        ),
+        tooltip=["Proxy_Type", "Count"]
+    )
+
+def live_dashboard_interval(result_count):
+    """ 結果件数に応じたリアルタイム分析の再描画間隔 (秒) を返す (件数が1桁増えるごとに基準間隔分だけ延ばす) """
+    return min(LIVE_DASHBOARD_MAX_INTERVAL, UI_REFRESH_INTERVAL * max(1.0, math.log10(max(result_count, 1))))
+
+def init_live_dashboard(container, title):
+    """ リアルタイム分析用に、パネルごとに独立して書き換えられる描画枠を用意する """
+    slots = {}
+    with container.container():
+        st.markdown(f"**{title}**")
+        columns = [*st.columns(2), *st.columns(2)]
+        for (panel, label), col in zip(DASHBOARD_PANELS, columns):
+            with col:
+                st.markdown(label)
+                slots[panel] = st.empty()
+    return {'slots': slots, 'rows': {}}
+
+def update_live_dashboard(dashboard, isp_df, country_df, country_all_df, proxy_df):
+    """ 集計値が前回の描画から変化したパネルだけを再描画し、チャート仕様の再送信を最小限に抑える """
+    frames = {'map': country_all_df, 'isp': isp_df, 'pie': country_df, 'proxy': proxy_df}
+    redrawn = 0
+    for panel, df in frames.items():
+        # 集計表は高々数百行なので、行タプルそのものを比較キーとして保持する
+        rows = tuple(df.itertuples(index=False, name=None))
+        if dashboard['rows'].get(panel) == rows:
+            continue
+        dashboard['rows'][panel] = rows
+        dashboard['slots'][panel].altair_chart(build_dashboard_chart(panel, df).properties(height=250), width="stretch")
+        redrawn += 1
+    return redrawn
 
-# --- 集計結果描画ヘルパー関数 (2x2ダッシュボード & 1枚絵出力対応) ---
 def draw_summary_content(isp_summary_df, country_summary_df, target_frequency_df, country_all_df, proxy_df, title):
     st.markdown(f"**{title}**")
     
-    # データがない場合のエラー回避用プレースホルダー作成関数
-    def get_empty_chart():
-        return alt.Chart(pd.DataFrame({'x': [1]})).mark_text(size=14, color='gray').encode(
-            text=alt.value('データなし')
-        )
-
     # グラフの右側に配置するテキストテーブル生成関数 (2段表示・文字潰れ回避版)
     def get_table_chart(df, name_col, count_col, use_color=False, color_scheme=None, domain_list=None):
         if df.empty:
@@ -1918,64 +3758,10 @@ def draw_summary_content(isp_summary_df, country_summary_df, target_frequency_df
     # ==========================================
     # ブラウザ表示用 (Tab1) のベースチャート生成
     # ==========================================
-    
-    # 1. 国別ヒートマップ
-    if WORLD_MAP_GEOJSON and not country_all_df.empty:
-        base = alt.Chart(WORLD_MAP_GEOJSON).mark_geoshape(
-            stroke='black', strokeWidth=0.1, fill="#f0f0f052"
-        ).project(type='mercator', scale=65, translate=[220, 150]) 
-        
-        heatmap = alt.Chart(WORLD_MAP_GEOJSON).mark_geoshape(
-            stroke='black', strokeWidth=0.1
-        ).encode(
-            color=alt.Color('Count:Q', scale=alt.Scale(type='log', scheme='yelloworangered'), legend=None),
-            tooltip=[alt.Tooltip('Country:N', title='国名'), alt.Tooltip('Count:Q', title='件数', format=',')]
-        ).transform_lookup(
-            lookup='id', from_=alt.LookupData(country_all_df, key='NumericCode', fields=['Count', 'Country'])
-        ).project(type='mercator', scale=65, translate=[220, 150])
-        
-        chart_map_base = alt.layer(base, heatmap).resolve_scale(color='independent')
-    else:
-        chart_map_base = get_empty_chart()
-
-    # 2. ISP横棒グラフの構築
-    if not isp_summary_df.empty:
-        chart_isp_base = alt.Chart(isp_summary_df).mark_bar(color="#1e3a8a").encode(
-            x=alt.X('Count:Q', title='件数', axis=alt.Axis(tickMinStep=1, format='d')),
-            y=alt.Y('ISP:N', sort='-x', title='')
-        )
-    else:
-        chart_isp_base = get_empty_chart()
-
-    # 3. 国別パイチャート
-    if not country_summary_df.empty:
-        chart_pie_base = alt.Chart(country_summary_df).mark_arc().encode(
-            theta=alt.Theta(field="Count", type="quantitative"),
-            color=alt.Color(
-                field="Country", 
-                type="nominal", 
-                scale=alt.Scale(domain=country_order, scheme="spectral"), 
-                legend=alt.Legend(title="国名", orient="right")
-            ),
-            tooltip=["Country", "Count"]
-        )
-    else:
-        chart_pie_base = get_empty_chart()
-
-    # 4. プロキシドーナツチャート
-    if not proxy_df.empty:
-        chart_proxy_base = alt.Chart(proxy_df).mark_arc(innerRadius=50).encode(
-            theta=alt.Theta(field="Count", type="quantitative"),
-            color=alt.Color(
-                field="Proxy_Type", 
-                type="nominal", 
-                scale=alt.Scale(domain=proxy_order, scheme="category10"),
-                legend=alt.Legend(title="判定", orient="right")
-            ),
-            tooltip=["Proxy_Type", "Count"]
-        )
-    else:
-        chart_proxy_base = get_empty_chart()
+    chart_map_base = build_dashboard_chart('map', country_all_df)
+    chart_isp_base = build_dashboard_chart('isp', isp_summary_df)
+    chart_pie_base = build_dashboard_chart('pie', country_summary_df)
+    chart_proxy_base = build_dashboard_chart('proxy', proxy_df)
 
     # ----------------------------------------------------
     # タブによる表示切り替え
@@ -2029,6 +3815,8 @@ def draw_summary_content(isp_summary_df, country_summary_df, target_frequency_df
             ).properties(title="ISP別 件数 (Top 10)", height=280, width=400)
             isp_table = get_table_chart(isp_summary_df, 'ISP', 'Count', use_color=False)
             c_isp_img = alt.hconcat(isp_chart, isp_table).resolve_scale(y='independent')
+        else:
+            c_isp_img = alt.Chart(pd.DataFrame({'x': [1]})).mark_text(text='データなし').properties(title="ISP別 件数 (Top 10)", height=280, width=620)
 
         # 4. 画像用 プロキシドーナツ ＆ 表
         if not proxy_df.empty:
@@ -2209,11 +3997,14 @@ def generate_stix2_bundle(results):
         clean_target = str(target).split(' - ')[0].split(' ')[0]
         if "(" in clean_target:
             clean_target = clean_target.split("(")[0].strip()
+        # レンジ展開したメンバー (レンジ (IP)) はメンバーIP自体を指標にする
+        if parse_target(str(target)).is_range_member:
+            clean_target = parse_target(str(target)).ip
 
-        # STIXのサイバー観測パターンの構築
-        if is_ipv4(clean_target):
+        # STIXのサイバー観測パターンの構築 (CIDRレンジも ipv4-addr / ipv6-addr の値として扱える)
+        if parse_target(clean_target).version == 4:
             pattern = f"[ipv4-addr:value = '{clean_target}']"
-        elif is_valid_ip(clean_target): # IPv6
+        elif parse_target(clean_target).version == 6:
             pattern = f"[ipv6-addr:value = '{clean_target}']"
         else:
             pattern = f"[domain-name:value = '{clean_target}']"
@@ -2548,15 +4339,17 @@ def generate_individual_html_report(res, clean_ip, report_opts=None):
     nslookup_data = {}
     domain_name_for_nslookup = ""
     
-    if "(" in target_ip and ")" in target_ip:
-        domain_name_for_nslookup = target_ip.split("(")[0].strip()
+    parsed_target = parse_target(target_ip)
+    if parsed_target.is_composite:
+        domain_name_for_nslookup = parsed_target.domain
         nslookup_data = st.session_state.get('resolved_dns_map', {}).get(domain_name_for_nslookup, {})
-    elif not is_valid_ip(target_ip): 
+    elif not parsed_target.is_ip and not parsed_target.is_range: 
         domain_name_for_nslookup = target_ip
         nslookup_data = st.session_state.get('resolved_dns_map', {}).get(domain_name_for_nslookup, {})
     
     nslookup_raw = nslookup_data.get('raw', '') if isinstance(nslookup_data, dict) else ""
     nslookup_ips = nslookup_data.get('ips', []) if isinstance(nslookup_data, dict) else []
+    nslookup_records = (nslookup_data.get('records') if isinstance(nslookup_data, dict) else None) or {}
     
     if isinstance(nslookup_data, str):
         nslookup_raw = nslookup_data
@@ -2725,6 +4518,17 @@ def generate_individual_html_report(res, clean_ip, report_opts=None):
             
         cmd_str = f"resolver = dns.resolver.Resolver(); resolver.nameservers=['8.8.8.8']; resolver.resolve('{domain_name_for_nslookup}', 'A/AAAA/MX')"
         ip_list_str = "<br>".join([html.escape(ip) for ip in nslookup_ips]) if nslookup_ips else "取得なし"
+
+        # 種別ごとのレコードを保持している場合は、MX/NS/CNAMEを生出力を読み解かずに一覧表示する
+        record_rows = ""
+        if nslookup_records.get('MX'):
+            mx_list_str = "<br>".join(f"{html.escape(mx['exchange'])} (優先度 {mx['preference']})" for mx in sorted(nslookup_records['MX'], key=lambda mx: mx['preference']))
+            record_rows += f"<tr><th>メールサーバー<br>(MX)</th><td>{mx_list_str}</td></tr>"
+        if nslookup_records.get('NS'):
+            record_rows += f"<tr><th>権威DNSサーバー<br>(NS)</th><td>{'<br>'.join(html.escape(ns) for ns in nslookup_records['NS'])}</td></tr>"
+        if nslookup_records.get('CNAME'):
+            cname_chain_str = " → ".join([html.escape(nslookup_records['CNAME'][0]['name'])] + [html.escape(c['target']) for c in nslookup_records['CNAME']])
+            record_rows += f"<tr><th>別名の連鎖<br>(CNAME)</th><td>{cname_chain_str}</td></tr>"
         
         # --- 捨てアド (Disposable Email) 検知ロジック ---
         detected_services = res.get('DISPOSABLE_SERVICES', [])
@@ -2757,6 +4561,7 @@ def generate_individual_html_report(res, clean_ip, report_opts=None):
                 <tr><th>対象ドメイン<br>(Target Domain)</th><td><strong>{html.escape(domain_name_for_nslookup)}</strong></td></tr>
                 <tr><th>取得日時<br>(Timestamp)</th><td><strong>{current_time_str}</strong></td></tr>
                 <tr><th>取得IPアドレス<br>(Resolved IPs)</th><td><strong>{ip_list_str}</strong></td></tr>
+                {record_rows}
                 {table_alert_row}
             </table>
             <h2>内部実行クエリ (Python)</h2>
@@ -3311,7 +5116,7 @@ def generate_individual_html_report(res, clean_ip, report_opts=None):
             display_count_text = "エラー (上限到達)"
         elif st_rev_json.get("error") == "rate_limit_during_pagination":
             # ページめくり中に制限に達した場合の特別警告
-            rev_html_rows = f"<tr><td style='text-align:center; background-color:#fff3e0; color:#e65100;'><b>⚠️ 全件取得の途中でAPI上限に到達しました。取得できた {len(records)} 件までを表示します。</b></td></tr>"
+            rev_html_rows = f"<tr><td style='text-align:center; background-color:#fff3e0; color:#e65100;'><b>⚠️ 全件取得の途中でAPI上限に到達しました。欠けなく取得できた先頭 {st_rev_json.get('pages_fetched', 1)} ページ分 ({len(records)} 件) を表示します。</b></td></tr>"
             for rec in records:
                 hostname = rec.get("hostname", "")
                 if hostname:
@@ -3612,16 +5417,10 @@ def display_results(results, current_mode_full_text, display_mode, use_rdap_opti
     st.markdown("### 📝 検索結果")
 
     # SecurityTrails API制限到達時のグローバル警告
-    st_limit_hit = False
-    for r in results:
-        st_j = r.get('ST_JSON')
-        st_r = r.get('ST_REVERSE_IP_JSON')
-        if isinstance(st_j, dict) and st_j.get('error') == 'rate_limit':
-            st_limit_hit = True
-            break
-        if isinstance(st_r, dict) and st_r.get('error') == 'rate_limit':
-            st_limit_hit = True
-            break
+    st_limit_hit = any(
+        results[col].map(lambda v: isinstance(v, dict) and v.get('error') == 'rate_limit').any()
+        for col in ('ST_JSON', 'ST_REVERSE_IP_JSON') if col in results.columns
+    )
             
     if st_limit_hit:
         st.error("🚨 **SecurityTrails API 利用制限の警告**: 月間の無料リクエスト枠（50回）に到達しました。一部のターゲットにおいて過去の履歴やReverse IP情報が取得できていません。")
@@ -3667,7 +5466,7 @@ def display_results(results, current_mode_full_text, display_mode, use_rdap_opti
         ※ VPNAPI.ioの設定がされていない場合は、Tor判定のみを行います。
         """)
 
-    if not results:
+    if results.empty:
         st.info("検索結果がここに表示されます。")
         return
 
@@ -3692,47 +5491,28 @@ def display_results(results, current_mode_full_text, display_mode, use_rdap_opti
                     orig_data_map[extracted_ip] = []
                 orig_data_map[extracted_ip].append(row.to_dict())
 
-    for idx, res in enumerate(results):
-        c_code = res.get('CountryCode', 'N/A')
-        c_jp = res.get('Country_JP', 'N/A')
-        country_display = f"{c_jp} ({c_code})"
-        target_ip = res.get('Target_IP', 'N/A')
-        actual_ip = extract_actual_ip(target_ip)
-        
-        row_data = {"No.": idx + 1}
-        
-        # ユーザー要望: 元データの列を一覧ビューの左側に反映
-        if original_cols:
-            if actual_ip in orig_data_map:
-                rows_list = orig_data_map[actual_ip]
-                for col in original_cols:
-                    # 複数の値がある場合は重複を排除して「 / 」で結合し一覧表示する
-                    vals = []
-                    for r in rows_list:
-                        val = str(r.get(col, '')).strip()
-                        if val and val not in vals:
-                            vals.append(val)
-                    row_data[col] = " / ".join(vals) if vals else ""
-            else:
-                for col in original_cols:
-                    row_data[col] = ''
-        
-        row_data.update({
-            "IPアドレス": target_ip,
-            "国名": country_display,
-            "Whois(元データ)": res.get('ISP_API_Raw', 'N/A'),
-            "Whois(日本語名)": res.get('ISP_JP', 'N/A'),
-            "RDAP(元データ)": res.get('RDAP_Name_Raw', ''),
-            "RDAP(日本語名)": res.get('RDAP_JP', ''),
-            "Proxy種別": res.get('Proxy_Type', ''),
-            "IoTリスク": res.get('IoT_Risk', ''),
-            "逆引き結果": res.get('RDNS_Hosts', ''),
-            "Reverse IP": res.get('ST_Reverse_Hosts', ''),
-            "ステータス": res.get('Status', 'N/A')
-        })
-        df_list.append(row_data)
+    target_ips = text_column(results, 'Target_IP')
+    df = pd.DataFrame({"No.": np.arange(1, len(results) + 1)}, index=results.index)
     
-    df = pd.DataFrame(df_list)
+    # ユーザー要望: 元データの列を一覧ビューの左側に反映
+    actual_ips = target_ips.map(extract_actual_ip) if original_cols else None
+    for col in original_cols:
+        # 複数の値がある場合は重複を排除して「 / 」で結合し一覧表示する
+        joined = {ip: " / ".join(dict.fromkeys(v for v in (str(r.get(col, '')).strip() for r in rows_list) if v)) for ip, rows_list in orig_data_map.items()}
+        df[col] = actual_ips.map(joined).fillna('')
+    
+    df["IPアドレス"] = target_ips
+    df["国名"] = text_column(results, 'Country_JP') + " (" + text_column(results, 'CountryCode') + ")"
+    df["Whois(元データ)"] = text_column(results, 'ISP_API_Raw')
+    df["Whois(日本語名)"] = text_column(results, 'ISP_JP')
+    df["RDAP(元データ)"] = text_column(results, 'RDAP_Name_Raw', '')
+    df["RDAP(日本語名)"] = text_column(results, 'RDAP_JP', '')
+    df["Proxy種別"] = text_column(results, 'Proxy_Type', '')
+    df["IoTリスク"] = text_column(results, 'IoT_Risk', '')
+    df["逆引き結果"] = text_column(results, 'RDNS_Hosts', '')
+    df["Reverse IP"] = text_column(results, 'ST_Reverse_Hosts', '')
+    df["ステータス"] = text_column(results, 'Status')
+    df = df.reset_index(drop=True)
 
     # UIの一覧ビューからも不要なカラムを動的に消去する
     ui_cols_to_drop = []
@@ -3740,7 +5520,7 @@ def display_results(results, current_mode_full_text, display_mode, use_rdap_opti
         ui_cols_to_drop.extend(["RDAP(元データ)", "RDAP(日本語名)"])
         
     # IoTリスクが取得されていない（オフ または 集約モード）場合はカラムごと消す
-    if all(r.get('IoT_Risk', '') in ['[Not Checked]', 'Aggr Mode (Skip)', '', 'N/A'] for r in results):
+    if text_column(results, 'IoT_Risk', '').isin(['[Not Checked]', 'Aggr Mode (Skip)', '', 'N/A']).all():
         ui_cols_to_drop.append("IoTリスク")
         
     if not use_rdns_option:
@@ -3800,20 +5580,18 @@ def display_results(results, current_mode_full_text, display_mode, use_rdap_opti
 
     # A. 行が選択されている場合 (手動選択の取得)
     if selected_indices:
-        for idx in selected_indices:
-            if idx < len(results):
-                res = results[idx]
-                target_results_dict[res.get('Target_IP')] = res
+        for res in frame_rows_to_dicts(results, [idx for idx in selected_indices if idx < len(results)]):
+            target_results_dict[res.get('Target_IP')] = res
 
     # B. フィルタリングUIを常に表示し、条件指定の取得を行う
     st.info("👆 一覧の行クリック選択と、以下の条件指定は同時に併用可能です。")
     with st.expander("🔎 条件でターゲットを一括指定する", expanded=True):
         col_f1, col_f2 = st.columns(2)
         with col_f1:
-            all_countries = sorted(list(set([r.get('Country_JP', 'N/A') for r in results])))
+            all_countries = sorted(text_column(results, 'Country_JP').unique())
             sel_countries = st.multiselect("国名で選択:", all_countries)
         with col_f2:
-            all_isps = sorted(list(set([r.get('ISP_JP', 'N/A') for r in results])))
+            all_isps = sorted(text_column(results, 'ISP_JP').unique())
             sel_isps = st.multiselect("Whois(日本語名)で選択:", all_isps)
             
         # --- 元データの属性フィルタUI ---
@@ -3866,13 +5644,16 @@ def display_results(results, current_mode_full_text, display_mode, use_rdap_opti
                 has_filter_input = True
 
         if has_filter_input:
-            for res in results:
+            # 国名・ISPの条件は列単位で絞り込み、該当行だけをdictへ戻して元データの条件を判定する
+            candidates = pd.Series(True, index=results.index)
+            if sel_countries:
+                candidates &= text_column(results, 'Country_JP').isin(sel_countries)
+            if sel_isps:
+                candidates &= text_column(results, 'ISP_JP').isin(sel_isps)
+            for res in frame_rows_to_dicts(results[candidates]):
                 target_ip = res.get('Target_IP')
                 actual_ip = extract_actual_ip(target_ip)
                 
-                c_match = res.get('Country_JP', 'N/A') in sel_countries if sel_countries else True
-                i_match = res.get('ISP_JP', 'N/A') in sel_isps if sel_isps else True
-                
                 orig_match = True
                 if orig_filters:
                     rows_list = orig_data_map.get(actual_ip, [])
@@ -3917,7 +5698,7 @@ def display_results(results, current_mode_full_text, display_mode, use_rdap_opti
                     else:
                         orig_match = False # 元データが存在しないIPはフィルタ除外
                 
-                if c_match and i_match and orig_match:
+                if orig_match:
                     target_results_dict[target_ip] = res
 
     # 辞書から最終的なリストを生成 (重複は自動的に上書き・排除される)
@@ -3926,6 +5707,14 @@ def display_results(results, current_mode_full_text, display_mode, use_rdap_opti
     if target_results:
         st.success(f"✅ 合計 **{len(target_results)}** 件が選択されています（手動選択: {len(selected_indices)}件 / フィルタ条件と結合済）。")
 
+        # 2段階トリアージの実行後は、選択したIPを追加で詳細解析できる (他のターゲットは再処理しない)
+        if st.session_state.get('triage') and not st.session_state.is_searching:
+            known_targets = set(st.session_state.targets_cache)
+            deep_candidates = [r['Target_IP'] for r in target_results if r.get('Target_IP') in known_targets and not is_ip_range(r['Target_IP']) and is_valid_ip(extract_actual_ip(r['Target_IP']))]
+            if deep_candidates and st.button(f"🔬 選択中のIP {len(deep_candidates)}件を詳細解析する (2段階目)", key="triage_deep_button"):
+                start_deep_phase(deep_candidates)
+                st.rerun()
+
     # --- 4. 選択された全ターゲットに対してレポートを表示 ---
     if target_results:
         total_selected = len(target_results)
@@ -3934,15 +5723,16 @@ def display_results(results, current_mode_full_text, display_mode, use_rdap_opti
         st.caption("※ APIキーが未入力の項目や、検索設定でオフになっていた機能はグレーアウト（無効化）されます。")
         
         # 選択されたターゲットにドメインが含まれているか、IPが含まれているかを判定
-        has_domain_in_selection = any(not is_valid_ip(r.get('Target_IP', '')) or "(" in r.get('Target_IP', '') for r in target_results)
+        # レンジ展開したメンバー (レンジ (IP)) は複合形式でもドメインを含まない
+        has_domain_in_selection = any(parsed.is_composite or not (parsed.is_ip or parsed.is_range) for parsed in (parse_target(r.get('Target_IP', '')) for r in target_results))
         has_ip_in_selection = any(is_valid_ip(extract_actual_ip(r.get('Target_IP', ''))) for r in target_results)
 
         # WHOISデータが実際に取得されているかを判定（複数入力時はIP-BAN回避のためスキップされている）
         has_whois_in_selection = False
         for r in target_results:
             target_ip = r.get('Target_IP', 'N/A')
-            detailed = st.session_state.get('detailed_data', {}).get(target_ip, {})
-            if detailed.get('IP_WHOIS_TEXT') or detailed.get('DOMAIN_WHOIS_TEXT'):
+            detail_store = st.session_state.detailed_data
+            if detail_store.get_field(target_ip, 'IP_WHOIS_TEXT') or detail_store.get_field(target_ip, 'DOMAIN_WHOIS_TEXT'):
                 has_whois_in_selection = True
                 break
 
@@ -4563,6 +6353,510 @@ def render_merged_analysis(df_merged):
     with tab_spider:
         render_spider_web_analysis(df_merged)
 
+# ==========================================
+# ログ取り込み (アクセスログ・syslog・JSON Lines)
+# ==========================================
+LOG_IP_COLUMN = 'IP'
+LOG_TIME_COLUMN = '日時(JST)'
+LOG_FILE_EXTENSIONS = ('.log', '.jsonl', '.ndjson', '.gz')
+# タイムゾーン情報を持たない日時 (RFC3164のsyslog・オフセットなしのJSON等) は、形式を問わずサーバー現地時刻として扱う
+LOG_NAIVE_TIMEZONE = 'Asia/Tokyo'
+# ログ取り込み時のプレビューに表示する先頭行数 (数GBのログでも表全体を描画しない)
+LOG_PREVIEW_ROWS = 1000
+# 年を補ったRFC3164の日時が現在時刻よりこれ以上先になる場合は、前年のログとみなす (時計のずれは許容する)
+SYSLOG_FUTURE_TOLERANCE = pd.Timedelta(days=1)
+# 数値のUNIX時刻がこの値を超える場合はミリ秒とみなす (秒単位なら西暦5000年以降になるため)
+LOG_EPOCH_MS_THRESHOLD = 1e11
+
+# 行ごとにコンパイルし直さないよう、抽出用の正規表現はモジュール読み込み時に一度だけ構築する
+ACCESS_LOG_PATTERN = re.compile(
+    r'^(?P<ip>[0-9A-Fa-f:.]+)\s+\S+\s+\S+\s+\[(?P<time>[^\]]+)\]\s+'
+    r'"(?P<method>[A-Z]+)?\s*(?P<path>[^\s"]*)[^"]*"\s+(?P<status>\d{3}|-)\s+\S+'
+    r'(?:\s+"(?P<referer>[^"]*)"\s+"(?P<ua>[^"]*)")?'
+)
+RFC3164_TIME_REGEX = r'[A-Z][a-z]{2}\s+\d{1,2}\s+\d{2}:\d{2}:\d{2}'
+SYSLOG_PATTERN = re.compile(
+    r'^(?:<\d+>\d?\s*)?(?P<time>' + RFC3164_TIME_REGEX + r'|\d{4}-\d{2}-\d{2}T\S+)\s+'
+    r'(?P<host>\S+)\s+(?P<program>[^\s:\[]+)(?:\[\d+\])?:\s*(?P<msg>.*)$'
+)
+# 年・タイムゾーンを持たないRFC3164形式の日時 (例: "Oct  3 12:34:56") だけに一致する
+RFC3164_TIMESTAMP_PATTERN = re.compile(r'^' + RFC3164_TIME_REGEX + r'$')
+# 末尾のタイムゾーン表記 (Z / +09:00 / +0900 / UTC / GMT) の有無で、オフセットなしの日時を見分ける
+LOG_TZ_SUFFIX_PATTERN = r'(?:[Zz]|[+-]\d{2}:?\d{2}|\bUTC|\bGMT)$'
+LOG_IPV4_PATTERN = re.compile(r'(?<![\d.])(?:(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\.){3}(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)(?![\d.])')
+LOG_IPV6_PATTERN = re.compile(r'(?<![0-9A-Fa-f:])(?:[0-9A-Fa-f]{0,4}:){2,7}[0-9A-Fa-f]{0,4}(?![0-9A-Fa-f:])')
+
+JSON_LOG_FIELD_KEYS = {
+    'ip': ('ip', 'client_ip', 'clientIP', 'remote_addr', 'remote_ip', 'src_ip', 'source_ip', 'sourceIPAddress', 'ipAddress', 'c-ip'),
+    'time': ('@timestamp', 'timestamp', 'time', 'ts', 'datetime', 'date', 'eventTime'),
+    'path': ('path', 'uri', 'url', 'request_uri', 'request', 'cs-uri-stem'),
+    'ua': ('user_agent', 'userAgent', 'http_user_agent', 'ua', 'cs(User-Agent)'),
+    'status': ('status', 'status_code', 'statusCode', 'response', 'sc-status'),
+}
+
+def extract_first_ip(text):
+    """ 任意のテキストから最初に出現する有効なIPアドレスを抽出する """
+    m = LOG_IPV4_PATTERN.search(text)
+    if m: return m.group(0)
+    for m in LOG_IPV6_PATTERN.finditer(text):
+        try:
+            return str(ipaddress.IPv6Address(m.group(0)))
+        except ValueError:
+            continue
+    return None
+
+def parse_access_log_line(line):
+    """ nginx/Apache (common/combined) 形式のアクセスログ1行を解析する """
+    m = ACCESS_LOG_PATTERN.match(line)
+    if not m: return None
+    return {
+        'ip': m.group('ip'), 'time': m.group('time'), 'method': m.group('method') or '',
+        'path': m.group('path') or '', 'status': m.group('status'), 'ua': m.group('ua') or ''
+    }
+
+def parse_syslog_line(line):
+    """ syslog (RFC3164 / ISO8601タイムスタンプ) 形式の1行を解析し、本文中のIPを抽出する """
+    m = SYSLOG_PATTERN.match(line)
+    if not m: return None
+    ip = extract_first_ip(m.group('msg'))
+    if not ip: return None
+    return {'ip': ip, 'time': m.group('time'), 'host': m.group('host'), 'program': m.group('program')}
+
+def _pick_json_field(record, field):
+    for key in JSON_LOG_FIELD_KEYS[field]:
+        val = record.get(key)
+        if isinstance(val, dict):
+            # ECS形式 (例: {"client": {"ip": ...}}) などのネスト構造にも1階層だけ対応する
+            val = val.get('ip') or val.get('address') or val.get('original')
+        if val not in (None, ''):
+            return val
+    return None
+
+def parse_jsonl_line(line):
+    """ JSON Lines形式の監査ログ1行を解析し、代表的なキー名からIP・日時等を取り出す """
+    if not line.startswith('{'): return None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict): return None
+    ip = _pick_json_field(record, 'ip')
+    if ip is None:
+        for nested_key in ('client', 'source', 'src'):
+            nested = record.get(nested_key)
+            if isinstance(nested, dict) and nested.get('ip'):
+                ip = nested['ip']
+                break
+    if ip is None: return None
+    return {
+        'ip': str(ip), 'time': _pick_json_field(record, 'time'), 'path': _pick_json_field(record, 'path') or '',
+        'status': _pick_json_field(record, 'status'), 'ua': _pick_json_field(record, 'ua') or ''
+    }
+
+# パーサーの登録簿 (新しい形式は parse 関数・出力列・日時フォーマットを追加するだけで利用可能になる)
+LOG_PARSERS = {
+    'access': {
+        'label': 'Webアクセスログ (nginx / Apache)',
+        'parse': parse_access_log_line,
+        'columns': {'method': 'Method', 'path': 'Path', 'status': 'Status', 'ua': 'User_Agent'},
+        'time_format': '%d/%b/%Y:%H:%M:%S %z',
+    },
+    'syslog': {
+        'label': 'syslog',
+        'parse': parse_syslog_line,
+        'columns': {'host': 'Host', 'program': 'Program'},
+        'time_format': None,
+    },
+    'jsonl': {
+        'label': 'JSON Lines (構造化監査ログ)',
+        'parse': parse_jsonl_line,
+        'columns': {'path': 'Path', 'status': 'Status', 'ua': 'User_Agent'},
+        'time_format': None,
+    },
+}
+
+def detect_log_format(sample_lines):
+    """ 先頭数十行を各パーサーで試行し、最も多く解析できた形式のキーを返す (該当なしはNone) """
+    sample_lines = [l for l in sample_lines if l.strip()]
+    if not sample_lines: return None
+    best_key, best_hits = None, 0
+    for key, spec in LOG_PARSERS.items():
+        hits = sum(1 for l in sample_lines if spec['parse'](l.strip()))
+        if hits > best_hits:
+            best_key, best_hits = key, hits
+    # 半数以上の行を解析できた場合のみログとみなす (1行1ターゲットのリストを誤判定しないため)
+    return best_key if best_hits * 2 >= len(sample_lines) else None
+
+def iter_log_records(line_iter, parser_key):
+    """ 行イテレータを逐次解析し、IPを含むレコードだけを順に返す (ファイル全体をメモリに載せない) """
+    parse = LOG_PARSERS[parser_key]['parse']
+    for line in line_iter:
+        line = line.strip()
+        if not line: continue
+        rec = parse(line)
+        if rec and rec.get('ip'):
+            yield rec
+
+def parse_epoch_timestamps(numbers):
+    """ 数値のUNIX時刻 (秒・ミリ秒) をJSTのnaive datetime列へ変換する """
+    numbers = pd.to_numeric(numbers, errors='coerce').astype(float)
+    is_ms = numbers.abs() > LOG_EPOCH_MS_THRESHOLD
+    parsed = pd.to_datetime(numbers.where(~is_ms), unit='s', errors='coerce', utc=True)
+    parsed = parsed.where(~is_ms, pd.to_datetime(numbers.where(is_ms), unit='ms', errors='coerce', utc=True))
+    return parsed.dt.tz_convert(LOG_NAIVE_TIMEZONE).dt.tz_localize(None)
+
+def normalize_log_timestamps(values, time_format=None, now=None):
+    """ ログの日時文字列を一括でJSTのnaive datetime列へ変換する (オフセットなしの日時は LOG_NAIVE_TIMEZONE の現地時刻とみなす) """
+    now = now if now is not None else pd.Timestamp.now(tz=LOG_NAIVE_TIMEZONE).tz_localize(None)
+    series = pd.Series(values, dtype='object')
+    # JSON Linesの ts / timestamp 等に入る数値のUNIX時刻は、文字列として解析するとナノ秒とみなされ1970年になるため別に変換する
+    is_epoch = series.map(lambda v: isinstance(v, (int, float)) and not isinstance(v, bool))
+    if is_epoch.any():
+        epoch = parse_epoch_timestamps(series[is_epoch]).reindex(series.index)
+        if is_epoch.all():
+            return epoch
+        rest = normalize_log_timestamps(series.where(~is_epoch, None).tolist(), time_format, now)
+        return rest.where(~is_epoch, epoch)
+    if time_format is None and values and all(isinstance(v, str) and RFC3164_TIMESTAMP_PATTERN.match(v) for v in values[:5]):
+        # RFC3164のsyslogは年を持たないため取り込み時点の年を補い、未来の日時になった行 (年末のログを年明けに取り込んだ場合) は前年とみなす
+        parsed = pd.to_datetime(str(now.year) + " " + series.astype(str), format='%Y %b %d %H:%M:%S', errors='coerce')
+        is_future = parsed > now + SYSLOG_FUTURE_TOLERANCE
+        return parsed.where(~is_future, parsed - pd.DateOffset(years=1))
+    parsed = pd.to_datetime(series, format=time_format or 'mixed', errors='coerce', utc=True)
+    if time_format and parsed.isna().all():
+        parsed = pd.to_datetime(series, format='mixed', errors='coerce', utc=True)
+    # utc=True ではオフセットなしの日時もUTCとして読まれるため、その行は変換せず表記どおりの現地時刻を採用する
+    is_naive = series.map(lambda v: isinstance(v, str)) & ~series.astype(str).str.strip().str.contains(LOG_TZ_SUFFIX_PATTERN, regex=True)
+    local = parsed.dt.tz_convert(LOG_NAIVE_TIMEZONE).dt.tz_localize(None)
+    return local.where(~is_naive, parsed.dt.tz_localize(None))
+
+def parse_log_stream(binary_stream, parser_key=None):
+    """ ログファイルをストリーム解析し、IP列・日時列を持つデータフレームを構築する """
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8', errors='replace', newline='')
+    head = []
+    for line in text_stream:
+        head.append(line)
+        if len(head) >= 50: break
+    if parser_key is None:
+        parser_key = detect_log_format(head)
+    if parser_key is None:
+        return None, None
+
+    spec = LOG_PARSERS[parser_key]
+    out_fields = list(spec['columns'].keys())
+    # 行ごとのdictを溜め込まず、列ごとのリストに追記してメモリ使用量を抑える
+    cols = {'ip': [], 'time': [], **{f: [] for f in out_fields}}
+
+    def all_lines():
+        yield from head
+        yield from text_stream
+
+    for rec in iter_log_records(all_lines(), parser_key):
+        cols['ip'].append(rec['ip'])
+        cols['time'].append(rec.get('time'))
+        for f in out_fields:
+            cols[f].append(rec.get(f))
+
+    df = pd.DataFrame({LOG_IP_COLUMN: cols['ip']})
+    if any(v is not None for v in cols['time']):
+        df[LOG_TIME_COLUMN] = normalize_log_timestamps(cols['time'], spec['time_format'])
+    for f, col_name in spec['columns'].items():
+        series = pd.Series(cols[f], dtype='object')
+        # ステータスやホスト名など繰り返しの多い列はカテゴリ型にして省メモリ化する
+        df[col_name] = series.astype('category') if col_name in ('Method', 'Status', 'Host', 'Program') else series
+    return df, parser_key
+
+def open_log_source(file_name, binary_stream):
+    """ gzip圧縮されたログは透過的に展開して読み込む """
+    if file_name.endswith('.gz'):
+        return gzip.GzipFile(fileobj=binary_stream)
+    return binary_stream
+
+# ==========================================
+# アップロードファイル取り込み (Ingestion Cache)
+# ==========================================
+def build_log_entry(df_log, parser_key):
+    """ ログ解析結果を取り込みキャッシュの形式に変換する (ログ由来のIPはOCR補正を行わない) """
+    targets = df_log[LOG_IP_COLUMN].astype(str).tolist()
+    return {
+        'df_orig': df_log, 'ip_col': LOG_IP_COLUMN, 'targets': targets, 'cleaned_targets': targets,
+        'freq_counts': df_log[LOG_IP_COLUMN].value_counts().to_dict() if targets else {},
+        'error': None, 'preview': None, 'log_format': parser_key
+    }
+
+def parse_uploaded_file(file_name, file_bytes, text_only=False, log_format=None):
+    """ アップロードファイルを解析し、元データ・IP列・整形済みターゲット・頻度集計をまとめて返す """
+    entry = {
+        'df_orig': None, 'ip_col': None, 'targets': [], 'cleaned_targets': [],
+        'freq_counts': {}, 'error': None, 'preview': None, 'log_format': None
+    }
+    lines = []
+    try:
+        # ログ形式 (拡張子、または.txtの中身がログ形式と判定された場合) はExcelを経由せず直接取り込む
+        if not text_only and file_name.lower().endswith(LOG_FILE_EXTENSIONS + ('.txt',)):
+            df_log, parser_key = parse_log_stream(open_log_source(file_name.lower(), io.BytesIO(file_bytes)), log_format)
+            if df_log is not None:
+                return build_log_entry(df_log, parser_key)
+            if file_name.lower().endswith('.gz'):
+                entry['error'] = "ログ形式を判別できませんでした。"
+                return entry
+
+        if not text_only and file_name.endswith('.csv'):
+            entry['df_orig'] = pd.read_csv(io.BytesIO(file_bytes))
+        elif not text_only and file_name.endswith(('.xlsx', '.xls')):
+            entry['df_orig'] = pd.read_excel(io.BytesIO(file_bytes))
+        else:
+            # TXTファイル (公開モードでは常にテキストとして扱う)
+            lines = file_bytes.decode("utf-8").splitlines()
+    except Exception as e:
+        entry['error'] = str(e)
+        return entry
+
+    df_orig = entry['df_orig']
+    if df_orig is not None:
+        # 先頭10行をサンプリングしてIPアドレス列を自動検出する
+        for col in df_orig.columns:
+            sample = df_orig[col].dropna().head(10).astype(str)
+            if any(is_valid_ip(val.strip()) for val in sample):
+                entry['ip_col'] = col
+                break
+        if entry['ip_col']:
+            lines = df_orig[entry['ip_col']].dropna().astype(str).tolist()
+
+    entry['targets'] = [re.sub(r'\s+', '', t) for t in lines if t.strip()]
+    entry['cleaned_targets'] = clean_ocr_error_series(pd.Series(entry['targets'], dtype='object')).tolist()
+    if entry['cleaned_targets']:
+        entry['freq_counts'] = pd.Series(entry['cleaned_targets']).value_counts().to_dict()
+    return entry
+
+def get_cached_upload(uploaded_file, text_only=False, log_format=None):
+    """ ファイル内容のハッシュをキーに取り込み結果を再利用し、再実行時の再解析を省略する """
+    file_bytes = uploaded_file.getvalue()
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
+    cache_key = (file_hash, uploaded_file.name, text_only, log_format)
+    
+    cached = st.session_state.get('ingest_cache')
+    if cached and cached.get('key') == cache_key:
+        return cached
+    
+    entry = parse_uploaded_file(uploaded_file.name, file_bytes, text_only, log_format)
+    entry['key'] = cache_key
+    # 最新の1ファイル分のみ保持し、古い巨大データフレームへの参照を解放する
+    st.session_state['ingest_cache'] = entry
+    return entry
+
+def get_cached_log_path(path, log_format=None):
+    """ ローカルの大容量ログファイルをアップロードせずにストリーム解析する (パス・サイズ・更新時刻でキャッシュ) """
+    entry = {
+        'df_orig': None, 'ip_col': None, 'targets': [], 'cleaned_targets': [],
+        'freq_counts': {}, 'error': None, 'preview': None, 'log_format': None
+    }
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        entry['error'] = f"ログファイルにアクセスできません ({e})"
+        return entry
+    cache_key = ('path', os.path.abspath(path), stat.st_size, stat.st_mtime, log_format)
+    
+    cached = st.session_state.get('ingest_cache')
+    if cached and cached.get('key') == cache_key:
+        return cached
+
+    try:
+        with open(path, 'rb') as raw_stream:
+            df_log, parser_key = parse_log_stream(open_log_source(path.lower(), raw_stream), log_format)
+        if df_log is None:
+            entry['error'] = "ログ形式を判別できませんでした。形式を手動で選択してください。"
+        else:
+            entry = build_log_entry(df_log, parser_key)
+    except OSError as e:
+        entry['error'] = f"ログファイルの読み込みに失敗しました ({e})"
+    
+    entry['key'] = cache_key
+    st.session_state['ingest_cache'] = entry
+    return entry
+
+def get_upload_preview(upload_entry, invalid_targets):
+    """ 判定結果列付きのプレビュー表を生成する (除外対象が同一であればキャッシュを返す) """
+    invalid_set = frozenset(invalid_targets) # ⬅️ 検索高速化のためSet(集合)に変換
+    cached_preview = upload_entry.get('preview')
+    if cached_preview and cached_preview[0] == invalid_set:
+        return cached_preview[1]
+
+    df_orig = upload_entry['df_orig']
+    ip_col = upload_entry['ip_col']
+    # ログは数百万行になり得るため、先頭の一部だけをプレビューする
+    preview_df = df_orig.head(LOG_PREVIEW_ROWS).copy() if upload_entry.get('log_format') else df_orig.copy()
+    # 除外対象がある場合のみ判定列を追加する
+    if invalid_set:
+        def check_status(val):
+            if pd.isna(val): return "➖ 空欄"
+            val_str = str(val).strip()
+            if val_str in invalid_set:
+                return "⚠️ 除外 (形式エラー)"
+            return "✅ 検索対象"
+        
+        # データフレームの一番左 (インデックス0) に判定列を挿入
+        preview_df.insert(0, '📝 判定結果', preview_df[ip_col].apply(check_status))
+
+    upload_entry['preview'] = (invalid_set, preview_df)
+    return preview_df
+
+# ==========================================
+# ターゲット正規化 (一括ベクトル処理)
+# ==========================================
+OCR_ERROR_CHAR_PATTERN = r'[Iil|OoSsAaBⅡ]'
+LIKELY_DOMAIN_CHAR_PATTERN = r'[-g-zG-Z]'
+IP_RANGE_CANDIDATE_PATTERN = r'[0-9A-Fa-f.:]+(?:/\d{1,3}|\s*-\s*[0-9A-Fa-f.:]+)'
+IPV4_STRICT_PATTERN = r'(?:(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\.){3}(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)'
+TARGET_TABLE_COLUMNS = ['target', 'kind', 'version', 'v4_int', 'v6_hi', 'v6_lo']
+
+def clean_ocr_error_series(series):
+    """ clean_ocr_error_chars と同じ置換規則を Series 全体へ一括適用する """
+    cleaned = series
+    for src, dst in (('Ⅱ', '11'), ('I', '1'), ('l', '1'), ('|', '1'), ('O', '0'), ('o', '0'), (';', '.'), (',', '.')):
+        cleaned = cleaned.str.replace(src, dst, regex=False)
+    # IPv6 (コロンを含む) は16進数の判定に影響するため S/s の置換を行わない
+    no_colon = ~cleaned.str.contains(':', regex=False)
+    cleaned = cleaned.where(~no_colon, cleaned.str.replace(r'[Ss]', '5', regex=True))
+    return cleaned
+
+def classify_ip_series(series):
+    """ 文字列Seriesを一括でIP判定し、バージョンと整数表現 (IPv4: uint32 / IPv6: 上位・下位uint64) を返す """
+    n = len(series)
+    # 'ドメイン (IP)' 形式は括弧内のIPで判定する (extract_actual_ip と同じ規則)
+    has_paren = series.str.contains('(', regex=False) & series.str.contains(')', regex=False)
+    actual = series.copy()
+    if has_paren.any():
+        actual[has_paren] = series[has_paren].str.split('(').str[-1].str.replace(')', '', regex=False).str.strip()
+
+    version = np.zeros(n, dtype=np.int8)
+    v4_int = np.zeros(n, dtype=np.uint32)
+    v6_hi = np.zeros(n, dtype=np.uint64)
+    v6_lo = np.zeros(n, dtype=np.uint64)
+
+    v4_mask = actual.str.fullmatch(IPV4_STRICT_PATTERN).fillna(False).to_numpy(dtype=bool)
+    if v4_mask.any():
+        octets = actual[v4_mask].str.split('.', n=3, expand=True).astype(np.uint32).to_numpy()
+        v4_int[v4_mask] = (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+        version[v4_mask] = 4
+
+    # IPv6の表記揺れ (省略形・埋め込みIPv4等) は正規表現で網羅できないため、コロンを含む候補のみ個別に検証する
+    v6_candidates = np.flatnonzero(~v4_mask & actual.str.contains(':', regex=False).fillna(False).to_numpy(dtype=bool))
+    actual_values = actual.to_numpy(dtype=object)
+    for idx in v6_candidates:
+        try:
+            packed = int(ipaddress.IPv6Address(actual_values[idx]))
+        except ValueError:
+            continue
+        version[idx] = 6
+        v6_hi[idx] = packed >> 64
+        v6_lo[idx] = packed & 0xFFFFFFFFFFFFFFFF
+    return version, v4_int, v6_hi, v6_lo, has_paren.to_numpy(dtype=bool)
+
+def domain_format_mask(series, ip_version):
+    """ is_valid_domain と同じFQDN形式チェックを Series 全体へ一括適用する """
+    mask = np.zeros(len(series), dtype=bool)
+    # IPと判定済みの行はドメインになり得ないため、残りの行だけを検査する
+    candidates = ip_version == 0
+    if not candidates.any():
+        return mask
+    sub = series[candidates]
+    tld = sub.str.rsplit('.', n=1).str[-1]
+    mask[candidates] = (
+        sub.str.contains('.', regex=False).to_numpy(dtype=bool)
+        & ~sub.str.startswith('.').to_numpy(dtype=bool)
+        & ~sub.str.endswith('.').to_numpy(dtype=bool)
+        & ~sub.str.contains(r'\s', regex=True).to_numpy(dtype=bool)
+        & tld.str.isalpha().to_numpy(dtype=bool)
+        & (tld.str.len() >= 2).to_numpy(dtype=bool)
+    )
+    return mask
+
+def normalize_targets(raw_targets):
+    """ 入力ターゲットをOCR補正・IP/ドメイン判定・重複排除し、入力順の型付きターゲット表と除外リストを返す """
+    empty_table = pd.DataFrame({
+        'target': pd.Series(dtype='object'), 'kind': pd.Categorical([], categories=['ipv4', 'ipv6', 'range', 'domain']),
+        'version': pd.Series(dtype=np.int8), 'v4_int': pd.Series(dtype=np.uint32),
+        'v6_hi': pd.Series(dtype=np.uint64), 'v6_lo': pd.Series(dtype=np.uint64), 'composite': pd.Series(dtype=bool)
+    })
+    if not raw_targets:
+        return empty_table, []
+
+    # 同じ文字列は一度だけ判定する (出現順を保持)。文字列型のSeriesにすることで .str 処理をC実装側で一括実行させる
+    uniq = pd.Series(pd.unique(pd.Series(raw_targets, dtype='object').astype(str)), dtype='string')
+    cleaned = clean_ocr_error_series(uniq)
+
+    raw_ver, raw_v4, raw_hi, raw_lo, raw_paren = classify_ip_series(uniq)
+    raw_is_domain = domain_format_mask(uniq, raw_ver)
+    # OCR補正で値が変わった行だけを再判定し、変化のない行 (大半のIPリスト) は元の判定結果を流用する
+    changed = (cleaned != uniq).to_numpy(dtype=bool)
+    cln_ver, cln_v4, cln_hi, cln_lo, cln_paren = (a.copy() for a in (raw_ver, raw_v4, raw_hi, raw_lo, raw_paren))
+    cln_is_domain = raw_is_domain.copy()
+    if changed.any():
+        sub = cleaned[changed].reset_index(drop=True)
+        sub_ver, sub_v4, sub_hi, sub_lo, sub_paren = classify_ip_series(sub)
+        cln_ver[changed], cln_v4[changed], cln_hi[changed], cln_lo[changed], cln_paren[changed] = sub_ver, sub_v4, sub_hi, sub_lo, sub_paren
+        cln_is_domain[changed] = domain_format_mask(sub, sub_ver)
+
+    has_ocr_char = uniq.str.contains(OCR_ERROR_CHAR_PATTERN, regex=True).to_numpy(dtype=bool)
+    likely_domain = uniq.str.contains(LIKELY_DOMAIN_CHAR_PATTERN, regex=True).to_numpy(dtype=bool)
+
+    # 判定の優先順位は従来のループと同一:
+    # 1) OCR誤認文字を含み補正後がIP → 補正後を採用  2) 元の文字列がIP → そのまま採用
+    # 3) ドメインらしい文字を含む → 元の文字列がFQDN形式なら採用  4) それ以外 → 補正後がIP/FQDNなら採用
+    # CIDR / ハイフン範囲は展開せずに1ターゲットとして受け付け、正規化した表記に揃える
+    range_text = np.full(len(uniq), None, dtype=object)
+    range_candidates = np.flatnonzero(uniq.str.fullmatch(IP_RANGE_CANDIDATE_PATTERN).fillna(False).to_numpy(dtype=bool))
+    uniq_values = uniq.to_numpy(dtype=object)
+    for idx in range_candidates:
+        bounds = parse_ip_range(uniq_values[idx])
+        if bounds:
+            range_text[idx] = format_ip_range(*bounds)
+    is_range = range_text != None
+
+    use_cleaned_ip = ~is_range & has_ocr_char & (cln_ver > 0)
+    use_raw_ip = ~is_range & ~use_cleaned_ip & (raw_ver > 0)
+    rest = ~is_range & ~use_cleaned_ip & ~use_raw_ip
+    use_raw_domain = rest & likely_domain & raw_is_domain
+    use_cleaned_fallback = rest & ~likely_domain & ((cln_ver > 0) | cln_is_domain)
+    take_cleaned = use_cleaned_ip | use_cleaned_fallback
+    accepted = take_cleaned | use_raw_ip | use_raw_domain | is_range
+
+    invalid_targets = uniq[~accepted].tolist()
+
+    pick = lambda a, b: np.where(take_cleaned, a, b)[accepted]
+    final_text = np.where(take_cleaned, cleaned.to_numpy(dtype=object), uniq_values)
+    final_text = np.where(is_range, range_text, final_text)
+    for idx in np.flatnonzero(is_range):
+        # レンジの開始IPを整数列に格納しておき、後段のソート・集約で利用できるようにする
+        parsed = parse_target(range_text[idx])
+        raw_ver[idx] = parsed.version
+        if parsed.version == 4:
+            raw_v4[idx] = parsed.int_value
+        else:
+            raw_hi[idx], raw_lo[idx] = parsed.int_value >> 64, parsed.int_value & 0xFFFFFFFFFFFFFFFF
+    table = pd.DataFrame({
+        'target': final_text[accepted],
+        'version': pick(cln_ver, raw_ver).astype(np.int8),
+        'v4_int': pick(cln_v4, raw_v4).astype(np.uint32),
+        'v6_hi': pick(cln_hi, raw_hi).astype(np.uint64),
+        'v6_lo': pick(cln_lo, raw_lo).astype(np.uint64),
+        'composite': pick(cln_paren, raw_paren).astype(bool),
+    })
+    # 補正後の文字列が別の入力と重なる場合があるため、最終値で改めて重複排除する
+    table = table.drop_duplicates(subset='target', keep='first').reset_index(drop=True)
+    table['composite'] = table['composite'] & (table['version'] > 0)
+    range_rows = table['target'].isin(set(range_text[is_range])).to_numpy(dtype=bool)
+    table.insert(1, 'kind', pd.Categorical(
+        np.select([range_rows, table['version'] == 4, table['version'] == 6], ['range', 'ipv4', 'ipv6'], default='domain'),
+        categories=['ipv4', 'ipv6', 'range', 'domain']
+    ))
+    # 取り込み時点でTargetを生成しておき、検索・集計中の各ヘルパーでは解析済みオブジェクトを引くだけにする
+    for t in table['target']:
+        parse_target(t)
+    return table, invalid_targets
+
 # ==========================================
 # 状態管理（Session State）用ヘルパー関数
 # ==========================================
@@ -4570,7 +6864,7 @@ def init_session_state():
     """ アプリケーション起動時・リセット時に必要なSession Stateを初期化する """
     default_states = {
         'cancel_search': False,
-        'raw_results': [],
+        'raw_results': ResultStore(),
         'targets_cache': [],
         'is_searching': False,
         'deferred_ips': {},
@@ -4579,7 +6873,7 @@ def init_session_state():
         'target_freq_map': {},
         'cidr_cache': {},
         'debug_summary': {},
-        'detailed_data': {},
+        'detailed_data': DetailStore.create(),
         'learned_proxy_isps': {}
     }
     
@@ -4600,8 +6894,56 @@ def reset_search_state():
     st.session_state.deferred_ips = {}
     st.session_state.finished_ips = set()
     st.session_state.search_start_time = time.time()
+    st.session_state['search_progress'] = init_progress_counters()
+    # 結果リストは同じオブジェクトを使い回すため、前回検索の集計カウンターを明示的に破棄する
+    st.session_state.pop('summary_aggregator', None)
+    st.session_state.pop('triage', None)
     clear_recovery_data()
 
+# --- 2段階トリアージ ---
+# 1段階目 (ジオ・Tor・クラウド判定のみ) の結果から、2段階目 (詳細解析) の対象を選ぶ一次シグナルの選択肢
+TRIAGE_SIGNAL_LABELS = {'tor': "Torノード", 'cloud': "クラウド", 'hosting': "ホスティング", 'unknown_isp': "ISP不明", 'foreign': "海外"}
+TRIAGE_DEFAULT_SIGNALS = ['tor', 'cloud', 'hosting', 'unknown_isp']
+
+def select_triage_targets(tor_nodes, cloud_ip_data, trigger_signals):
+    """ 1段階目の結果行のうち、一次シグナルが条件に合致するIPターゲット (レンジを除く) を2段階目の対象として返す """
+    if not st.session_state.raw_results:
+        return []
+    trigger_signals = set(trigger_signals)
+    # 判定に使う列だけを列指向ストアから取り出し、検索対象かつ成功した行に絞ってから1行ずつ判定する
+    frame = st.session_state.raw_results.to_pandas(columns=['Target_IP', 'Status', 'ISP_API_Raw', 'CountryCode'])
+    is_candidate = text_column(frame, 'Target_IP', '').isin(set(st.session_state.targets_cache)) & text_column(frame, 'Status', '').str.startswith('Success')
+    detail_store = st.session_state.detailed_data
+    selected = []
+    for row in frame_rows_to_dicts(frame[is_candidate]):
+        target = row['Target_IP']
+        if is_ip_range(target):
+            continue
+        actual_ip = extract_actual_ip(target)
+        cloud_provider = check_cloud_provider(actual_ip, cloud_ip_data)
+        signals = collect_cheap_signals(actual_ip, row, tor_nodes, cloud_provider)
+        if not signals & trigger_signals and 'hosting' in trigger_signals:
+            # ASN種別の判定に使うIPinfoの応答は詳細データ側に分離して保存されているため、必要な場合のみその項目だけを読み出す
+            row['IPINFO_JSON'] = detail_store.get_field(target, 'IPINFO_JSON')
+            signals = collect_cheap_signals(actual_ip, row, tor_nodes, cloud_provider)
+        if signals & trigger_signals:
+            selected.append(target)
+    return selected
+
+def start_deep_phase(deep_targets):
+    """ 指定ターゲットの1段階目の行を取り除いて未完了へ戻し、2段階目 (詳細解析) として再検索させる。他のターゲットは再処理しない """
+    deep_set = set(deep_targets)
+    st.session_state['triage'] = {'phase': 2, 'targets': deep_set}
+    if not deep_set:
+        return
+    st.session_state.raw_results = ResultStore([r for r in st.session_state.raw_results if r.get('Target_IP') not in deep_set])
+    st.session_state.finished_ips -= deep_set
+    st.session_state['search_progress'] = init_progress_counters(st.session_state.finished_ips)
+    # 結果リストが縮むため、次回のチェックポイントでジャーナルを全体から書き直す
+    get_journal_cursor()['records'] = 0
+    st.session_state.is_searching = True
+    st.session_state.cancel_search = False
+
 
 # --- メイン処理 ---
 def main():
@@ -4609,7 +6951,7 @@ def main():
     init_session_state()
 
     # リカバリUI
-    if not IS_PUBLIC_MODE and os.path.exists(BACKUP_FILE) and not st.session_state.is_searching and not st.session_state.raw_results:
+    if not IS_PUBLIC_MODE and recovery_data_exists() and not st.session_state.is_searching and not st.session_state.raw_results:
         st.warning("⚠️ 前回中断された検索セッションが残っています。")
         col_rec1, col_rec2 = st.columns(2)
         with col_rec1:
@@ -4710,13 +7052,20 @@ def main():
                 # Reverse IPの設定
                 st.markdown("##### ⚙️ Reverse IP 追加設定")
                 use_st_rev_fetchall = st.checkbox("Reverse IP 全件取得 (API消費大)", value=False, help="オンにすると、同一IPに紐づくドメインが100件を超える場合、APIを複数回消費して全件取得を試みます。CDNのIPなどを対象にするとクレジットが枯渇する恐れがあります。")
+                use_st_fast_rate = st.checkbox(f"高速送信 (有料プラン向け: {SECURITYTRAILS_FAST_RPS}件/秒)", value=False, help=f"オンにすると、SecurityTrailsへの送信間隔を1秒{SECURITYTRAILS_MAX_RPS}件から{SECURITYTRAILS_FAST_RPS}件に引き上げます。無料枠ではレート制限に抵触する恐れがあります。")
             else:
                 use_st_rev_fetchall = False
+                use_st_fast_rate = False
+            # 送信上限は共有のリミッターを書き換えず、このセッションの照会ごとに引き渡す
+            st_rate = SECURITYTRAILS_FAST_RPS if use_st_fast_rate else SECURITYTRAILS_MAX_RPS
 
         st.markdown("---")
         if st.button("🔄 システム/キャッシュを完全リセット", help="キャッシュが古くなった場合やメモリを解放したい場合にクリック"):
             # セッションステートを完全に削除してガベージコレクションを促す
-            keys_to_delete = ['cidr_cache', 'detailed_data', 'raw_results', 'resolved_dns_map', 'original_df', 'original_input_list', 'targets_cache']
+            # ディスクへ退避した詳細データも併せて削除する
+            if 'detailed_data' in st.session_state:
+                st.session_state['detailed_data'].clear()
+            keys_to_delete = ['cidr_cache', 'detailed_data', 'raw_results', 'resolved_dns_map', 'original_df', 'original_input_list', 'targets_cache', 'ingest_cache', 'summary_aggregator', 'search_progress', 'recovery_journal', 'triage']
             for key in keys_to_delete:
                 if key in st.session_state:
                     del st.session_state[key]
@@ -4998,12 +7347,21 @@ def main():
             help_text = "※ 1行に1つのターゲットを記載"
         else:
             # ローカルモード (ローカル版の挙動): csv/excel許可
-            allowed_types = ['txt', 'csv', 'xlsx', 'xls']
-            label_text = "リストをアップロード (txt/csv/xlsx)"
-            help_text = "※ 1行に1つのターゲットを記載、またはCSV/ExcelのIP列を自動検出します"
+            allowed_types = ['txt', 'csv', 'xlsx', 'xls', 'log', 'jsonl', 'ndjson', 'gz']
+            label_text = "リストをアップロード (txt/csv/xlsx/log/jsonl)"
+            help_text = "※ 1行に1つのターゲットを記載、またはCSV/ExcelのIP列を自動検出します。アクセスログ・syslog・JSON Linesは形式を自動判別して取り込みます"
 
         uploaded_file = st.file_uploader(label_text, type=allowed_types)
         st.caption(help_text)
+
+        log_path_input = ""
+        log_format_choice = None
+        if not IS_PUBLIC_MODE:
+            # 数GB規模のログはアップロードせず、ローカルパスから直接ストリーム解析する
+            with st.expander("📜 ログ取り込み設定 (アクセスログ / syslog / JSON Lines)", expanded=False):
+                log_format_labels = {'自動判別': None, **{spec['label']: key for key, spec in LOG_PARSERS.items()}}
+                log_format_choice = log_format_labels[st.selectbox("ログ形式", list(log_format_labels.keys()), key="log_format_select")]
+                log_path_input = st.text_input("大容量ログファイルのパス (ローカル専用)", placeholder="/var/log/nginx/access.log", help="アップロードを経由せずにディスク上のログを逐次読み込みます。.gz圧縮にも対応しています。").strip()
         
     with input_tab3:
         single_input = st.text_input(
@@ -5014,10 +7372,14 @@ def main():
 
     raw_targets = []
     df_orig = None
+    ip_col = None
+    upload_entry = None
 
     # 元のファイル名をセッションに保存（ダウンロード時のプレフィックス用）
     if uploaded_file:
         st.session_state['base_filename'] = os.path.splitext(uploaded_file.name)[0]
+    elif log_path_input:
+        st.session_state['base_filename'] = os.path.splitext(os.path.basename(log_path_input))[0]
     else:
         st.session_state['base_filename'] = "WhoisSearchResult"
 
@@ -5026,196 +7388,58 @@ def main():
         
     if single_input:
         raw_targets.append(single_input.strip())
+
+    # 生データからすべての空白文字（半角・全角スペース、タブ等）を完全に除去し、空行を排除する
+    raw_targets = [re.sub(r'\s+', '', t) for t in raw_targets if t.strip()]
     
     if uploaded_file:
-        # --- 公開モードの場合の読み込み処理 (StreamlitCloud版ロジック) ---
-        if IS_PUBLIC_MODE:
-             try:
-                # シンプルにテキストとして読み込む
-                string_data = uploaded_file.read().decode("utf-8")
-                raw_targets.extend(string_data.splitlines())
-                
-                # 元データフレーム機能は無効化
-                st.session_state['original_df'] = None
-                st.session_state['ip_column_name'] = None
-                
-                st.info(f"📄 テキスト読み込み完了: {len(raw_targets)} 行")
-
-             except Exception as e:
-                st.error(f"ファイル読み込みエラー: {e}")
-        
-        # --- ローカルモードの場合の読み込み処理  ---
+        # 再実行(rerun)のたびに巨大なCSV/Excelを解析し直さないよう、内容ハッシュで取り込み結果を再利用する
+        upload_entry = get_cached_upload(uploaded_file, text_only=IS_PUBLIC_MODE, log_format=log_format_choice)
+    elif log_path_input:
+        with st.spinner("⏳ ログファイルを解析中..."):
+            upload_entry = get_cached_log_path(log_path_input, log_format=log_format_choice)
+
+    if upload_entry:
+        if upload_entry['error']:
+            st.error(f"ファイル読み込みエラー: {upload_entry['error']}")
         else:
-            ip_col = None
-            try:
-                if uploaded_file.name.endswith('.csv'):
-                    df_orig = pd.read_csv(uploaded_file)
-                elif uploaded_file.name.endswith(('.xlsx', '.xls')):
-                    df_orig = pd.read_excel(uploaded_file)
-                else:
-                    # TXTファイル
-                    raw_targets.extend(uploaded_file.read().decode("utf-8").splitlines())
-                    st.session_state['original_df'] = None
-                    st.session_state['ip_column_name'] = None
-                
-            except Exception as e:
-                st.error(f"ファイル読み込みエラー: {e}")
+            df_orig = upload_entry['df_orig']
+            ip_col = upload_entry['ip_col']
+            st.session_state['original_df'] = df_orig
+            st.session_state['ip_column_name'] = ip_col
             
-            # --- ローカルモードの場合の読み込み処理  ---
+            if df_orig is None:
+                st.info(f"📄 テキスト読み込み完了: {len(upload_entry['targets'])} 行")
+            elif ip_col:
+                # --- アップロードデータのプレビュー (空枠の作成) ---
+                if upload_entry.get('log_format'):
+                    st.info(f"📜 ログ取り込み完了 ({LOG_PARSERS[upload_entry['log_format']]['label']}): {len(df_orig)} 件 / ユニークIP: {len(upload_entry['freq_counts'])} 件")
+                else:
+                    st.info(f"📄 ファイル読み込み完了: {len(df_orig)} 行 / IP列: `{ip_col}`")
+                with st.expander("👀 アップロードデータ・プレビュー", expanded=False):
+                    if upload_entry.get('log_format') and len(df_orig) > LOG_PREVIEW_ROWS:
+                        st.caption(f"※ 先頭 {LOG_PREVIEW_ROWS:,} 件のみを表示しています。")
+                    preview_container = st.empty() 
+                # ---------------------------------------------
             else:
-                ip_col = None
-                try:
-                    if uploaded_file.name.endswith('.csv'):
-                        df_orig = pd.read_csv(uploaded_file)
-                    elif uploaded_file.name.endswith(('.xlsx', '.xls')):
-                        df_orig = pd.read_excel(uploaded_file)
-                    else:
-                        # TXTファイル
-                        raw_targets.extend(uploaded_file.read().decode("utf-8").splitlines())
-                        st.session_state['original_df'] = None
-                        st.session_state['ip_column_name'] = None
-                    
-                    if df_orig is not None:
-                        st.session_state['original_df'] = df_orig
-                        for col in df_orig.columns:
-                            sample = df_orig[col].dropna().head(10).astype(str)
-                            if any(is_valid_ip(val.strip()) for val in sample):
-                                ip_col = col
-                                break
-                        
-                        if ip_col:
-                            st.session_state['ip_column_name'] = ip_col
-                            raw_targets.extend(df_orig[ip_col].dropna().astype(str).tolist())
-                            
-                            # --- アップロードデータのプレビュー (空枠の作成) ---
-                            st.info(f"📄 ファイル読み込み完了: {len(df_orig)} 行 / IP列: `{ip_col}`")
-                            with st.expander("👀 アップロードデータ・プレビュー", expanded=False):
-                                preview_container = st.empty() 
-                            # ---------------------------------------------
-                        else:
-                            st.error("ファイル内にIPアドレスの列が見つかりませんでした。")
-
-                except Exception as e:
-                    st.error(f"ファイル読み込みエラー: {e}")
-    
-    cleaned_raw_targets_list = []
-    target_freq_counts = {}
-
-    # 生データからすべての空白文字（半角・全角スペース、タブ等）を完全に除去し、空行を排除する
-    raw_targets = [re.sub(r'\s+', '', t) for t in raw_targets if t.strip()]
-
-    if raw_targets:
-        cleaned_raw_targets_list = [clean_ocr_error_chars(t) for t in raw_targets]
-        target_freq_counts = pd.Series(cleaned_raw_targets_list).value_counts().to_dict()
-    else:
-        target_freq_counts = {}
-
-    targets = []
-    invalid_targets_skipped = [] # 無効としてスキップされたターゲットを記録
-    ocr_error_chars = set('Iil|OoSsAaBⅡ')
-    resolved_dns_map = {} # nslookupの生出力保存用辞書
-
-    def resolve_domain_nslookup(domain):
-    
-        ips = []
-        raw_lines = []
-    
-        try:
-            # システムのリゾルバに依存せず、Google/CloudflareのパブリックDNSを明示的に使用
-            resolver = dns.resolver.Resolver(configure=False)
-            resolver.nameservers = random.sample(PUBLIC_DNS_SERVERS, 2) + random.sample(PUBLIC_DNS_V6_SERVERS, 1)
-            resolver.timeout = 3
-            resolver.lifetime = 3
-
-            raw_lines.append(f";; Domain: {domain}")
-            raw_lines.append(f";; Resolver: {resolver.nameservers}")
-
-            # --- Aレコード (IPv4) 取得 ---
-            try:
-                answers_v4 = resolver.resolve(domain, 'A')
-                for rdata in answers_v4:
-                    ip = rdata.to_text()
-                    if ip not in ips:
-                        ips.append(ip)
-                    raw_lines.append(f"{domain}. \tIN \tA \t{ip}")
-            except dns.resolver.NoAnswer:
-                raw_lines.append(f";; IPv4 (A) record not found for {domain}")
-            except dns.resolver.NXDOMAIN:
-                raw_lines.append(f";; Domain {domain} does not exist (NXDOMAIN)")
-                return [], "\n".join(raw_lines) # ドメインがないなら終了
-            except Exception as e:
-                raw_lines.append(f";; IPv4 Query Failed: {str(e)}")
-
-            # --- AAAAレコード (IPv6) 取得 ---
-            try:
-                answers_v6 = resolver.resolve(domain, 'AAAA')
-                for rdata in answers_v6:
-                    ip = rdata.to_text()
-                    if ip not in ips:
-                        ips.append(ip)
-                    raw_lines.append(f"{domain}. \tIN \tAAAA \t{ip}")
-            except dns.resolver.NoAnswer:
-                pass # IPv6がないのは一般的
-            except Exception as e:
-                raw_lines.append(f";; IPv6 Query Failed: {str(e)}")
-
-            # --- MXレコード (Mail Exchange) 取得 ---
-            try:
-                # MXレコードは捨てアド特定の生命線であるため、専用の長いライフタイムを設定して取得を試みる
-                resolver_mx = dns.resolver.Resolver(configure=False)
-                resolver_mx.nameservers = random.sample(PUBLIC_DNS_SERVERS, 3)
-                resolver_mx.timeout = 5
-                resolver_mx.lifetime = 10
-                
-                answers_mx = resolver_mx.resolve(domain, 'MX')
-                for rdata in answers_mx:
-                    mx_target = rdata.exchange.to_text(omit_final_dot=True)
-                    mx_pref = rdata.preference
-                    raw_lines.append(f"{domain}. \tIN \tMX \t{mx_pref} {mx_target}")
-            except dns.resolver.NoAnswer:
-                raw_lines.append(f";; MX record not found for {domain}")
-            except Exception as e:
-                raw_lines.append(f";; MX Query Failed: {str(e)}")
-
-        except Exception as e:
-            raw_lines.append(f";; Critical DNS Error: {str(e)}")
-    
-        return ips, "\n".join(raw_lines)
-
-    for t in raw_targets:
-        original_t = t
-        is_ocr_error_likely = any(c in ocr_error_chars for c in original_t)
-        if is_ocr_error_likely:
-            cleaned_t = clean_ocr_error_chars(original_t)
-            if is_valid_ip(cleaned_t):
-                if cleaned_t not in targets: targets.append(cleaned_t)
-                continue
-            t = original_t
-        
-        invalid_ip_chars = set('ghijklmnopqrstuvwxyz')
-        has_hyphen = '-' in t
-        has_strictly_domain_char = any(c in invalid_ip_chars for c in t.lower())
-        is_likely_domain_or_host = has_hyphen or has_strictly_domain_char
+                st.error("ファイル内にIPアドレスの列が見つかりませんでした。")
     
-        if is_valid_ip(t):
-            if t not in targets: targets.append(t)
-        elif is_likely_domain_or_host:
-            # ドメイン形式の厳格チェック
-            if is_valid_domain(t):
-                # DNS解決を入力時から削除し、単にドメインとしてキューに入れる
-                if t not in targets: targets.append(t)
-            else:
-                invalid_targets_skipped.append(t) # 不正なドメインとして除外
+    cleaned_raw_targets_list = clean_ocr_error_series(pd.Series(raw_targets, dtype='object')).tolist()
+    target_freq_counts = pd.Series(cleaned_raw_targets_list).value_counts().to_dict() if cleaned_raw_targets_list else {}
+
+    # ファイル側の整形済みリストと頻度集計はキャッシュ済みのものを合算する
+    if upload_entry and not upload_entry['error']:
+        raw_targets.extend(upload_entry['targets'])
+        cleaned_raw_targets_list.extend(upload_entry['cleaned_targets'])
+        if target_freq_counts:
+            for t, c in upload_entry['freq_counts'].items():
+                target_freq_counts[t] = target_freq_counts.get(t, 0) + c
         else:
-            cleaned_t_final = clean_ocr_error_chars(t)
-            if is_valid_ip(cleaned_t_final):
-                if cleaned_t_final not in targets: targets.append(cleaned_t_final)
-            else:
-                # クリーンアップ後もドメイン形式の厳格チェック
-                if is_valid_domain(cleaned_t_final):
-                    if cleaned_t_final not in targets: targets.append(cleaned_t_final)
-                else:
-                    invalid_targets_skipped.append(t) # 不正なドメインとして除外
+            target_freq_counts = dict(upload_entry['freq_counts'])
+
+    # 10万行規模でも一瞬で終わるよう、判定・重複排除はユニーク値に対する一括処理で行う
+    target_table, invalid_targets_skipped = normalize_targets(raw_targets)
+    targets = target_table['target'].tolist()
 
     # スキップされたターゲットがあれば警告を表示
     if invalid_targets_skipped:
@@ -5223,22 +7447,8 @@ def main():
 
     # --- プレビュー表に判定結果を反映させる (NEW) ---
     if 'preview_container' in locals() and df_orig is not None and ip_col:
-        preview_df = df_orig.copy()
-        # 除外対象がある場合のみ判定列を追加する
-        if invalid_targets_skipped:
-            invalid_set = set(invalid_targets_skipped) # ⬅️ 検索高速化のためSet(集合)に変換
-            def check_status(val):
-                if pd.isna(val): return "➖ 空欄"
-                val_str = str(val).strip()
-                if val_str in invalid_set:
-                    return "⚠️ 除外 (形式エラー)"
-                return "✅ 検索対象"
-            
-            # データフレームの一番左 (インデックス0) に判定列を挿入
-            preview_df.insert(0, '📝 判定結果', preview_df[ip_col].apply(check_status))
-            
-        # プレースホルダーにデータフレームを描画
-        preview_container.dataframe(preview_df, width="stretch")
+        # プレースホルダーにデータフレームを描画 (除外対象が変わらない限りキャッシュ済みの表を再利用)
+        preview_container.dataframe(get_upload_preview(upload_entry, invalid_targets_skipped), width="stretch")
 
     has_new_targets = (targets != st.session_state.targets_cache)
     
@@ -5249,15 +7459,18 @@ def main():
             st.session_state['resolved_dns_map'] = {} # 新規入力時はマップをリセットする
 
     # --- エンジン処理用の振り分け（ドメイン(IP)はIPとして処理させる） ---
-    ip_targets = [t for t in targets if is_valid_ip(t)]
-    domain_targets = [t for t in targets if not is_valid_ip(t)]
+    is_ip_mask = (target_table['version'] > 0).to_numpy()
+    is_range_mask = (target_table['kind'] == 'range').to_numpy()
+    ip_targets = target_table['target'][is_ip_mask & ~is_range_mask].tolist()
+    range_targets = target_table['target'][is_range_mask].tolist()
+    domain_targets = target_table['target'][~is_ip_mask].tolist()
 
     # --- UI表示用の厳密なカウント & カテゴリ分け ---
     # 1. ドメインから解決されたIP (例: "domain.com (1.2.3.4)")
-    count_resolved_ip = sum(1 for t in ip_targets if "(" in t and ")" in t)
+    count_resolved_ip = int(target_table['composite'].sum())
     
     # 2. 直接入力されたIPv6
-    count_direct_ipv6 = sum(1 for t in ip_targets if not is_ipv4(t) and "(" not in t)
+    count_direct_ipv6 = int(((target_table['kind'] == 'ipv6') & ~target_table['composite']).sum())
     
     # 3. 直接入力されたIPv4 (全IPターゲット - 解決分 - IPv6)
     count_direct_ipv4 = len(ip_targets) - count_direct_ipv6 - count_resolved_ip
@@ -5265,6 +7478,9 @@ def main():
     # 4. 純粋なドメインターゲット
     count_domain = len(domain_targets)
 
+    # 5. CIDR / ハイフン範囲 (レンジ単位で1回だけ照会する)
+    count_range = len(range_targets)
+
     # 合計待機数
     count_pending = len(st.session_state.deferred_ips)
 
@@ -5277,6 +7493,16 @@ def main():
             st.markdown("**解析モード:** (追加の解析オプションを選択)")
             # InternetDBオプション
             use_internetdb_option = st.checkbox("IoTリスク検知 (InternetDBを利用)", value=False, help="Shodan InternetDBを利用して、対象IPの開放ポートや踏み台リスクを検知します。")
+            internetdb_risk_ports = INTERNETDB_RISK_PORTS
+            if use_internetdb_option:
+                selected_risk_ports = st.multiselect(
+                    "IoTリスクとして扱うポート",
+                    options=list(INTERNETDB_RISK_PORTS),
+                    default=list(INTERNETDB_RISK_PORTS),
+                    format_func=lambda port: f"{port} ({INTERNETDB_RISK_PORTS[port]})",
+                    help="変更しても再照会は行わず、取得済みの開放ポート情報から判定し直して表示します。"
+                )
+                internetdb_risk_ports = {port: INTERNETDB_RISK_PORTS[port] for port in selected_risk_ports}
             # RDAPオプション
             use_rdap_option = st.checkbox("公式レジストリ情報 (RDAP公式台帳の併用 - 5秒待機)", value=False, help="RDAP(公式台帳)から最新のネットワーク名を取得します。アクセス制限を避けるため処理速度が強制的に低下します。")
             # 逆引き(rDNS)オプション
@@ -5288,6 +7514,30 @@ def main():
                 disabled=not bool(st_api_key), 
                 help="SecurityTrails APIを使用し、対象IPに紐づくドメイン群を逆検索します。※APIキーの設定が必要です。"
             )
+            # 2段階トリアージ (一次情報のみで全件を処理した後、疑わしいIPのみ詳細解析を自動実行する)
+            use_triage_option = st.checkbox(
+                "2段階トリアージ (高速な一次判定 → 疑わしいIPのみ詳細解析)",
+                value=False,
+                key="triage_checkbox",
+                help="1段階目はジオ情報とTor・クラウド判定のみで全件を高速に処理してダッシュボードを表示し、2段階目で条件に合致したIPにのみRDAP・WHOIS・逆引き・VPNAPI等の詳細解析を実行します。"
+            )
+            triage_signals = TRIAGE_DEFAULT_SIGNALS
+            if use_triage_option:
+                triage_signals = st.multiselect(
+                    "詳細解析の対象条件 (いずれかに該当するIP)",
+                    list(TRIAGE_SIGNAL_LABELS.keys()),
+                    default=TRIAGE_DEFAULT_SIGNALS,
+                    format_func=TRIAGE_SIGNAL_LABELS.get,
+                    key="triage_signals_select"
+                )
+            # 照会ポリシー (VPNAPI・Reverse IP・InternetDB を一次シグナルに応じて省略する)
+            enrichment_policy = st.selectbox(
+                "照会ポリシー (有料・低速APIの呼び出し条件)",
+                list(ENRICHMENT_POLICIES.keys()),
+                index=list(ENRICHMENT_POLICIES.keys()).index(DEFAULT_ENRICHMENT_POLICY),
+                key="enrichment_policy_select",
+                help="クラウドレンジ・Tor・ISP名/ASN種別・国などの一次情報から判定し、一般の住宅回線など照会の必要性が低いIPではVPNAPI・Reverse IP・InternetDBの呼び出しを省略してAPIクォータを節約します。"
+            )
 
         with col_set1:
             display_mode = st.radio(
@@ -5298,12 +7548,12 @@ def main():
             )
             st.markdown("---") 
             
-            # RDAPまたはrDNSがオンの場合は、ユーザーに設定させずUI上で固定値を明示する
-            if use_rdap_option:
+            # RDAPまたはrDNSがオンの場合は、ユーザーに設定させずUI上で固定値を明示する (トリアージ時は2段階目のみ自動で制限する)
+            if use_rdap_option and not use_triage_option:
                 st.info("ℹ️ **RDAP有効時の制限**\n公式台帳のアクセス制限を回避するため、自動的に「単一スレッド / 5秒待機」に固定されます。速度を優先する場合は右側のチェックを外してください。")
                 max_workers = 1
                 delay_between_requests = 5.0
-            elif use_rdns_option:
+            elif use_rdns_option and not use_triage_option:
                 st.info("ℹ️ **逆引き(rDNS)有効時の制限**\nDNSクエリの競合を防ぐため、自動的に「単一スレッド / 2秒待機」に固定されます。速度を優先する場合は右側のチェックを外してください。")
                 max_workers = 1
                 delay_between_requests = 2.0
@@ -5319,7 +7569,7 @@ def main():
                 # 2. 変数の確定ロジック (KeyError 回避策)
                 if api_mode_selection == "カスタム設定 (任意調整)":
                     st.markdown("---")
-                    max_workers = st.slider("並列スレッド数 (同時処理数)", 1, 5, 2, help="数を増やすと速くなりますが、API制限にかかりやすくなります。")
+                    max_workers = st.slider("並列スレッド数 (同時処理数)", 1, MAX_WORKERS_LIMIT, 2, help="数を増やすと速くなりますが、API制限にかかりやすくなります。")
                     delay_between_requests = st.slider("リクエスト間待機時間 (秒)", 0.1, 5.0, 1.5, 0.1, help="値を増やすほど安全ですが、検索に時間がかかります。")
                 else:
                     selected_settings = MODE_SETTINGS[api_mode_selection]
@@ -5348,9 +7598,10 @@ def main():
         * **ファイル名に注意**: アップロードする場合は、ファイル名に機密情報（例: `ClientA_Log.txt`）を含めず、`list.txt` などの無機質な名前を使用してください。
         """)
 
+    range_info = f"IPレンジ: {count_range}件 / " if count_range else ""
     status_msg = (
         f"**検索対象:** IPアドレス: {count_direct_ipv4}件(v4)・{count_direct_ipv6}件(v6) / "
-        f"ドメイン: {count_domain} 件 (正引きIP: {count_resolved_ip}件) / "
+        f"ドメイン: {count_domain} 件 (正引きIP: {count_resolved_ip}件) / {range_info}"
         f"待機中: {count_pending}件 / **キャッシュ:** {len(st.session_state.cidr_cache)}件"
     )
     st.info(status_msg)
@@ -5369,6 +7620,22 @@ def main():
     if not use_internetdb_option:
         st.caption("※ **IoT Check Inactive:** IoT/脆弱性リスク検知はスキップされます。")
 
+    # 開始前に、キャッシュを考慮したAPI呼び出し数・所要時間を見積もって表示する
+    if not is_currently_searching and targets and "簡易" not in current_mode_full_text:
+        # RDAP・逆引きで設定画面の値が固定されている場合、一次判定のみの見積もりには選択中のAPI処理モードの値を使う
+        light_settings = None
+        if (use_rdap_option or use_rdns_option) and not use_triage_option:
+            light_mode = MODE_SETTINGS.get(st.session_state.get("api_mode_radio"), next(iter(MODE_SETTINGS.values())))
+            light_settings = (light_mode["MAX_WORKERS"], light_mode["DELAY_BETWEEN_REQUESTS"])
+        search_plan = plan_search_run(
+            ip_targets, range_targets, domain_targets, max_workers, delay_between_requests,
+            use_rdap_option, use_internetdb_option, use_rdns_option, use_st_reverse_ip, pro_api_key, vpnapi_key, st_api_key,
+            use_triage_option, enrichment_policy, has_new_targets, light_settings
+        )
+        render_search_plan(search_plan, suggest_cheaper_options(
+            search_plan, use_rdap_option, use_rdns_option, vpnapi_key, use_st_reverse_ip, pro_api_key, use_triage_option, enrichment_policy
+        ))
+
     st.markdown("<br>", unsafe_allow_html=True) # ボタンとの間に少し余白を作る
 
     # 4. 実行ボタン
@@ -5396,11 +7663,13 @@ def main():
             # 新規検索時に古い巨大なデータを明示的に解放し、状態をリセットする
             reset_search_state()
             st.session_state.targets_cache = targets
+            if use_triage_option:
+                st.session_state['triage'] = {'phase': 1, 'targets': set()}
             st.rerun() 
             
         elif is_currently_searching:
             targets = st.session_state.targets_cache
-            domain_targets = [t for t in targets if not is_valid_ip(t)]
+            domain_targets = [t for t in targets if not is_valid_ip(t) and not is_ip_range(t)]
 
             st.subheader("⏳ 処理中...")
             
@@ -5409,25 +7678,28 @@ def main():
             if unresolved_domains:
                 with st.spinner(f"⏳ {len(unresolved_domains)}件のドメインを並列で名前解決中... (並列数: {max_workers})"):
                     def resolve_and_map(domain):
-                        ips, raw = resolve_domain_nslookup(domain)
-                        return domain, ips, raw
+                        ips, raw, records = resolve_domain_nslookup(domain)
+                        return domain, ips, raw, records
                     
                     # DNSクエリ(UDP)によるルーターのNAT溢れを防ぐため、ユーザー設定のmax_workersに同期させる
                     with ThreadPoolExecutor(max_workers=max_workers) as dns_executor:
                         dns_results = list(dns_executor.map(resolve_and_map, unresolved_domains))
                         
-                    for domain, ips, raw in dns_results:
-                        st.session_state.resolved_dns_map[domain] = {'ips': ips, 'raw': raw}
+                    known_targets = set(targets)
+                    for domain, ips, raw, records in dns_results:
+                        st.session_state.resolved_dns_map[domain] = {'ips': ips, 'raw': raw, 'records': records}
                         for resolved_ip in ips:
                             combined_t = f"{domain} ({resolved_ip})"
-                            if combined_t not in targets: 
+                            if combined_t not in known_targets: 
+                                known_targets.add(combined_t)
                                 targets.append(combined_t)
                     
                     # DNS解決済みのターゲットリストでキャッシュを最新状態に上書き
                     st.session_state.targets_cache = targets
 
             # DNS並列解決が完了した後、改めて全体のIPターゲットを抽出してキューに流す
-            ip_targets = [t for t in targets if is_valid_ip(t)]
+            # レンジはIPと同じキューで処理する (ワーカー側でレンジ単位の照会に振り分ける)
+            ip_targets = [t for t in targets if is_valid_ip(t) or is_ip_range(t)]
             total_targets = len(targets)
             total_ip_api_targets = len(ip_targets)
             
@@ -5445,12 +7717,15 @@ def main():
             st.session_state.deferred_ips = deferred_ips_new
             
             immediate_ip_queue_unique = []
+            queued_ips = set()
             for ip in ip_targets_to_process:
-                if ip not in st.session_state.deferred_ips and ip not in immediate_ip_queue_unique:
+                if ip not in st.session_state.deferred_ips and ip not in queued_ips:
+                    queued_ips.add(ip)
                     immediate_ip_queue_unique.append(ip)
 
             immediate_ip_queue = immediate_ip_queue_unique
-            immediate_ip_queue.extend(ready_to_retry_ips)
+            # 再試行対象は未完了ターゲットとして既にキューに含まれているため、重複して投入しない
+            immediate_ip_queue.extend(ip for ip in ready_to_retry_ips if ip not in queued_ips)
             
             is_single_input = (len(cleaned_raw_targets_list) == 1)
             if "簡易" in current_mode_full_text:
@@ -5458,23 +7733,21 @@ def main():
                     results_list = []
                     for t in targets:
                         results_list.append(get_simple_mode_details(t))
-                    st.session_state.raw_results = results_list
+                    st.session_state.raw_results = ResultStore(results_list)
                     st.session_state.finished_ips.update(targets)
                     st.session_state.is_searching = False
                     st.rerun()
 
             else:
-                if not any(res['ISP'] == 'Domain/Host' for res in st.session_state.raw_results) and domain_targets:
+                # ドメイン結果の有無はISP列だけを列指向のまま調べる (行ごとに復元しない)
+                if domain_targets and not st.session_state.raw_results.to_pandas(columns=['ISP'])['ISP'].eq('Domain/Host').any():
                     for d in domain_targets:
                         dns_data = st.session_state.get('resolved_dns_map', {}).get(d, {})
                         ns_raw = dns_data.get('raw', '') if isinstance(dns_data, dict) else str(dns_data)
-                        res_domain = get_domain_details(d, ns_raw, st_api_key, st_start_date, st_end_date, is_single_target=is_single_input)
+                        dns_records = dns_data.get('records') if isinstance(dns_data, dict) else None
+                        res_domain = get_domain_details(d, ns_raw, st_api_key, st_start_date, st_end_date, is_single_target=is_single_input, dns_records=dns_records, st_rate=st_rate)
                         
-                        heavy_keys = ['RDAP_JSON', 'VPNAPI_JSON', 'IPINFO_JSON', 'DOMAIN_RDAP_JSON', 'ST_JSON', 'RDNS_DATA', 'ST_REVERSE_IP_JSON', 'DOMAIN_WHOIS_TEXT', 'IP_WHOIS_TEXT']
-                        ip_val = res_domain['Target_IP']
-                        st.session_state.detailed_data[ip_val] = {k: res_domain.pop(k) for k in heavy_keys if k in res_domain}
-                        
-                        st.session_state.raw_results.append(res_domain)
+                        store_result_row(res_domain)
                     st.session_state.finished_ips.update(domain_targets)
 
                 prog_bar_container = st.empty()
@@ -5484,6 +7757,19 @@ def main():
                 if immediate_ip_queue:
                     cidr_cache_snapshot = st.session_state.cidr_cache.copy() 
                     learned_isps_snapshot = st.session_state.learned_proxy_isps.copy()
+
+                    # --- 2段階トリアージ: 段階に応じて詳細解析の有無を切り替える ---
+                    triage_phase = (st.session_state.get('triage') or {}).get('phase')
+                    run_rdap, run_rdns, run_internetdb, run_st_reverse, run_vpnapi_key = use_rdap_option, use_rdns_option, use_internetdb_option, use_st_reverse_ip, vpnapi_key
+                    run_single_target = is_single_input
+                    if triage_phase == 1:
+                        # 1段階目はジオ情報とローカルのTor・クラウド判定のみで全件を処理し、ダッシュボードを最短で表示させる
+                        run_rdap = run_rdns = run_internetdb = run_st_reverse = False
+                        run_vpnapi_key = None
+                    elif triage_phase == 2:
+                        # 2段階目は1段階目のCIDRキャッシュ (詳細解析なしの結果) を使わず、WHOISを含めて個別に照会し直す
+                        cidr_cache_snapshot = {}
+                        run_single_target = True
                     
                     # --- IPinfo バルク一括取得の実行 ---
                     bulk_ipinfo_cache_snapshot = {}
@@ -5498,139 +7784,143 @@ def main():
                     current_max_workers = max_workers
                     current_delay = delay_between_requests
                     
-                    if use_rdap_option:
+                    if run_rdap:
                         # RDAPエンドポイントの厳格なアクセス制限(429エラー)を回避するため強制保護
                         current_max_workers = 1
                         if current_delay < 5.0:
                             current_delay = 5.0
                         st.info("ℹ️ RDAP公式台帳のアクセス制限を回避するため、安全モード（シングルスレッド/最低5秒待機）で実行中...")
-                    elif use_rdns_option:
+                    elif run_rdns:
                         # DNSクエリの競合とタイムアウトを防ぐため強制的にシングルスレッド化
                         current_max_workers = 1 
                         if current_delay < 2.0:
                             current_delay = 2.0
                         st.info("ℹ️ 逆引き精度向上のため、負荷調整モード（シングルスレッド/最低2秒待機）で実行中...")
 
+                    # 同じ実IPを指すターゲット (複数ドメインの正引き結果など) をまとめ、IP単位の照会を1回に集約する
+                    ip_groups = {}
+                    for ip in immediate_ip_queue:
+                        group_key = ip if is_ip_range(ip) else extract_actual_ip(ip)
+                        ip_groups.setdefault(group_key, []).append(ip)
+
                     with ThreadPoolExecutor(max_workers=current_max_workers) as executor:
                         future_to_ip = {
                             executor.submit(
-                                get_ip_details_from_api, 
-                                ip, 
+                                get_range_details if is_ip_range(group_key) else get_ip_group_details, 
+                                group[0] if is_ip_range(group_key) else group, 
                                 cidr_cache_snapshot, 
                                 learned_isps_snapshot, 
                                 current_delay,
                                 rate_limit_wait_seconds,
                                 tor_nodes,
                                 cloud_ip_data,
-                                use_rdap_option,
-                                use_internetdb_option,
-                                use_rdns_option,
-                                use_st_reverse_ip,
+                                run_rdap,
+                                run_internetdb,
+                                run_rdns,
+                                run_st_reverse,
                                 pro_api_key,
-                                vpnapi_key,
+                                run_vpnapi_key,
                                 st_api_key,
                                 st_start_date,
                                 st_end_date,
                                 use_st_rev_fetchall,
-                                is_single_input,
-                                bulk_ipinfo_cache_snapshot
-                            ): ip for ip in immediate_ip_queue
+                                run_single_target,
+                                bulk_ipinfo_cache_snapshot,
+                                enrichment_policy,
+                                st_rate
+                            ): group_key for group_key, group in ip_groups.items()
                         }
                         remaining = set(future_to_ip.keys())
+                        progress = get_progress_counters()
+
+                        # ワーカー完了時のコールバックで結果をキューへ積み、メインスレッドはキューから一括で取り出して反映する
+                        result_queue = queue.Queue()
+                        for f in future_to_ip:
+                            f.add_done_callback(result_queue.put)
+                        pending_count = len(future_to_ip)
+                        last_drawn_count = len(st.session_state.raw_results)
+                        live_dashboard = None
+                        last_dashboard_time = 0.0
 
                         # UI更新用のタイマー初期化
                         last_ui_update_time = time.time()
                         last_backup_time = time.time() # バックアップ用タイマー
                         
-                        while remaining and not st.session_state.cancel_search:
-                            done, remaining = wait(remaining, timeout=0.1, return_when=FIRST_COMPLETED)
-                            
-                            # タスクが完了した時のみ画面更新処理を行う
-                            if done: 
-                                for f in done:
-                                    res_tuple = f.result()
-                                    res = res_tuple[0]
-                                    new_cache_entry = res_tuple[1] if len(res_tuple) > 1 else None
-                                    new_learned_isp = res_tuple[2] if len(res_tuple) > 2 else None
-                                    ip = res['Target_IP']
-                                    
-                                    if new_cache_entry:
-                                        st.session_state.cidr_cache.update(new_cache_entry)
-                                    
-                                    # メインスレッド側で学習済みリストを安全に更新
-                                    if new_learned_isp:
-                                        st.session_state.learned_proxy_isps.update(new_learned_isp)
-                                    if res.get('Status', '').startswith('Success'):
-                                        heavy_keys = ['RDAP_JSON', 'VPNAPI_JSON', 'IPINFO_JSON', 'DOMAIN_RDAP_JSON', 'ST_JSON', 'RDNS_DATA', 'ST_REVERSE_IP_JSON', 'DOMAIN_WHOIS_TEXT', 'IP_WHOIS_TEXT']
-                                        st.session_state.detailed_data[ip] = {k: res.pop(k) for k in heavy_keys if k in res}
-                                        
-                                        st.session_state.raw_results.append(res)
-                                        st.session_state.finished_ips.add(ip)
-                                    elif res.get('Defer_Until'):
-                                        st.session_state.deferred_ips[ip] = res['Defer_Until']
-                                    else:
-                                        heavy_keys = ['RDAP_JSON', 'VPNAPI_JSON', 'IPINFO_JSON', 'DOMAIN_RDAP_JSON', 'ST_JSON', 'RDNS_DATA', 'ST_REVERSE_IP_JSON', 'DOMAIN_WHOIS_TEXT', 'IP_WHOIS_TEXT']
-                                        st.session_state.detailed_data[ip] = {k: res.pop(k) for k in heavy_keys if k in res}
-                                        
-                                        st.session_state.raw_results.append(res)
-                                        st.session_state.finished_ips.add(ip)
-
-                                current_time_for_ui = time.time()
-                                is_last_item = not remaining and not st.session_state.deferred_ips
-
-                                if total_ip_api_targets > 0 and (current_time_for_ui - last_ui_update_time > 1.5 or is_last_item):
-                                    last_ui_update_time = current_time_for_ui # タイマーをリセット
-                                    
-                                    processed_api_ips_count = len([ip for ip in st.session_state.finished_ips if is_valid_ip(ip)])
-                                    pct = int(processed_api_ips_count / total_ip_api_targets * 100)
-                                    elapsed_time = time.time() - st.session_state.search_start_time
-                                    eta_seconds = 0
-                                    if processed_api_ips_count > 0:
-                                        rate = processed_api_ips_count / elapsed_time
-                                        remaining_count = total_ip_api_targets - processed_api_ips_count
-                                        eta_seconds = math.ceil(remaining_count / rate)
+                        while pending_count and not st.session_state.cancel_search:
+                            # 次の画面更新時刻までは結果の到着を待ち、届いた時点で即座に起床する (固定スリープによる遅延を排除)
+                            wait_seconds = max(0.05, UI_REFRESH_INTERVAL - (time.time() - last_ui_update_time))
+                            batch = []
+                            try:
+                                batch.append(result_queue.get(timeout=wait_seconds))
+                                while True:
+                                    batch.append(result_queue.get_nowait())
+                            except queue.Empty:
+                                pass
+
+                            for f in batch:
+                                pending_count -= 1
+                                if not f.cancelled():
+                                    apply_worker_result(f.result(), progress)
+
+                            current_time_for_ui = time.time()
+                            is_last_item = not pending_count and not st.session_state.deferred_ips
+
+                            # 画面更新は結果の到着とは独立したタイマーで行う
+                            if total_ip_api_targets > 0 and (current_time_for_ui - last_ui_update_time >= UI_REFRESH_INTERVAL or is_last_item):
+                                last_ui_update_time = current_time_for_ui # タイマーをリセット
+                                
+                                processed_api_ips_count = progress['completed']
+                                pct = min(100, int(processed_api_ips_count / total_ip_api_targets * 100))
+                                # 全期間の平均ではなく直近のスループットから残り時間を推定する (キャッシュヒット連続時等の急変に追従させる)
+                                rate = update_throughput_estimate(progress, current_time_for_ui)
+                                eta_display = format_eta(total_ip_api_targets - processed_api_ips_count, rate)
+                                provider_display = " / ".join(f"{k}: {v}" for k, v in progress['providers'].most_common(3))
+                                saved_display = format_saved_calls(progress)
                                     
-                                    eta_display = "計算中..."
-                                    if eta_seconds > 0:
-                                        minutes = int(eta_seconds // 60)
-                                        seconds = int(eta_seconds % 60)
-                                        eta_display = f"{minutes:02d}分{seconds:02d}秒"
-                                        
-                                    # withを使わずに直接コンテナを上書きしてチラつきを防ぐ
-                                    prog_bar_container.progress(pct)
-                                    status_text_container.info(f"**⏳ 処理中... ({pct}%)** | 完了: {processed_api_ips_count}/{total_ip_api_targets} | ⏸️ 保留: {len(st.session_state.deferred_ips)} | 📦 キャッシュ: {len(st.session_state.cidr_cache)} | ⏱️ 残り: {eta_display}")
+                                # withを使わずに直接コンテナを上書きしてチラつきを防ぐ
+                                prog_bar_container.progress(pct)
+                                status_text_container.info(f"**⏳ 処理中... ({pct}%)** | 完了: {processed_api_ips_count}/{total_ip_api_targets} | ⏸️ 保留: {len(st.session_state.deferred_ips)} | ❌ エラー: {progress['errors']} | 📦 キャッシュ: {len(st.session_state.cidr_cache)} (ヒット {progress['cached']}) | ⏱️ 残り: {eta_display}" + (f" | 🔌 {provider_display}" if provider_display else "") + (f" | 💰 節約: {saved_display}" if saved_display else ""))
+                                
+                                # リアルタイム分析は結果件数に応じて間隔を延ばし、前回の描画以降に結果が増えた場合のみ更新する
+                                result_count = len(st.session_state.raw_results)
+                                if result_count != last_drawn_count and (current_time_for_ui - last_dashboard_time >= live_dashboard_interval(result_count) or is_last_item):
+                                    last_drawn_count = result_count
+                                    last_dashboard_time = current_time_for_ui
+                                    isp_df, country_df, freq_df, country_all_df, isp_full_df, country_full_df, freq_full_df, proxy_df = summarize_in_realtime(st.session_state.raw_results, include_full=False)
                                     
-                                    isp_df, country_df, freq_df, country_all_df, isp_full_df, country_full_df, freq_full_df, proxy_df = summarize_in_realtime(st.session_state.raw_results)
+                                    # 検索中は画像タブを省いた軽量なダッシュボードを使い、集計値が変わったパネルだけを差し替える
+                                    if live_dashboard is None:
+                                        live_dashboard = init_live_dashboard(summary_container, "📊 リアルタイム分析")
+                                    update_live_dashboard(live_dashboard, isp_df, country_df, country_all_df, proxy_df)
                                     
-                                    # empty()による全消去を廃止し、直接上書きさせることで点滅を防ぐ
-                                    with summary_container.container():
-                                        draw_summary_content(isp_df, country_df, freq_df, country_all_df, proxy_df, "📊 リアルタイム分析") 
-                                        
-                                    # 10秒ごとにディスクへセッションをバックアップする
-                                    if current_time_for_ui - last_backup_time > 10.0 or is_last_item:
-                                        save_recovery_data()
-                                        last_backup_time = current_time_for_ui
-
-                            if not remaining and not st.session_state.deferred_ips:
-                                break
-                            
+                                # 10秒ごとにディスクへセッションをバックアップする
+                                if current_time_for_ui - last_backup_time > 10.0 or is_last_item:
+                                    save_recovery_data()
+                                    last_backup_time = current_time_for_ui
+
                             if st.session_state.deferred_ips:
                                 # 強制再起動ではなく、未実行のタスクをキャンセルしてループを安全に脱出する
-                                for f in remaining:
+                                for f in future_to_ip:
                                     f.cancel()
                                 break  
                             
-                            time.sleep(0.5) 
-                            
                         if total_ip_api_targets > 0 and not st.session_state.deferred_ips:
-                            processed_api_ips_count = len([ip for ip in st.session_state.finished_ips if is_valid_ip(ip)])
-                            final_pct = int(processed_api_ips_count / total_ip_api_targets * 100)
+                            processed_api_ips_count = progress['completed']
+                            final_pct = min(100, int(processed_api_ips_count / total_ip_api_targets * 100))
                             with prog_bar_container:
                                 st.progress(final_pct)
                             with status_text_container:
-                                st.success(f"**✅ 処理完了 (100%)** | 完了: {processed_api_ips_count}/{total_ip_api_targets} | 📦 キャッシュ: {len(st.session_state.cidr_cache)}")
+                                saved_display = format_saved_calls(progress)
+                                st.success(f"**✅ 処理完了 (100%)** | 完了: {processed_api_ips_count}/{total_ip_api_targets} | 📦 キャッシュ: {len(st.session_state.cidr_cache)}" + (f" | 💰 節約: {saved_display}" if saved_display else ""))
                         
                 if len(st.session_state.finished_ips) == total_targets and not st.session_state.deferred_ips:
+                    if (st.session_state.get('triage') or {}).get('phase') == 1:
+                        # 1段階目の完了時に、条件に合致したIPのみを2段階目 (詳細解析) として自動で再投入する
+                        deep_targets = select_triage_targets(tor_nodes, cloud_ip_data, triage_signals)
+                        start_deep_phase(deep_targets)
+                        if deep_targets:
+                            st.info(f"🔬 一次判定が完了しました。条件に合致した **{len(deep_targets)}** 件の詳細解析を開始します...")
+                            st.rerun()
                     st.session_state.is_searching = False
                     clear_recovery_data() # 正常完了時はバックアップを消去
                     st.info("✅ 全ての検索が完了しました。")
@@ -5670,24 +7960,31 @@ def main():
                 st.json(st.session_state.get('cidr_cache', {}))
 
         
-        successful_results = [r for r in res if r['Status'].startswith('Success') or r['Status'].startswith('Aggregated')]
-        error_results = [r for r in res if not (r['Status'].startswith('Success') or r['Status'].startswith('Aggregated'))]
+        # 行をdictへ戻さず、列指向ストアから一度だけDataFrameを作ってステータスで振り分ける
+        res_df = res.to_pandas() if len(res) else pd.DataFrame(columns=['Target_IP', 'Status'])
+        res_df = rescore_internetdb_risk(res_df, internetdb_risk_ports)
+        is_success = text_column(res_df, 'Status', '').str.startswith(('Success', 'Aggregated'))
+        successful_df = res_df[is_success]
+        error_df = res_df[~is_success]
         
+        pending_rows = []
         for ip, defer_time in st.session_state.deferred_ips.items():
             status = f"Pending (Retry in {max(0, int(defer_time - time.time()))}s)"
-            error_results.append({
+            pending_rows.append({
                 'Target_IP': ip, 'ISP': 'N/A', 'Country': 'N/A', 'CountryCode': 'N/A', 'RIR_Link': get_authoritative_rir_link(ip, 'N/A'),
                 'Secondary_Security_Links': create_secondary_links(ip), 
                 'Status': status
             })
+        if pending_rows:
+            error_df = pd.concat([error_df, pd.DataFrame(pending_rows)], ignore_index=True)
         
         if "集約" in current_mode_full_text:
-            display_res = group_results_by_isp(successful_results)
-            display_res.extend(error_results)
+            display_res = pd.concat([group_results_by_isp(successful_df), error_df], ignore_index=True)
         else:
-            display_res = successful_results + error_results
+            display_res = pd.concat([successful_df, error_df], ignore_index=True)
             target_order = {ip: i for i, ip in enumerate(targets)}
-            display_res.sort(key=lambda x: target_order.get(get_copy_target(x['Target_IP']), float('inf')))
+            order = text_column(display_res, 'Target_IP', '').map(lambda t: target_order.get(get_copy_target(t), len(target_order)))
+            display_res = display_res.iloc[np.argsort(order.to_numpy(), kind='stable')].reset_index(drop=True)
 
         display_results(display_res, current_mode_full_text, display_mode, use_rdap_option, pro_api_key, vpnapi_key, st_api_key, use_rdns_option, use_st_reverse_ip)
         
@@ -5699,22 +7996,53 @@ def main():
             # --- 全入力順・全件ベースのデータフレーム構築 ---
             df_for_analysis = pd.DataFrame()
             
-            # マッチング精度を高めるための多重キー辞書の構築
+            # 結果ストアを列指向のままDataFrame化し、入力値から結果の行位置を引く多重キー辞書を構築する
+            result_frame = rescore_internetdb_risk(st.session_state.raw_results.to_pandas(), internetdb_risk_ports)
             result_lookup = {}
-            for r in st.session_state.raw_results:
-                target = r.get('Target_IP', '')
+            for pos, target in enumerate(result_frame['Target_IP'].fillna('') if 'Target_IP' in result_frame.columns else []):
                 actual = extract_actual_ip(target)
-                result_lookup[target] = r
+                result_lookup[target] = pos
                 if actual and actual != target:
-                    result_lookup[actual] = r
+                    result_lookup[actual] = pos
 
-            def get_result_info(raw_ip_str):
-                if pd.isna(raw_ip_str): return {}
+            def get_result_pos(raw_ip_str):
+                if pd.isna(raw_ip_str): return -1
                 val = str(raw_ip_str).strip()
                 cleaned = clean_ocr_error_chars(val)
                 actual = extract_actual_ip(cleaned)
                 # 実IP、クリーンIP、生文字列の順で一致する結果を探す
-                return result_lookup.get(actual) or result_lookup.get(cleaned) or result_lookup.get(val) or {}
+                for key in (actual, cleaned, val):
+                    if key in result_lookup:
+                        return result_lookup[key]
+                return -1
+
+            # (出力列名, 結果の列名, 該当なし時の値)
+            analysis_columns = [
+                ('国名', 'Country_JP', 'N/A'),
+                ('Whois結果（元データ）', 'ISP', 'N/A'),
+                ('Whois結果（日本語名称）', 'ISP_JP', 'N/A'),
+                ('RDAP結果（元データ）', 'RDAP_Name_Raw', 'N/A'),
+                ('RDAP結果（日本語名称）', 'RDAP_JP', 'N/A'),
+                ('プロキシ種別', 'Proxy_Type', ''),
+                ('IoTリスク', 'IoT_Risk', 'N/A'),
+                ('逆引き結果', 'RDNS_Hosts', ''),
+                ('Reverse IP', 'ST_Reverse_Hosts', ''),
+                ('ステータス', 'Status', 'N/A'),
+            ]
+
+            def attach_result_columns(df, key_series):
+                """ 入力値の列に対応する結果列を、ユニーク値ごとの照合と列単位の取り出しで付与する """
+                unique_keys = pd.Series(key_series.unique())
+                pos_by_key = pd.Series(unique_keys.map(get_result_pos).to_numpy(), index=unique_keys)
+                positions = key_series.map(pos_by_key).to_numpy(dtype=np.int64)
+                found = positions >= 0
+                for out_col, key, default in analysis_columns:
+                    values = np.full(len(df), default, dtype=object)
+                    if key in result_frame.columns and found.any():
+                        source = result_frame[key].astype(object).to_numpy()[positions[found]]
+                        values[found] = np.where(pd.isna(source), default, source)
+                    df[out_col] = values
+                return df
 
             full_input_list = st.session_state.get('original_input_list', [])
 
@@ -5723,36 +8051,11 @@ def main():
                     # 元のアップロードデータ(CSV/Excel)が存在する場合、その行構造(時間など)を完全維持する
                     df_for_analysis = st.session_state['original_df'].copy()
                     ip_col = st.session_state['ip_column_name']
-                    
-                    df_for_analysis['国名'] = df_for_analysis[ip_col].map(lambda x: get_result_info(x).get('Country_JP', 'N/A'))
-                    df_for_analysis['Whois結果（元データ）'] = df_for_analysis[ip_col].map(lambda x: get_result_info(x).get('ISP', 'N/A'))
-                    df_for_analysis['Whois結果（日本語名称）'] = df_for_analysis[ip_col].map(lambda x: get_result_info(x).get('ISP_JP', 'N/A'))
-                    df_for_analysis['RDAP結果（元データ）'] = df_for_analysis[ip_col].map(lambda x: get_result_info(x).get('RDAP_Name_Raw', 'N/A'))
-                    df_for_analysis['RDAP結果（日本語名称）'] = df_for_analysis[ip_col].map(lambda x: get_result_info(x).get('RDAP_JP', 'N/A'))
-                    df_for_analysis['プロキシ種別'] = df_for_analysis[ip_col].map(lambda x: get_result_info(x).get('Proxy_Type', ''))
-                    df_for_analysis['IoTリスク'] = df_for_analysis[ip_col].map(lambda x: get_result_info(x).get('IoT_Risk', 'N/A'))
-                    df_for_analysis['逆引き結果'] = df_for_analysis[ip_col].map(lambda x: get_result_info(x).get('RDNS_Hosts', ''))
-                    df_for_analysis['Reverse IP'] = df_for_analysis[ip_col].map(lambda x: get_result_info(x).get('ST_Reverse_Hosts', ''))
-                    df_for_analysis['ステータス'] = df_for_analysis[ip_col].map(lambda x: get_result_info(x).get('Status', 'N/A'))
+                    df_for_analysis = attach_result_columns(df_for_analysis, df_for_analysis[ip_col])
                 else:
                     # テキスト貼り付けの場合
-                    temp_rows = []
-                    for t in full_input_list:
-                        info = get_result_info(t)
-                        temp_rows.append({
-                            '対象IP/Domain': t,
-                            '国名': info.get('Country_JP', 'N/A'),
-                            'Whois結果（元データ）': info.get('ISP', 'N/A'),
-                            'Whois結果（日本語名称）': info.get('ISP_JP', 'N/A'),
-                            'RDAP結果（元データ）': info.get('RDAP_Name_Raw', 'N/A'),
-                            'RDAP結果（日本語名称）': info.get('RDAP_JP', 'N/A'),
-                            'プロキシ種別': info.get('Proxy_Type', ''),
-                            'IoTリスク': info.get('IoT_Risk', 'N/A'),
-                            '逆引き結果': info.get('RDNS_Hosts', ''),
-                            'Reverse IP': info.get('ST_Reverse_Hosts', ''),
-                            'ステータス': info.get('Status', 'N/A')
-                        })
-                    df_for_analysis = pd.DataFrame(temp_rows)
+                    df_for_analysis = pd.DataFrame({'対象IP/Domain': full_input_list})
+                    df_for_analysis = attach_result_columns(df_for_analysis, df_for_analysis['対象IP/Domain'])
 
             # マスターデータ（Excel/全件CSV用）から無効オプション列を削除
             if not df_for_analysis.empty:
@@ -5845,7 +8148,7 @@ def main():
                 
                 with sub_tab1:
                     c1, c2 = st.columns(2)
-                    csv_display = pd.DataFrame(display_res).astype(str)
+                    csv_display = display_res.astype(str)
                     rename_map = {
                         'Target_IP': 'IPアドレス',
                         'Country_JP': '国名', 
@@ -5901,7 +8204,7 @@ def main():
                 with sub_tab3:
                     st.info("**STIX (Structured Threat Information Expression) 2.1 形式**\n\n調査結果を、世界標準の脅威インテリジェンス・フォーマット (JSON形式) で出力します。SIEMへのIoC（侵害指標）の取り込みや、MISPへのインポートにそのまま使用できます。")
                     
-                    stix_data = generate_stix2_bundle(display_res)
+                    stix_data = generate_stix2_bundle(frame_rows_to_dicts(display_res))
                     stix_filename = f"{file_prefix}_STIX.json"
                     
                     if IS_PUBLIC_MODE:
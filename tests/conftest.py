@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# WhoisApp.py は単一ファイルのアプリのため、リポジトリ直下をパスに追加してモジュールとして読み込む
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """ キャッシュ・ジャーナル等の相対パスで書き出すファイルを一時ディレクトリに閉じ込める """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,44 @@
+import os
+
+import WhoisApp as app
+
+
+PAYLOAD = {'RDAP_JSON': {'name': 'EXAMPLE-NET', 'handle': 'X'}, 'IP_WHOIS_TEXT': 'inetnum: 192.0.2.0 - 192.0.2.255'}
+
+
+def test_memory_store_round_trip_and_dedup():
+    store = app.DetailStore()
+    store['192.0.2.1'] = PAYLOAD
+    store['192.0.2.2'] = {'RDAP_JSON': dict(PAYLOAD['RDAP_JSON'])}
+    assert store['192.0.2.1'] == PAYLOAD
+    assert store.get('192.0.2.3', 'none') == 'none'
+    assert store.get_field('192.0.2.1', 'IP_WHOIS_TEXT') == PAYLOAD['IP_WHOIS_TEXT']
+    assert store.get_field('192.0.2.2', 'IP_WHOIS_TEXT', '') == ''
+    # 同一内容のブロブは1つだけ保持する
+    assert store.refs['192.0.2.1']['RDAP_JSON'] == store.refs['192.0.2.2']['RDAP_JSON']
+    assert len(store._blobs) == 2 and len(store) == 2 and '192.0.2.2' in store
+
+
+def test_disk_store_restores_from_state(workdir):
+    store = app.DetailStore(os.path.join(app.DETAIL_BLOB_ROOT, 'a' * 32))
+    store['192.0.2.1'] = PAYLOAD
+    restored = app.DetailStore.from_state(store.to_state())
+    assert restored['192.0.2.1'] == PAYLOAD
+    store.clear()
+    assert not os.path.exists(store.directory) and len(store) == 0
+
+
+def test_sweep_removes_only_stale_unreferenced_directories(workdir):
+    stale, referenced, fresh = (os.path.join(app.DETAIL_BLOB_ROOT, c * 32) for c in 'abc')
+    for directory in (stale, referenced, fresh):
+        app.DetailStore(directory)['192.0.2.1'] = PAYLOAD
+    # 中断時のジャーナルが参照しているディレクトリは古くても残す
+    with open(app.BACKUP_JOURNAL_FILE, 'w', encoding='utf-8') as f:
+        f.write('{"type": "static", "detail_directory": "%s"}\n' % referenced)
+    for directory in (stale, referenced):
+        for root, _, files in os.walk(directory):
+            for path in [root] + [os.path.join(root, name) for name in files]:
+                os.utime(path, (0, 0))
+    assert app.remove_stale_detail_directories() == 1
+    assert not os.path.exists(stale)
+    assert os.path.exists(referenced) and os.path.exists(fresh)
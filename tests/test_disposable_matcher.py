@@ -0,0 +1,32 @@
+import WhoisApp as app
+
+
+def service_names(matcher, target):
+    # MX辞書とドメイン辞書の両方に載っているサービスは2件のIDで返るため、名前の集合で比べる
+    return {matcher.services[i][1] for i in matcher.match_services(target)}
+
+
+def test_known_services_match_inside_hostnames():
+    matcher = app.DisposableMatcher([])
+    assert service_names(matcher, 'mx1.mailinator.com') == {'Mailinator'}
+    assert '捨てメアド (メルアドぽいぽい)' in service_names(matcher, 'instaddr.jp')
+    assert service_names(matcher, 'example.com') == set()
+
+
+def test_overlapping_patterns_are_all_reported():
+    matcher = app.DisposableMatcher([])
+    # 'm.miril.jp' と、その一部に重なる短いパターンも取りこぼさない
+    ids = matcher.match_services('m.miril.jp')
+    patterns = {matcher.services[i][0] for i in ids}
+    assert 'm.miril.jp' in patterns
+    assert ids == sorted(ids)
+
+
+def test_blocklist_suffix_tree_returns_longest_registered_suffix():
+    matcher = app.DisposableMatcher(['trash.example', 'mail.temp.example', 'temp.example', 'tld'])
+    assert matcher.find_blocklisted_suffix('a.b.trash.example') == 'trash.example'
+    assert matcher.find_blocklisted_suffix('x.mail.temp.example') == 'mail.temp.example'
+    assert matcher.find_blocklisted_suffix('other.temp.example') == 'temp.example'
+    # 1ラベルだけの一致 (TLD) は採用しない
+    assert matcher.find_blocklisted_suffix('foo.tld') is None
+    assert matcher.find_blocklisted_suffix('safe.example') is None
@@ -0,0 +1,29 @@
+import pytest
+
+import WhoisApp as app
+
+
+@pytest.mark.parametrize('isp, expected', [
+    ('Hetzner Online GmbH', True),
+    ('Private Servers Ltd', True),
+    ('Colocation America Corporation', True),
+    ('Sakura VPS', True),
+    ('Colombia Movil', False),
+    ('Observer Networks', False),
+    ('KDDI CORPORATION', False),
+])
+def test_hosting_pattern_matches_whole_words(isp, expected):
+    assert bool(app.HOSTING_ISP_PATTERN.search(isp)) is expected
+
+
+def test_unknown_country_is_not_foreign():
+    signals = lambda result: app.collect_cheap_signals('192.0.2.1', dict(result, ISP_API_Raw='KDDI CORPORATION'), set(), None)
+    assert signals({'CountryCode': 'JP'}) == set()
+    assert signals({'CountryCode': 'US'}) == {'foreign'}
+    assert signals({'CountryCode': 'N/A'}) == set()
+    assert signals({}) == set()
+
+
+def test_policy_gates_stages_on_signals():
+    assert app.collect_cheap_signals('192.0.2.1', {'CountryCode': 'JP'}, {'192.0.2.1'}, 'AWS') == {'tor', 'cloud', 'unknown_isp'}
+    assert app.is_stage_permitted(None, 'vpnapi', set())
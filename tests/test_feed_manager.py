@@ -0,0 +1,104 @@
+import time
+
+import pytest
+import requests
+
+import WhoisApp as app
+
+URL = 'https://feeds.example/list.txt'
+INTERVAL = 3600
+
+
+class FakeResponse:
+    def __init__(self, status_code, text='', headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(response=self)
+
+
+class FakeFeedServer:
+    """ 応答を順番に返し、受け取った条件付きGETのヘッダーを記録する """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append(headers or {})
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def parse_lines(fetch):
+    body = fetch(URL)
+    return None if body is None else body.split()
+
+
+@pytest.fixture
+def server(monkeypatch):
+    def install(*responses):
+        fake = FakeFeedServer(*responses)
+        monkeypatch.setattr(app.session, 'get', fake.get)
+        return fake
+    return install
+
+
+def test_first_get_fetches_and_fresh_snapshot_is_reused(server):
+    fake = server(FakeResponse(200, 'a b', {'ETag': '"v1"'}))
+    manager = app.FeedManager({'list': (parse_lines, INTERVAL)})
+    assert manager.get('list') == ['a', 'b']
+    assert manager.get('list') == ['a', 'b']
+    assert len(fake.requests) == 1 and manager.version('list') == 0
+
+
+def test_not_modified_keeps_parsed_data_and_version(server):
+    fake = server(FakeResponse(200, 'a b', {'ETag': '"v1"'}), FakeResponse(304))
+    manager = app.FeedManager({'list': (parse_lines, INTERVAL)})
+    manager.get('list')
+    manager._refresh('list')
+    assert fake.requests[1] == {'If-None-Match': '"v1"'}
+    assert manager.get('list') == ['a', 'b'] and manager.version('list') == 0
+
+
+def test_changed_body_replaces_snapshot(server):
+    server(FakeResponse(200, 'a b', {'ETag': '"v1"'}), FakeResponse(200, 'c', {'ETag': '"v2"'}))
+    manager = app.FeedManager({'list': (parse_lines, INTERVAL)})
+    manager.get('list')
+    manager._refresh('list')
+    assert manager.get('list') == ['c'] and manager.version('list') == 1
+
+
+def test_failed_refresh_keeps_last_data_and_retries_soon(server):
+    server(FakeResponse(200, 'a b'), requests.exceptions.ConnectionError('offline'))
+    manager = app.FeedManager({'list': (parse_lines, INTERVAL)})
+    manager.get('list')
+    before = time.time()
+    manager._refresh('list')
+    snapshot = manager._snapshot('list')
+    assert snapshot['data'] == ['a', 'b'] and snapshot['version'] == 0
+    # 失敗した更新は最新として扱わず、再検証間隔ではなく FEED_RETRY_INTERVAL 後に再試行させる
+    expected = before - INTERVAL + app.FEED_RETRY_INTERVAL
+    assert expected - 1 <= snapshot['fetched_at'] <= time.time() - INTERVAL + app.FEED_RETRY_INTERVAL
+
+
+def test_first_fetch_failure_is_retried_soon(server):
+    server(requests.exceptions.ConnectionError('offline'))
+    manager = app.FeedManager({'list': (parse_lines, INTERVAL)})
+    assert manager.get('list') is None
+    assert time.time() - manager._snapshot('list')['fetched_at'] < INTERVAL
+
+
+def test_saved_feed_is_served_from_disk_after_restart(server, workdir):
+    fake = server(FakeResponse(200, 'a b', {'ETag': '"v1"'}), FakeResponse(304))
+    app.FeedManager({'list': (parse_lines, INTERVAL)}, 'feeds').get('list')
+    restarted = app.FeedManager({'list': (parse_lines, INTERVAL)}, 'feeds')
+    assert restarted.get('list') == ['a', 'b']
+    assert len(fake.requests) == 1
+    restarted._refresh('list')
+    assert fake.requests[1] == {'If-None-Match': '"v1"'}
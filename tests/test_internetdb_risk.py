@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+
+import WhoisApp as app
+
+
+@pytest.fixture
+def internetdb_cache(monkeypatch):
+    cache = app.PersistentTTLCache(None, app.INTERNETDB_CACHE_TTL)
+    monkeypatch.setattr(app, 'get_internetdb_cache', lambda: cache)
+    return cache
+
+
+def test_score_with_default_policy():
+    record = {'found': True, 'ports': [23, 80, 8080], 'vulns': ['CVE-2024-0001']}
+    assert app.score_internetdb_risk(record) == 'CVEs(1) / Proxy:HTTP / Vuln:Telnet (High Risk)'
+    assert app.score_internetdb_risk({'found': True, 'ports': [443], 'vulns': []}) == '[No Match (Other Ports)]'
+    assert app.score_internetdb_risk({'found': True, 'ports': [], 'vulns': []}) == '[No Match]'
+    assert app.score_internetdb_risk({'found': False, 'ports': [], 'vulns': []}) == '[データなし]'
+    # 取得失敗時のエラー文字列はそのまま返す
+    assert app.score_internetdb_risk('エラー: Shodanのアクセス制限超過') == 'エラー: Shodanのアクセス制限超過'
+
+
+def test_score_with_custom_policy():
+    record = {'found': True, 'ports': [23, 80], 'vulns': []}
+    assert app.score_internetdb_risk(record, {80: 'Web:HTTP'}) == 'Web:HTTP'
+    assert app.score_internetdb_risk(record, {}) == '[No Match (Other Ports)]'
+
+
+def test_rescore_uses_cached_records_and_skips_unscored_rows(internetdb_cache):
+    internetdb_cache.put('192.0.2.1', {'found': True, 'ports': [23, 80], 'vulns': []})
+    internetdb_cache.put('192.0.2.5', {'found': True, 'ports': [21], 'vulns': []})
+    frame = pd.DataFrame({
+        'Target_IP': ['192.0.2.1', '192.0.2.0/29 (192.0.2.5)', '192.0.2.0/29', '198.51.100.1'],
+        'IoT_Risk': pd.Categorical(['Vuln:Telnet (High Risk)', 'Vuln:FTP', '[Range] 8件に展開', '[Not Checked]']),
+    })
+    rescored = app.rescore_internetdb_risk(frame, {80: 'Web:HTTP'})
+    assert rescored['IoT_Risk'].tolist() == ['Web:HTTP', '[No Match (Other Ports)]', '[Range] 8件に展開', '[Not Checked]']
+    # 既定の方針のままなら採点し直さない
+    assert app.rescore_internetdb_risk(frame, app.INTERNETDB_RISK_PORTS) is frame
+
+
+def test_check_internetdb_risk_does_not_refetch_cached_ip(internetdb_cache, monkeypatch):
+    internetdb_cache.put('192.0.2.1', {'found': True, 'ports': [5555], 'vulns': []})
+    monkeypatch.setattr(app, 'fetch_internetdb_record', lambda *args: pytest.fail('cached IP was refetched'))
+    assert app.check_internetdb_risk('192.0.2.1') == 'IoT:Android/ADB (High Risk)'
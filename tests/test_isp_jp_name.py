@@ -0,0 +1,20 @@
+import WhoisApp as app
+
+
+def test_exact_and_normalized_matches():
+    assert app.lookup_isp_jp_name('NTT Communications Corporation') == 'NTTドコモビジネス株式会社'
+    # 大文字小文字・カンマ・ピリオドの違いは正規化して一致させる
+    assert app.lookup_isp_jp_name('ntt docomo inc') == '株式会社NTTドコモ'
+
+
+def test_remap_rules_use_word_boundaries_and_rule_order():
+    assert app.lookup_isp_jp_name('KDDI Web Communications') == 'KDDI株式会社'
+    # edion の中の dion には一致しない
+    assert app.lookup_isp_jp_name('EDION Corporation') == 'EDION Corporation'
+    # 複数のキーワードに一致する場合はルールの定義順で先のものを採用する
+    assert app.lookup_isp_jp_name('OCN by KDDI') == 'KDDI株式会社'
+
+
+def test_unknown_isp_is_returned_unchanged():
+    assert app.lookup_isp_jp_name('Example Transit LLC') == 'Example Transit LLC'
+    assert app.get_jp_names('', 'JP') == ('N/A', app.COUNTRY_JP_NAME.get('JP', 'JP'))
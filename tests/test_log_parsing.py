@@ -0,0 +1,81 @@
+import gzip
+import io
+import json
+
+import pandas as pd
+
+import WhoisApp as app
+
+
+def parse(text, parser_key=None):
+    return app.parse_log_stream(io.BytesIO(text.encode('utf-8')), parser_key)
+
+
+def test_access_log_is_detected_and_converted_to_jst():
+    log = (
+        '203.0.113.7 - - [10/Oct/2024:13:55:36 +0000] "GET /index.html HTTP/1.1" 200 2326 "-" "curl/8.0"\n'
+        '2001:db8::5 - - [10/Oct/2024:22:55:36 +0900] "POST /login HTTP/1.1" 403 12 "-" "Mozilla/5.0"\n'
+    )
+    df, key = parse(log)
+    assert key == 'access'
+    assert df[app.LOG_IP_COLUMN].tolist() == ['203.0.113.7', '2001:db8::5']
+    assert df['Method'].tolist() == ['GET', 'POST']
+    assert df['Status'].tolist() == ['200', '403']
+    assert df[app.LOG_TIME_COLUMN].tolist() == [pd.Timestamp('2024-10-10 22:55:36')] * 2
+
+
+def test_syslog_extracts_first_ip_from_message():
+    log = (
+        'Oct  3 12:34:56 web01 sshd[123]: Failed password for root from 198.51.100.23 port 22 ssh2\n'
+        'Oct  3 12:35:00 web01 sshd[123]: Accepted publickey for deploy from 192.0.2.10 port 50000\n'
+        'Oct  3 12:35:01 web01 cron[9]: session opened for user root\n'
+    )
+    df, key = parse(log)
+    assert key == 'syslog'
+    assert df[app.LOG_IP_COLUMN].tolist() == ['198.51.100.23', '192.0.2.10']
+    assert df['Program'].tolist() == ['sshd', 'sshd']
+
+
+def test_jsonl_reads_nested_client_ip():
+    lines = [
+        {'@timestamp': '2024-10-10T00:00:00Z', 'client': {'ip': '192.0.2.1'}, 'url': '/a', 'status': 200},
+        {'timestamp': '2024-10-10T09:00:00', 'remote_addr': '192.0.2.2', 'path': '/b'},
+    ]
+    df, key = parse("\n".join(json.dumps(l) for l in lines) + "\n")
+    assert key == 'jsonl'
+    assert df[app.LOG_IP_COLUMN].tolist() == ['192.0.2.1', '192.0.2.2']
+    # オフセットなしの日時は現地時刻 (JST) として扱い、UTCの日時とは同じ時刻に揃う
+    assert df[app.LOG_TIME_COLUMN].tolist() == [pd.Timestamp('2024-10-10 09:00:00')] * 2
+
+
+def test_gzip_source_and_plain_list_is_not_a_log():
+    compressed = gzip.compress(b'203.0.113.7 - - [10/Oct/2024:13:55:36 +0000] "GET / HTTP/1.1" 200 1\n')
+    df, key = app.parse_log_stream(app.open_log_source('access.log.gz', io.BytesIO(compressed)))
+    assert key == 'access' and len(df) == 1
+    assert parse("8.8.8.8\n1.1.1.1\nexample.com\n") == (None, None)
+
+
+def test_rfc3164_future_dates_roll_back_a_year():
+    now = pd.Timestamp('2025-01-02 10:00:00')
+    parsed = app.normalize_log_timestamps(['Dec 31 23:59:59', 'Jan  2 09:00:00'], None, now=now)
+    assert parsed.tolist() == [pd.Timestamp('2024-12-31 23:59:59'), pd.Timestamp('2025-01-02 09:00:00')]
+
+
+def test_numeric_epoch_seconds_and_milliseconds():
+    parsed = app.normalize_log_timestamps([1700000000, 1700000000.5, 1700000000123], None)
+    assert parsed.tolist() == [
+        pd.Timestamp('2023-11-15 07:13:20'), pd.Timestamp('2023-11-15 07:13:20.500'), pd.Timestamp('2023-11-15 07:13:20.123'),
+    ]
+
+
+def test_jsonl_with_epoch_and_iso_timestamps_mixed():
+    lines = [
+        {'ts': 1700000000, 'ip': '192.0.2.1'},
+        {'timestamp': '2023-11-14T22:13:20Z', 'ip': '192.0.2.2'},
+        {'ip': '192.0.2.3'},
+    ]
+    df, key = parse("\n".join(json.dumps(l) for l in lines) + "\n")
+    assert key == 'jsonl'
+    times = df[app.LOG_TIME_COLUMN]
+    assert times.iloc[:2].tolist() == [pd.Timestamp('2023-11-15 07:13:20')] * 2
+    assert pd.isna(times.iloc[2])
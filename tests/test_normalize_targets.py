@@ -0,0 +1,35 @@
+import WhoisApp as app
+
+
+def test_empty_input_returns_typed_empty_table():
+    table, invalid = app.normalize_targets([])
+    assert table.empty and invalid == []
+    assert list(table['kind'].cat.categories) == ['ipv4', 'ipv6', 'range', 'domain']
+
+
+def test_classifies_and_deduplicates_in_input_order():
+    table, invalid = app.normalize_targets(['8.8.8.8', 'example.com', '2001:db8::1', '8.8.8.8', 'not a target'])
+    assert table['target'].tolist() == ['8.8.8.8', 'example.com', '2001:db8::1']
+    assert table['kind'].tolist() == ['ipv4', 'domain', 'ipv6']
+    assert table.loc[0, 'v4_int'] == 0x08080808
+    assert invalid == ['not a target']
+
+
+def test_ocr_characters_are_corrected_only_for_ips():
+    table, _ = app.normalize_targets(['l92.168.O.l', 'mailinator.com'])
+    assert table['target'].tolist() == ['192.168.0.1', 'mailinator.com']
+    assert table['kind'].tolist() == ['ipv4', 'domain']
+
+
+def test_ranges_are_kept_as_one_normalized_target():
+    table, _ = app.normalize_targets(['192.0.2.5/24', '198.51.100.0-198.51.100.255', '198.51.100.10-198.51.100.12'])
+    assert table['target'].tolist() == ['192.0.2.0/24', '198.51.100.0/24', '198.51.100.10-198.51.100.12']
+    assert set(table['kind']) == {'range'}
+    # 開始IPが整数列に入る
+    assert table.loc[0, 'v4_int'] == int(app.ipaddress.IPv4Address('192.0.2.0'))
+
+
+def test_composite_domain_ip_target():
+    table, _ = app.normalize_targets(['example.com (93.184.216.34)'])
+    assert table.loc[0, 'kind'] == 'ipv4'
+    assert bool(table.loc[0, 'composite'])
@@ -0,0 +1,61 @@
+import json
+import time
+
+import WhoisApp as app
+
+
+def test_memory_cache_expires_entries(monkeypatch):
+    cache = app.PersistentTTLCache(None, ttl=60)
+    assert cache.put('k', {'v': 1}) == {'v': 1}
+    assert cache.get('k') == {'v': 1} and 'k' in cache
+    later = time.time() + 61
+    monkeypatch.setattr(app.time, 'time', lambda: later)
+    assert cache.get('k') is None and 'k' not in cache
+
+
+def test_file_cache_survives_reload_and_skips_torn_lines(workdir):
+    cache = app.PersistentTTLCache('cache.jsonl', ttl=60)
+    cache.put('a', [1])
+    cache.put('a', [2])
+    with open('cache.jsonl', 'a', encoding='utf-8') as f:
+        f.write('{"key": "b", "fetch')
+    reloaded = app.PersistentTTLCache('cache.jsonl', ttl=60)
+    assert reloaded.get('a') == [2] and reloaded.get('b') is None
+
+
+def test_expired_and_superseded_lines_are_compacted(workdir):
+    now = time.time()
+    with open('cache.jsonl', 'w', encoding='utf-8') as f:
+        for i in range(5):
+            f.write(json.dumps({'key': 'old', 'fetched_at': now - 3600, 'value': i}) + '\n')
+        f.write(json.dumps({'key': 'new', 'fetched_at': now, 'value': 'x'}) + '\n')
+    cache = app.PersistentTTLCache('cache.jsonl', ttl=60)
+    assert cache.get('new') == 'x' and cache.get('old') is None
+    with open('cache.jsonl', encoding='utf-8') as f:
+        assert [json.loads(line)['key'] for line in f] == ['new']
+
+
+def test_legacy_internetdb_lines_are_migrated(workdir):
+    with open('idb.jsonl', 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'ip': '192.0.2.1', 'fetched_at': time.time(), 'found': True, 'ports': [23], 'vulns': []}) + '\n')
+        f.write(json.dumps({'unexpected': True}) + '\n')
+    cache = app.PersistentTTLCache('idb.jsonl', 60, app.migrate_internetdb_cache_entry)
+    assert cache.get('192.0.2.1') == {'found': True, 'ports': [23], 'vulns': []}
+    with open('idb.jsonl', encoding='utf-8') as f:
+        assert [json.loads(line)['key'] for line in f] == ['192.0.2.1']
+
+
+def test_securitytrails_ledger_persists_usage_without_plain_keys(workdir, monkeypatch):
+    ledger = app.SecurityTrailsLedger('ledger.json')
+    ledger.record_call('secret-key')
+    ledger.record_call('secret-key', 2)
+    ledger.mark_exhausted('secret-key')
+    reloaded = app.SecurityTrailsLedger('ledger.json')
+    assert reloaded.calls_this_month('secret-key') == 3 and reloaded.calls_this_month('other') == 0
+    assert reloaded.is_exhausted('secret-key')
+    with open('ledger.json', encoding='utf-8') as f:
+        assert 'secret-key' not in f.read()
+    # 再確認の間隔を過ぎたら再びAPIへ問い合わせる
+    later = time.time() + app.SECURITYTRAILS_EXHAUSTED_RECHECK + 1
+    monkeypatch.setattr(app.time, 'time', lambda: later)
+    assert not reloaded.is_exhausted('secret-key')
@@ -0,0 +1,29 @@
+import WhoisApp as app
+
+
+def test_range_target_is_not_an_ip():
+    parsed = app.parse_target('192.0.2.0/29')
+    assert parsed.is_range and not parsed.is_ip and not parsed.is_composite
+    assert parsed.ip == '192.0.2.0' and parsed.range_size == 8
+
+
+def test_range_member_key_is_its_own_kind():
+    key = app.range_member_key('192.0.2.0/29', '192.0.2.5')
+    parsed = app.parse_target(key)
+    assert parsed.is_range_member and parsed.range_parent == '192.0.2.0/29'
+    assert parsed.is_ip and parsed.ip == '192.0.2.5'
+    # ドメイン複合型 ('ドメイン (IP)') の処理には渡らない
+    assert not parsed.is_composite and parsed.domain is None
+    composite = app.parse_target('example.com (192.0.2.5)')
+    assert composite.is_composite and composite.domain == 'example.com' and not composite.is_range_member
+
+
+def test_member_links_are_ip_links():
+    links = app.create_secondary_links(app.range_member_key('192.0.2.0/29', '192.0.2.5'))
+    assert 'ipinfo.io/192.0.2.5' in links and 'IP2Proxy' in links
+    assert 'Aguse (Domain)' not in links and '192.0.2.0%2F29' not in links
+
+
+def test_iter_range_members_respects_limit():
+    assert list(app.iter_range_members('192.0.2.0/30')) == ['192.0.2.0', '192.0.2.1', '192.0.2.2', '192.0.2.3']
+    assert list(app.iter_range_members('192.0.2.0/24', limit=2)) == ['192.0.2.0', '192.0.2.1']
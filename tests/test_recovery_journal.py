@@ -0,0 +1,64 @@
+import json
+
+import WhoisApp as app
+
+
+def write_journal(records, torn_tail=False):
+    with open(app.BACKUP_JOURNAL_FILE, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        if torn_tail:
+            f.write('{"type": "results", "rows": [')
+
+
+SNAPSHOT = {
+    'type': 'snapshot',
+    'raw_results': [{'Target_IP': '192.0.2.1', 'Status': 'Success'}],
+    'detail_refs': {'directory': None, 'refs': {'192.0.2.1': {'RDAP_JSON': 'aa'}}},
+    'targets_cache': ['192.0.2.1', '192.0.2.2'],
+    'deferred_ips': {},
+    'finished_ips': ['192.0.2.1'],
+    'target_freq_map': {'192.0.2.1': 1, '192.0.2.2': 1},
+    'cidr_cache': {'192.0.2.0/24': {'ISP': 'A'}},
+    'learned_proxy_isps': {},
+    'resolved_dns_map': {},
+    'triage': None,
+}
+
+
+def test_replays_appended_records_over_snapshot(workdir):
+    write_journal([
+        SNAPSHOT,
+        {'type': 'results', 'rows': [{'Target_IP': '192.0.2.2', 'Status': 'Success'}], 'refs': {'192.0.2.2': {'RDAP_JSON': 'bb'}}},
+        {'type': 'finished', 'targets': ['192.0.2.2']},
+        {'type': 'cache', 'entries': {'198.51.100.0/24': {'ISP': 'B'}}},
+        {'type': 'state', 'deferred_ips': {'203.0.113.9': 1.0}, 'learned_proxy_isps': {'X': 'VPN'}, 'triage': {'phase': 2, 'targets': ['192.0.2.2']}},
+    ])
+    state, records = app.replay_recovery_journal()
+    assert records == 5
+    assert [r['Target_IP'] for r in state['raw_results']] == ['192.0.2.1', '192.0.2.2']
+    assert state['finished_ips'] == {'192.0.2.1', '192.0.2.2'}
+    assert set(state['cidr_cache']) == {'192.0.2.0/24', '198.51.100.0/24'}
+    assert state['detail_refs']['refs'] == {'192.0.2.1': {'RDAP_JSON': 'aa'}, '192.0.2.2': {'RDAP_JSON': 'bb'}}
+    assert state['deferred_ips'] == {'203.0.113.9': 1.0}
+    assert state['triage'] == {'phase': 2, 'targets': ['192.0.2.2']}
+
+
+def test_static_record_replaces_inputs_and_detail_directory(workdir):
+    write_journal([
+        SNAPSHOT,
+        {'type': 'static', 'targets_cache': ['203.0.113.1'], 'target_freq_map': {'203.0.113.1': 3}, 'resolved_dns_map': {}, 'detail_directory': 'whois_detail_blobs/' + 'f' * 32},
+    ])
+    state, _ = app.replay_recovery_journal()
+    assert state['targets_cache'] == ['203.0.113.1']
+    assert state['detail_refs']['directory'] == 'whois_detail_blobs/' + 'f' * 32
+    # 既存の参照は残る
+    assert '192.0.2.1' in state['detail_refs']['refs']
+
+
+def test_torn_tail_is_skipped_and_forces_a_rewrite(workdir):
+    write_journal([SNAPSHOT], torn_tail=True)
+    state, records = app.replay_recovery_journal()
+    assert len(state['raw_results']) == 1
+    # 途切れた行があった場合は次回のチェックポイントでスナップショットから書き直させる
+    assert records == 0
@@ -0,0 +1,47 @@
+import pytest
+
+import WhoisApp as app
+
+
+@pytest.fixture
+def rows(monkeypatch):
+    # 小さいチャンクで確定済みチャンクと未確定バッファの両方を通す
+    monkeypatch.setattr(app, 'RESULT_STORE_CHUNK_ROWS', 3)
+    return [
+        {'Target_IP': f'192.0.2.{i}', 'Status': 'Success (ip-api)', 'ISP': 'KDDI' if i % 2 else 'OCN', 'Score': i}
+        for i in range(7)
+    ] + [{'Target_IP': '192.0.2.99', 'Status': 'Error', 'Meta': {'retry': 1}}]
+
+
+def test_behaves_like_a_list(rows):
+    store = app.ResultStore(rows)
+    assert len(store) == 8 and bool(store)
+    assert list(store) == rows
+    assert store[0] == rows[0] and store[-1] == rows[-1]
+    assert store[2:5] == rows[2:5]
+    assert store[::2] == rows[::2]
+    with pytest.raises(IndexError):
+        store[8]
+
+
+def test_missing_keys_stay_missing(rows):
+    store = app.ResultStore(rows)
+    assert 'Meta' not in store[0]
+    assert 'ISP' not in store[7]
+
+
+def test_to_pandas_column_types(rows):
+    frame = app.ResultStore(rows).to_pandas()
+    assert frame['Target_IP'].tolist() == [r['Target_IP'] for r in rows]
+    # 辞書エンコード対象の列はカテゴリ型、型が混在する列は object 型になる
+    assert frame['ISP'].dtype == 'category'
+    assert frame['ISP'].iloc[:2].tolist() == ['OCN', 'KDDI'] and frame['ISP'].isna().iloc[7]
+    assert frame['Meta'].dtype == object and frame['Meta'].iloc[7] == {'retry': 1}
+    assert frame['Score'].iloc[6] == 6
+
+
+def test_to_pandas_selected_columns_and_clear(rows):
+    store = app.ResultStore(rows)
+    assert list(store.to_pandas(columns=['Target_IP', 'Status']).columns) == ['Target_IP', 'Status']
+    store.clear()
+    assert len(store) == 0 and list(store) == []
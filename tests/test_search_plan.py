@@ -0,0 +1,43 @@
+import time
+
+import pytest
+import streamlit as st
+
+import WhoisApp as app
+
+
+@pytest.fixture
+def session(monkeypatch):
+    st.session_state['finished_ips'] = set()
+    st.session_state['cidr_cache'] = {'192.0.2.0/24': {'ISP': 'cached', 'Timestamp': time.time()}}
+    st.session_state['resolved_dns_map'] = {}
+    monkeypatch.setattr(app, 'get_internetdb_cache', lambda: app.PersistentTTLCache(None))
+    yield st.session_state
+    for key in ('finished_ips', 'cidr_cache', 'resolved_dns_map'):
+        st.session_state.pop(key, None)
+
+
+def plan(ip_targets, range_targets=(), **options):
+    args = dict(max_workers=5, delay=0.5, use_rdap=False, use_internetdb=False, use_rdns=False, use_st_reverse_ip=False,
+                api_key='token', vpnapi_key='', st_api_key='')
+    args.update(options)
+    return app.plan_search_run(list(ip_targets), list(range_targets), [], **args)
+
+
+def test_ipinfo_counts_lookups_including_cidr_cache_hits(session):
+    targets = [f'198.51.100.{i}' for i in range(1, 1201)] + ['192.0.2.1', '192.0.2.2']
+    result = plan(targets, ['203.0.113.0/28'])
+    # 1200件 + キャッシュ該当の2件 + レンジの代表IP1件がBulk APIへ送られる
+    assert result['calls']['IPinfo'] == 1203
+    assert result['cache_hits'] == 2
+
+
+def test_ipinfo_lookups_double_as_upper_bound_with_triage(session):
+    result = plan(['198.51.100.1', '198.51.100.2'], use_triage=True)
+    assert result['calls']['IPinfo'] == 4 and result['is_upper_bound']
+    assert result['deep_seconds_upper'] is not None
+
+
+def test_without_ipinfo_key_uses_ip_api_requests(session):
+    result = plan(['198.51.100.1', '192.0.2.1'], api_key='')
+    assert 'IPinfo' not in result['calls'] and result['calls']['ip-api'] == 1
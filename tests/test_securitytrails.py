@@ -0,0 +1,120 @@
+import pytest
+import requests
+
+import WhoisApp as app
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self._payload = payload or {}
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(response=self)
+
+
+@pytest.fixture
+def securitytrails(monkeypatch):
+    """ 台帳・キャッシュ・送信間隔をテスト専用のメモリ上のものに差し替える """
+    ledger = app.SecurityTrailsLedger()
+    cache = app.PersistentTTLCache(None, app.SECURITYTRAILS_CACHE_TTL)
+    monkeypatch.setattr(app, 'get_securitytrails_ledger', lambda: ledger)
+    monkeypatch.setattr(app, 'get_securitytrails_cache', lambda: cache)
+    monkeypatch.setattr(app, 'get_securitytrails_limiter', lambda key_id, rate: app.RateLimiter(1000))
+    return ledger
+
+
+def test_rate_limiter_spaces_calls_evenly(monkeypatch):
+    clock = [100.0]
+    sleeps = []
+    monkeypatch.setattr(app.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(app.time, 'sleep', sleeps.append)
+    limiter = app.RateLimiter(app.SECURITYTRAILS_MAX_RPS)
+    for _ in range(3):
+        limiter.acquire()
+    assert sleeps == pytest.approx([1.0, 2.0])
+    limiter = app.RateLimiter(app.SECURITYTRAILS_FAST_RPS)
+    clock[0] = 200.0
+    sleeps.clear()
+    for _ in range(3):
+        limiter.acquire()
+    assert sleeps == pytest.approx([0.25, 0.5])
+
+
+def test_rate_is_chosen_per_call_without_touching_other_limiters(securitytrails, monkeypatch):
+    limiters = {}
+    monkeypatch.setattr(app, 'get_securitytrails_limiter', lambda key_id, rate: limiters.setdefault((key_id, rate), app.RateLimiter(1000)))
+    monkeypatch.setattr(app.session, 'request', lambda *args, **kwargs: FakeResponse(200))
+    app.securitytrails_request('GET', 'https://api.securitytrails.com/v1/x', 'key')
+    app.securitytrails_request('GET', 'https://api.securitytrails.com/v1/x', 'key', rate=app.SECURITYTRAILS_FAST_RPS)
+    app.securitytrails_request('GET', 'https://api.securitytrails.com/v1/x', 'other')
+    # 高速送信を選んだセッションがあっても、既定の送信上限で送る側のリミッターは共有も変更もされない
+    key_id = app.SecurityTrailsLedger._key_id
+    assert set(limiters) == {(key_id('key'), app.SECURITYTRAILS_MAX_RPS), (key_id('key'), app.SECURITYTRAILS_FAST_RPS),
+                             (key_id('other'), app.SECURITYTRAILS_MAX_RPS)}
+
+
+def test_requests_after_exhaustion_are_not_sent_or_charged(securitytrails, monkeypatch):
+    sent = []
+    monkeypatch.setattr(app.session, 'request', lambda *args, **kwargs: sent.append(args) or FakeResponse(429))
+    response = app.securitytrails_request('GET', 'https://api.securitytrails.com/v1/x', 'key')
+    assert response.status_code == 429 and securitytrails.is_exhausted('key')
+    with pytest.raises(app.SecurityTrailsAborted):
+        app.securitytrails_request('GET', 'https://api.securitytrails.com/v1/x', 'key')
+    assert len(sent) == 1 and securitytrails.calls_this_month('key') == 1
+
+
+def test_pagination_keeps_only_the_contiguous_prefix(securitytrails, monkeypatch):
+    def fake_request(method, url, timeout=10, json=None, **kwargs):
+        page = json.get('page', 1)
+        if page == 4:
+            return FakeResponse(429)
+        return FakeResponse(200, {'records': [{'hostname': f'host{page}'}], 'meta': {'total_pages': 8}})
+    monkeypatch.setattr(app.session, 'request', fake_request)
+
+    data = app.get_securitytrails_reverse_ip('192.0.2.1', 'key', fetch_all=True)
+    assert data['error'] == 'rate_limit_during_pagination'
+    hostnames = [r['hostname'] for r in data['records']]
+    # 途中が欠けたページ以降は結果に含めない
+    assert hostnames == [f'host{page}' for page in range(1, data['pages_fetched'] + 1)]
+    assert data['pages_fetched'] <= 3
+    assert securitytrails.is_exhausted('key')
+
+
+def test_complete_pagination_is_cached(securitytrails, monkeypatch):
+    calls = []
+
+    def fake_request(method, url, timeout=10, json=None, **kwargs):
+        calls.append(json.get('page', 1))
+        return FakeResponse(200, {'records': [{'hostname': f'host{json.get("page", 1)}'}], 'meta': {'total_pages': 3}})
+    monkeypatch.setattr(app.session, 'request', fake_request)
+
+    data = app.get_securitytrails_reverse_ip('192.0.2.1', 'key', fetch_all=True)
+    assert [r['hostname'] for r in data['records']] == ['host1', 'host2', 'host3']
+    assert 'pages_fetched' not in data
+    assert app.get_securitytrails_reverse_ip('192.0.2.1', 'key', fetch_all=True) == data
+    assert sorted(calls) == [1, 2, 3]
+
+
+def test_public_mode_does_not_share_cached_responses_between_keys(securitytrails, monkeypatch):
+    calls = []
+
+    def fake_request(method, url, timeout=10, json=None, **kwargs):
+        calls.append(kwargs['headers']['APIKEY'])
+        return FakeResponse(200, {'records': [{'hostname': 'host1'}], 'meta': {'total_pages': 1}})
+    monkeypatch.setattr(app.session, 'request', fake_request)
+    monkeypatch.setattr(app, 'IS_PUBLIC_MODE', True)
+
+    app.get_securitytrails_reverse_ip('192.0.2.1', 'key-a')
+    app.get_securitytrails_reverse_ip('192.0.2.1', 'key-a')
+    # 別の利用者のキーでは、先の利用者が取得した応答を返さずに自分のキーで照会する
+    app.get_securitytrails_reverse_ip('192.0.2.1', 'key-b')
+    assert calls == ['key-a', 'key-b']
+    assert 'key-a' not in app.securitytrails_reverse_key('192.0.2.1', False, 'key-a')
+
+    monkeypatch.setattr(app, 'IS_PUBLIC_MODE', False)
+    assert app.securitytrails_reverse_key('192.0.2.1', False, 'key-a') == app.securitytrails_reverse_key('192.0.2.1', False, 'key-b')
@@ -0,0 +1,86 @@
+import ipaddress
+import time
+
+import pytest
+import streamlit as st
+
+import WhoisApp as app
+
+
+SESSION_KEYS = ('raw_results', 'detailed_data', 'targets_cache', 'finished_ips', 'deferred_ips', 'cidr_cache',
+                'learned_proxy_isps', 'triage', 'recovery_journal', 'search_progress', 'is_searching', 'cancel_search')
+
+CLOUD = {'v4': [(int(ipaddress.ip_address('203.0.113.0')), int(ipaddress.ip_address('203.0.113.255')), 'AWS')], 'v6': []}
+
+
+def row(ip, isp='Example Telecom', country='JP', status='Success (IPinfo)'):
+    return {'Target_IP': ip, 'Status': status, 'ISP': isp, 'ISP_API_Raw': isp, 'CountryCode': country}
+
+
+@pytest.fixture
+def session():
+    rows = [
+        row('192.0.2.1'),
+        row('192.0.2.2', isp='N/A'),
+        row('192.0.2.3', country='US'),
+        row('192.0.2.4', isp='Example Hosting Ltd'),
+        row('198.51.100.1'),
+        row('203.0.113.5'),
+        row('192.0.2.9', isp='N/A', status='Error: timeout'),
+    ]
+    st.session_state['raw_results'] = app.ResultStore(rows)
+    st.session_state['detailed_data'] = app.DetailStore()
+    st.session_state['targets_cache'] = [r['Target_IP'] for r in rows]
+    st.session_state['finished_ips'] = {r['Target_IP'] for r in rows}
+    st.session_state['deferred_ips'] = {}
+    st.session_state['cidr_cache'] = {}
+    st.session_state['learned_proxy_isps'] = {}
+    st.session_state['triage'] = {'phase': 1, 'targets': set()}
+    yield st.session_state
+    for key in SESSION_KEYS:
+        st.session_state.pop(key, None)
+
+
+def test_selects_targets_by_trigger_signals(session):
+    selected = app.select_triage_targets({'198.51.100.1'}, CLOUD, ['tor', 'cloud', 'hosting', 'unknown_isp'])
+    # 失敗した行 (192.0.2.9) と、シグナルのない行・条件外の海外判定のみの行は選ばない
+    assert selected == ['192.0.2.2', '192.0.2.4', '198.51.100.1', '203.0.113.5']
+    assert app.select_triage_targets(set(), None, ['foreign']) == ['192.0.2.3']
+
+
+def test_hosting_signal_reads_ipinfo_asn_type_from_detail_store(session):
+    session['detailed_data']['192.0.2.1'] = {'IPINFO_JSON': {'asn': {'type': 'hosting'}}}
+    assert app.select_triage_targets(set(), None, ['hosting']) == ['192.0.2.1', '192.0.2.4']
+
+
+def test_start_deep_phase_requeues_only_selected_targets(session):
+    cursor = app.get_journal_cursor()
+    cursor['records'] = 12
+    app.start_deep_phase(['192.0.2.2', '203.0.113.5'])
+
+    assert session['triage'] == {'phase': 2, 'targets': {'192.0.2.2', '203.0.113.5'}}
+    remaining = [r['Target_IP'] for r in session['raw_results']]
+    assert remaining == ['192.0.2.1', '192.0.2.3', '192.0.2.4', '198.51.100.1', '192.0.2.9']
+    assert isinstance(session['raw_results'], app.ResultStore)
+    assert session['finished_ips'] == set(remaining)
+    assert session['search_progress']['completed'] == len(remaining)
+    # 結果リストが縮んだため、次回のチェックポイントではジャーナルを書き直す
+    assert app.get_journal_cursor()['records'] == 0
+    assert session['is_searching'] and not session['cancel_search']
+
+
+def test_start_deep_phase_without_targets_only_switches_phase(session):
+    app.start_deep_phase([])
+    assert session['triage'] == {'phase': 2, 'targets': set()}
+    assert len(session['raw_results']) == 7 and len(session['finished_ips']) == 7
+
+
+def test_phase_one_results_are_not_written_to_cidr_cache(session):
+    entry = {'198.18.0.0/24': dict(row('198.18.0.1'), Timestamp=time.time())}
+    progress = app.init_progress_counters()
+    app.apply_worker_result((row('198.18.0.1'), entry, None), progress)
+    assert session['cidr_cache'] == {} and app.get_journal_cursor()['cache'] == {}
+
+    session['triage'] = {'phase': 2, 'targets': {'198.18.0.2'}}
+    app.apply_worker_result((row('198.18.0.2'), entry, None), progress)
+    assert session['cidr_cache'] == entry and app.get_journal_cursor()['cache'] == entry